@@ -0,0 +1,82 @@
+"""Deterministic synthetic data for the benchmarks: Shopify products.json payloads and product-shot images."""
+import random
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image
+
+PRODUCT_TYPES = ['T-Shirt', 'Hoodie', 'Jeans', 'Dress', 'Jacket', 'Sneakers', 'Boots', 'Cap', 'Skirt', 'Shirt']
+MATERIALS = ['cotton', 'linen', 'wool', 'denim', 'leather', 'polyester', 'cashmere', 'silk']
+COLOURS = ['black', 'white', 'navy', 'olive', 'beige', 'burgundy', 'grey', 'sky blue']
+SIZES = ['XS', 'S', 'M', 'L', 'XL', 'XXL']
+VENDORS = [f'Vendor {i}' for i in range(20)]
+
+
+def shopify_products_json(n_products: int = 1000, seed: int = 0) -> dict:
+    """Builds a products.json payload shaped like Shopify's, with 1-6 size variants and 1-5 images per product."""
+    rng = random.Random(seed)
+    products = []
+    for i in range(n_products):
+        product_id = 7000000000000 + i
+        sizes = SIZES[:rng.randint(1, len(SIZES))]
+        material = rng.choice(MATERIALS)
+        colour = rng.choice(COLOURS)
+        product_type = rng.choice(PRODUCT_TYPES)
+        title = f'{colour.title()} {material.title()} {product_type} {i}'
+        products.append({
+            'id': product_id,
+            'title': title,
+            'handle': title.lower().replace(' ', '-'),
+            'body_html': f'<p>A relaxed {product_type.lower()} in soft {material}.</p>'
+                         f'<ul><li>Colour: {colour}</li><li>Machine washable</li></ul>' * rng.randint(1, 4),
+            'published_at': '2024-05-01T10:00:00+01:00',
+            'created_at': '2024-04-30T09:00:00+01:00',
+            'updated_at': '2024-06-01T12:00:00+01:00',
+            'vendor': rng.choice(VENDORS),
+            'product_type': product_type,
+            'tags': [material, colour, product_type.lower(), f'collection-{rng.randint(1, 30)}'],
+            'variants': [{
+                'id': product_id * 10 + v,
+                'title': size,
+                'sku': f'SKU-{i}-{size}',
+                'price': f'{rng.uniform(10, 300):.2f}',
+                'grams': rng.randint(100, 2000),
+                'available': rng.random() > 0.2,
+                'requires_shipping': True,
+                'taxable': True,
+                'featured_image': None,
+                'position': v + 1,
+            } for v, size in enumerate(sizes)],
+            'images': [{'src': f'https://cdn.shopify.com/s/files/1/0000/0001/files/{product_id}_{k}.jpg?v=1'}
+                       for k in range(rng.randint(1, 5))],
+            'options': [{'name': 'Size', 'values': sizes}],
+        })
+    return {'products': products}
+
+
+def product_image(seed: int = 0, size: int = 800) -> Image.Image:
+    """A product-shot-like image: a garment-shaped block of colour with fabric texture on a light background."""
+    rng = np.random.default_rng(seed)
+    background = rng.integers(225, 256)
+    image = np.full((size, size, 3), background, dtype=np.uint8)
+    colour = tuple(int(c) for c in rng.integers(0, 256, 3))
+    centre = (size // 2 + int(rng.integers(-size // 10, size // 10)), size // 2)
+    cv2.ellipse(image, centre, (size // 3, int(size // 2.4)), 0, 0, 360, colour, -1)
+    cv2.rectangle(image, (size // 8, size // 4), (7 * size // 8, size // 2), colour, -1)
+    if rng.random() > 0.5:
+        accent = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.rectangle(image, (size // 3, size // 3), (2 * size // 3, 5 * size // 8), accent, -1)
+    texture = rng.normal(0, 8, image.shape)
+    image = np.clip(image.astype(np.float32) + texture, 0, 255).astype(np.uint8)
+    return Image.fromarray(image)
+
+
+def image_corpus(n_images: int = 20, size: int = 800, seed: int = 0) -> list:
+    """JPEG-encoded product images, as they would arrive from the CDN."""
+    corpus = []
+    for i in range(n_images):
+        buffer = BytesIO()
+        product_image(seed + i, size).save(buffer, format='JPEG', quality=90)
+        corpus.append(buffer.getvalue())
+    return corpus
@@ -0,0 +1,326 @@
+"""Reproducible benchmarks for catalogue parsing, database load and the image models.
+
+Everything runs on synthetic fixtures (benchmarks/fixtures.py) with fixed seeds, so two runs on the same machine
+are comparable and a result can be diffed against one from another commit.
+
+Run from the repository root:
+
+    python -m benchmarks.run_benchmarks                        # all benchmarks, default sizes
+    python -m benchmarks.run_benchmarks --only parse,select     # a subset
+    python -m benchmarks.run_benchmarks --compare benchmarks/results/<baseline>.json
+
+Results are written to benchmarks/results/<timestamp>_<commit>.json.
+
+Database benchmarks use a local Postgres when TASC_BENCH_PG_HOST is set (also TASC_BENCH_PG_PORT, TASC_BENCH_PG_DB,
+TASC_BENCH_PG_USER, TASC_BENCH_PG_PASSWORD, TASC_BENCH_PG_SCHEMA), in which case insert_df and upsert_df are
+measured against a scratch copy of tasc_products_shopify. Otherwise they fall back to a SQLite file: select_df is
+measured the same way, and inserts are measured with pandas to_sql as a baseline, since insert_df (COPY) and
+upsert_df are Postgres-only.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from io import BytesIO
+
+import numpy as np
+
+from benchmarks.fixtures import image_corpus, shopify_products_json
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+DDL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tasc_core', 'data_products',
+                        'table', 'create', 'create_tasc_products_shopify.sql')
+BENCHMARKS = ['parse', 'insert', 'upsert', 'select', 'colours', 'background']
+
+
+def _throughput(fn, items: int, repeat: int = 3) -> dict:
+    """Runs fn `repeat` times and reports the best run, which is the least affected by machine noise."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return {'items': items, 'best_seconds': round(best, 4), 'mean_seconds': round(float(np.mean(timings)), 4),
+            'items_per_sec': round(items / best, 2)}
+
+
+def _latency(fn, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {'runs': repeat, 'p50_ms': round(float(np.percentile(timings, 50)), 3),
+            'p95_ms': round(float(np.percentile(timings, 95)), 3), 'max_ms': round(max(timings), 3)}
+
+
+def _products_dataframe(n_products: int):
+    from tasc_core.utils.util_shopify_product_parser import ShopifyProductParser
+
+    parser = ShopifyProductParser(url=None)
+    parser.json_data = shopify_products_json(n_products)
+    return parser.to_dataframe()
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Database targets
+# ---------------------------------------------------------------------------------------------------------------------
+
+class PostgresTarget:
+    backend = 'postgres'
+    supports_upsert = True
+
+    def __init__(self) -> None:
+        from tasc_core.utils.util_nebuladb import NebulaConnector
+
+        self.schema = os.getenv('TASC_BENCH_PG_SCHEMA', 'public')
+        self.table = 'tasc_bench_products_shopify'
+        self.db = NebulaConnector(host=os.getenv('TASC_BENCH_PG_HOST'), port=os.getenv('TASC_BENCH_PG_PORT', '5432'),
+                                  database=os.getenv('TASC_BENCH_PG_DB', 'postgres'),
+                                  username=os.getenv('TASC_BENCH_PG_USER', 'postgres'),
+                                  password=os.getenv('TASC_BENCH_PG_PASSWORD', ''))
+
+    def reset(self) -> None:
+        with open(DDL_PATH) as f:
+            ddl = f.read().replace('tasc_prod.tasc_products_shopify', f'{self.schema}.{self.table}')
+        self.db.execute_query(ddl)
+
+    def insert(self, df) -> None:
+        self.db.insert_df(self.schema, self.table, df)
+
+    def upsert(self, df) -> dict:
+        return self.db.upsert_df(self.table, self.schema, df, conflict_columns=['child_product_id'])
+
+    def select(self, query: str):
+        return self.db.select_df(query.format(table=f'{self.schema}.{self.table}'))
+
+
+class SqliteTarget:
+    backend = 'sqlite'
+    # upsert_df (INSERT ... ON CONFLICT through COPY into a temp table) is Postgres-only
+    supports_upsert = False
+
+    def __init__(self) -> None:
+        from tasc_core.utils.util_db_connector import DbConnector
+
+        self.path = os.path.join(tempfile.mkdtemp(prefix='tasc_bench_'), 'bench.sqlite')
+        self.table = 'tasc_bench_products_shopify'
+        self.db = DbConnector('sqlite', host=None, database=self.path, port=None)
+
+    def reset(self) -> None:
+        self.db.execute_query(f'DROP TABLE IF EXISTS {self.table}')
+
+    def insert(self, df) -> None:
+        df.to_sql(self.table, self.db.engine, if_exists='append', index=False, chunksize=1000)
+
+    def select(self, query: str):
+        return self.db.select_df(query.format(table=self.table))
+
+
+def _db_target():
+    return PostgresTarget() if os.getenv('TASC_BENCH_PG_HOST') else SqliteTarget()
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Benchmarks
+# ---------------------------------------------------------------------------------------------------------------------
+
+def bench_parse(args) -> dict:
+    """ShopifyProductParser.parse_products + to_dataframe on a synthetic products.json."""
+    from tasc_core.utils.util_shopify_product_parser import ShopifyProductParser
+
+    payload = shopify_products_json(args.products)
+    parser = ShopifyProductParser(url=None)
+    parser.json_data = payload
+    rows = len(parser.parse_products())
+    result = _throughput(parser.to_dataframe, rows)
+    result['products'] = args.products
+    result['products_per_sec'] = round(args.products / result['best_seconds'], 2)
+    return result
+
+
+def bench_insert(args) -> dict:
+    target = _db_target()
+    df = _products_dataframe(args.products)
+
+    def _run():
+        target.reset()
+        target.insert(df)
+    _run()
+    result = _throughput(_run, len(df))
+    result['backend'] = target.backend
+    result['method'] = 'insert_df' if target.backend == 'postgres' else 'pandas.to_sql'
+    result['rows_per_sec'] = result.pop('items_per_sec')
+    return result
+
+
+def bench_upsert(args) -> dict:
+    target = _db_target()
+    if not target.supports_upsert:
+        return {'skipped': f'upsert_df is Postgres-only, not available on {target.backend}; '
+                           'set TASC_BENCH_PG_HOST to benchmark it'}
+    df = _products_dataframe(args.products)
+    target.reset()
+    target.insert(df)
+    sample = df.head(args.upsert_rows)
+    result = _throughput(lambda: target.upsert(sample), len(sample), repeat=1)
+    result['backend'] = target.backend
+    result['rows_per_sec'] = result.pop('items_per_sec')
+
+    # a typical daily refresh: the same rows again with 5% of prices changed
+    refresh = sample.copy()
+    changed = refresh.sample(frac=0.05, random_state=0).index
+    refresh.loc[changed, 'price'] = (refresh.loc[changed, 'price'].astype(float) + 1).map('{:.2f}'.format)
+    counts = {}
+    refresh_result = _throughput(lambda: counts.update(target.upsert(refresh)), len(refresh), repeat=1)
+    refresh_result['rows_per_sec'] = refresh_result.pop('items_per_sec')
+    refresh_result.update(counts)
+    result['refresh_5pct_changed'] = refresh_result
+    return result
+
+
+def bench_select(args) -> dict:
+    target = _db_target()
+    df = _products_dataframe(args.products)
+    target.reset()
+    target.insert(df)
+    vendor = df['vendor'].iloc[0]
+    queries = {
+        'point': "SELECT * FROM {table} WHERE child_product_id = '%s'" % df['child_product_id'].iloc[0],
+        'vendor': "SELECT * FROM {table} WHERE vendor = '%s'" % vendor,
+        'full_scan': 'SELECT parent_product_id, product_title, price FROM {table}',
+    }
+    result = {'backend': target.backend, 'rows_in_table': len(df)}
+    for name, query in queries.items():
+        target.select(query)
+        result[name] = _latency(lambda: target.select(query), args.select_runs)
+    return result
+
+
+def bench_colours(args) -> dict:
+    """ImageProcessor.extract_colors on decoded images (network excluded)."""
+    from PIL import Image
+
+    from tasc_core.models.image_recognition.image_colour_recognition_model import ImageProcessor
+
+    processor = ImageProcessor(random_state=0)
+    images = [Image.open(BytesIO(data)).convert('RGB') for data in image_corpus(args.images, args.image_size)]
+
+    def _run():
+        for image in images:
+            processor.extract_colors(image=image)
+    result = _throughput(_run, len(images), repeat=1)
+    result['images_per_sec'] = result.pop('items_per_sec')
+    result['image_size'] = args.image_size
+    return result
+
+
+def bench_background(args) -> dict:
+    """remove_bg_bytes on JPEG bytes, after one warm-up call that loads the model."""
+    from tasc_core.models.image_recognition.image_background_removal_model import remove_bg_bytes
+
+    corpus = image_corpus(args.images, args.image_size)
+    remove_bg_bytes(corpus[0])
+
+    def _run():
+        for data in corpus:
+            remove_bg_bytes(data)
+    result = _throughput(_run, len(corpus), repeat=1)
+    result['images_per_sec'] = result.pop('items_per_sec')
+    result['image_size'] = args.image_size
+    return result
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Results
+# ---------------------------------------------------------------------------------------------------------------------
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       text=True).strip()
+    except Exception:
+        return 'unknown'
+
+
+def _flatten(results: dict, prefix: str = '') -> dict:
+    flat = {}
+    for name, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f'{prefix}{name}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f'{prefix}{name}'] = value
+    return flat
+
+
+def compare(baseline: dict, current: dict) -> None:
+    """Prints the change of every rate and latency metric between two result files."""
+    before, after = _flatten(baseline['results']), _flatten(current['results'])
+    print(f"\n{'metric':<45} {baseline['commit']:>12} {current['commit']:>12} {'change':>9}")
+    for name in sorted(set(before) & set(after)):
+        higher_is_better = name.endswith('_per_sec')
+        if not (higher_is_better or name.endswith('_ms') or name.endswith('best_seconds')):
+            continue
+        if not before[name]:
+            continue
+        change = (after[name] - before[name]) / before[name]
+        better = change > 0 if higher_is_better else change < 0
+        flag = '' if abs(change) < 0.05 else (' better' if better else ' WORSE')
+        print(f'{name:<45} {before[name]:>12} {after[name]:>12} {change:>+8.1%}{flag}')
+
+
+def main(argv: list = None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', help=f"comma-separated subset of: {', '.join(BENCHMARKS)}")
+    parser.add_argument('--products', type=int, default=2000, help='synthetic products for parse and DB benchmarks')
+    parser.add_argument('--upsert-rows', type=int, default=200, help='rows sent through upsert_df')
+    parser.add_argument('--select-runs', type=int, default=50, help='repetitions per select_df query')
+    parser.add_argument('--images', type=int, default=5, help='synthetic images for the image model benchmarks')
+    parser.add_argument('--image-size', type=int, default=800, help='side of the synthetic images in pixels')
+    parser.add_argument('--out', default=RESULTS_DIR, help='directory the result JSON is written to')
+    parser.add_argument('--compare', help='result JSON to compare this run against')
+    args = parser.parse_args(argv)
+
+    selected = args.only.split(',') if args.only else BENCHMARKS
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    results = {}
+    for name in selected:
+        print(f'Running {name}...', flush=True)
+        try:
+            results[name] = globals()[f'bench_{name}'](args)
+        except Exception as e:
+            results[name] = {'error': f'{type(e).__name__}: {e}'}
+        print(f'  {json.dumps(results[name])}')
+
+    report = {
+        'commit': _git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'parameters': {k: v for k, v in vars(args).items() if k not in ('out', 'compare')},
+        'results': results,
+    }
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{datetime.now().strftime('%Y%m%dT%H%M%S')}_{report['commit']}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {path}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+    return report
+
+
+if __name__ == '__main__':
+    main()
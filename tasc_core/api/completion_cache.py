@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class CompletionCache:
+    """Two-level cache for LLM completions: an in-memory LRU in front of an optional on-disk SQLite store.
+
+    Entries are keyed on a canonical hash of the request (model, messages, temperature, max_tokens and any other
+    request fields), expire after `ttl_seconds`, and are evicted least-recently-used once the memory tier holds
+    `max_memory_entries` or the disk tier exceeds `max_disk_bytes`. Requests with temperature > 0 are not cached
+    unless `cache_nondeterministic` is set, since callers asking for sampling usually want a fresh answer.
+
+    Example:
+        cache = CompletionCache(path="data/processed/completions.sqlite", ttl_seconds=7 * 24 * 3600)
+        client = OpenAIClient(api_key, cache=cache)
+        client.generate_completion("What colours go with navy?", temperature=0)
+        print(cache.metrics())
+    """
+
+    def __init__(self, path: str = None, ttl_seconds: float = 24 * 3600, max_memory_entries: int = 1024,
+                 max_disk_bytes: int = 256 * 1024 * 1024, cache_nondeterministic: bool = False) -> None:
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.cache_nondeterministic = cache_nondeterministic
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._disk_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.latency_saved = 0.0
+        if path:
+            self._open_disk()
+
+    def _open_disk(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                value TEXT,
+                expires_at REAL,
+                latency REAL,
+                size INTEGER,
+                last_access REAL
+            )""")
+        self._conn.execute('CREATE INDEX IF NOT EXISTS completions_last_access ON completions (last_access)')
+        self._conn.execute('DELETE FROM completions WHERE expires_at < ?', (time.time(),))
+        self._disk_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM completions').fetchone()[0]
+
+    @staticmethod
+    def make_key(**request) -> str:
+        """Canonical SHA-256 of a request. Key order and whitespace in the request do not change the hash."""
+        canonical = json.dumps(request, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def should_cache(self, temperature: float) -> bool:
+        if temperature is not None and temperature > 0 and not self.cache_nondeterministic:
+            with self._lock:
+                self.bypassed += 1
+            return False
+        return True
+
+    def get(self, key: str):
+        """Returns the cached completion for `key`, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, expires_at, latency = entry
+                if expires_at >= now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    self.latency_saved += latency
+                    return value
+                del self._memory[key]
+
+            if self._conn is not None:
+                row = self._conn.execute('SELECT value, expires_at, latency FROM completions WHERE key = ?',
+                                         (key,)).fetchone()
+                if row is not None and row[1] >= now:
+                    self._conn.execute('UPDATE completions SET last_access = ? WHERE key = ?', (now, key))
+                    self._remember(key, row[0], row[1], row[2])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    self.latency_saved += row[2]
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: str, latency: float = 0.0) -> None:
+        """Stores a completion along with the latency of the call that produced it."""
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        with self._lock:
+            self._remember(key, value, expires_at, latency)
+            if self._conn is not None:
+                size = len(value.encode('utf-8')) + len(key)
+                previous = self._conn.execute('SELECT size FROM completions WHERE key = ?', (key,)).fetchone()
+                self._conn.execute('INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?, ?)',
+                                   (key, value, expires_at, latency, size, now))
+                self._disk_bytes += size - (previous[0] if previous else 0)
+                if self._disk_bytes > self.max_disk_bytes:
+                    self._evict_disk()
+
+    def _remember(self, key, value, expires_at, latency) -> None:
+        self._memory[key] = (value, expires_at, latency)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self) -> None:
+        # drop expired rows first, then least recently used rows until the store is back under 90% of its budget
+        self._conn.execute('DELETE FROM completions WHERE expires_at < ?', (time.time(),))
+        self._disk_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM completions').fetchone()[0]
+        target = int(self.max_disk_bytes * 0.9)
+        for key, size in self._conn.execute('SELECT key, size FROM completions ORDER BY last_access').fetchall():
+            if self._disk_bytes <= target:
+                break
+            self._conn.execute('DELETE FROM completions WHERE key = ?', (key,))
+            self._memory.pop(key, None)
+            self._disk_bytes -= size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute('DELETE FROM completions')
+                self._disk_bytes = 0
+
+    def metrics(self) -> dict:
+        """Hit rate and latency saved since the cache was created."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'bypassed': self.bypassed,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'latency_saved_seconds': round(self.latency_saved, 3),
+                'memory_entries': len(self._memory),
+                'disk_bytes': self._disk_bytes,
+            }
@@ -0,0 +1,131 @@
+try:
+    import tiktoken
+except ImportError:  # token counts fall back to a character heuristic
+    tiktoken = None
+
+# Per-message framing overhead of the chat format, in tokens
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class ConversationManager:
+    """Keeps a chat history under a token budget so each turn's request size stays flat.
+
+    Token counts are computed once per message when it is added and kept alongside it, so checking the budget is
+    O(1) per turn. When the history goes over `max_history_tokens`, the oldest turns are either dropped or, if a
+    `summarise` callable is given, folded into a single running summary message. System messages are always kept.
+    The manager owns its message list; callers get copies and their own lists are never mutated.
+
+    Example:
+        conversation = ConversationManager(max_history_tokens=2000, system_prompt="You are a stylist.")
+        reply = client.generate_completion("What goes with navy chinos?", conversation=conversation)
+        reply = client.generate_completion("And for shoes?", conversation=conversation)
+    """
+
+    def __init__(self, max_history_tokens: int = 3000, model: str = "gpt-4", system_prompt: str = None,
+                 history: list = None, summarise=None, keep_last_turns: int = 2) -> None:
+        """
+        :param max_history_tokens: Budget for the history sent with each request, excluding the new prompt.
+        :param model: Model name used to pick the tokenizer.
+        :param system_prompt: A system message kept at the top of every request (optional).
+        :param history: Existing messages to start from; the list is copied (optional).
+        :param summarise: Callable taking a list of messages and returning a summary string (optional).
+        :param keep_last_turns: Most recent user/assistant exchanges never trimmed or summarised (default: 2).
+        """
+        self.max_history_tokens = max_history_tokens
+        self.summarise = summarise
+        self.keep_last_turns = keep_last_turns
+        self._encoder = None
+        if tiktoken is not None:
+            try:
+                self._encoder = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self._encoder = tiktoken.get_encoding("cl100k_base")
+        self.messages = []
+        self.token_counts = []
+        self.total_tokens = 0
+        self.summary = None
+        if system_prompt:
+            self.append({"role": "system", "content": system_prompt})
+        for message in history or []:
+            self.append(dict(message))
+
+    def count_tokens(self, text: str) -> int:
+        if self._encoder is not None:
+            return len(self._encoder.encode(text or ""))
+        return len(text or "") // 4 + 1
+
+    def _message_tokens(self, message: dict) -> int:
+        return self.count_tokens(str(message.get("content", ""))) + MESSAGE_OVERHEAD_TOKENS
+
+    def append(self, message: dict) -> None:
+        tokens = self._message_tokens(message)
+        self.messages.append(message)
+        self.token_counts.append(tokens)
+        self.total_tokens += tokens
+
+    def _pop(self, index: int) -> dict:
+        self.total_tokens -= self.token_counts.pop(index)
+        return self.messages.pop(index)
+
+    def prepare(self, prompt: str) -> list:
+        """Returns a new list of messages for a request: the (compacted) history followed by the user prompt."""
+        self.compact()
+        return [dict(message) for message in self.messages] + [{"role": "user", "content": prompt}]
+
+    def record(self, prompt: str, reply: str) -> None:
+        """Adds a completed exchange to the history."""
+        self.append({"role": "user", "content": prompt})
+        self.append({"role": "assistant", "content": reply})
+
+    def _trimmable(self) -> list:
+        """Indexes of non-system messages older than the protected most recent turns."""
+        turns = [i for i, message in enumerate(self.messages) if message.get("role") != "system"]
+        protected = self.keep_last_turns * 2
+        return turns[:-protected] if protected else turns
+
+    def compact(self) -> None:
+        """Trims or summarises the oldest turns until the history fits in max_history_tokens."""
+        if self.total_tokens <= self.max_history_tokens:
+            return None
+
+        candidates = self._trimmable()
+        dropped = []
+        excess = self.total_tokens - self.max_history_tokens
+        for index in candidates:
+            if excess <= 0:
+                break
+            dropped.append(index)
+            excess -= self.token_counts[index]
+        if not dropped:
+            return None
+
+        removed = [self._pop(index) for index in reversed(dropped)][::-1]
+        if self.summarise is None:
+            return None
+
+        if self.summary is not None:
+            summary_index = self.messages.index(self.summary)
+            removed.insert(0, self._pop(summary_index))
+        try:
+            text = self.summarise(removed)
+        except Exception as e:
+            print(f"Could not summarise conversation history, dropping it instead: {e}")
+            self.summary = None
+            return None
+
+        self.summary = {"role": "system", "content": f"Summary of the earlier conversation: {text}"}
+        tokens = self._message_tokens(self.summary)
+        position = sum(1 for message in self.messages if message.get("role") == "system")
+        self.messages.insert(position, self.summary)
+        self.token_counts.insert(position, tokens)
+        self.total_tokens += tokens
+
+
+def llm_summariser(client, model: str = "gpt-4", max_tokens: int = 200):
+    """Builds a `summarise` callable for ConversationManager that asks the model for a short recap."""
+    def _summarise(messages: list) -> str:
+        transcript = "\n".join(f"{m.get('role')}: {m.get('content')}" for m in messages)
+        prompt = ("Summarise this styling conversation in a few sentences, keeping the user's preferences, "
+                  f"sizes, budget and any items already recommended:\n\n{transcript}")
+        return client.generate_completion(prompt, model=model, temperature=0, max_tokens=max_tokens)
+    return _summarise
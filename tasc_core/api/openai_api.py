@@ -1,9 +1,18 @@
 import openai
 import os
-import requests
+import time
+import base64
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 from io import BytesIO
 from dotenv import load_dotenv
+from tasc_core.api.completion_cache import CompletionCache
+from tasc_core.api.conversation import ConversationManager
+from tasc_core.api.rate_limiter import RateLimiter, backoff_delay
+from tasc_core.utils import util_metrics as metrics
+from tasc_core.utils.util_http import get_transport
 
 # Load environment variables from .env file
 load_dotenv()
@@ -11,90 +20,313 @@ load_dotenv()
 # Set your OpenAI API key
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
+# Number of downloaded images and encoded data URLs kept per client
+IMAGE_CACHE_SIZE = 128
+
+# Token cost of one low-detail image part, used for rate limiting estimates
+IMAGE_PART_TOKENS = 85
+
+# HTTP statuses worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
 class OpenAIClient:
-    def __init__(self, api_key: str, organization_id: str = None, project_id: str = None):
+    def __init__(self, api_key: str, organization_id: str = None, project_id: str = None,
+                 cache: CompletionCache = None, rate_limiter: RateLimiter = None, api_base: str = None,
+                 max_retries: int = 5, request_timeout: float = 60):
         """
         Initializes the OpenAI client with the given API key, organization, and project.
 
         :param api_key: The API key for OpenAI.
         :param organization_id: The organization ID (optional).
         :param project_id: The project ID (optional).
+        :param cache: A CompletionCache used for non-streaming completions (optional).
+        :param rate_limiter: A RateLimiter shared by every request made through this client (optional).
+        :param api_base: Base URL of the API, e.g. a local mock server "http://127.0.0.1:8000/v1" (optional).
+        :param max_retries: Retries on 429/5xx and connection errors, with jittered backoff (default: 5).
+        :param request_timeout: Per-request timeout in seconds (default: 60).
         """
         openai.api_key = api_key
         if organization_id:
             openai.organization = organization_id
         if project_id:
             openai.project = project_id
+        self.api_key = api_key
+        self.organization_id = organization_id
+        self.api_base = api_base
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.request_timeout = request_timeout
+        self._image_bytes = OrderedDict()
+        self._data_urls = {}
+        self._image_lock = threading.Lock()
 
-    def generate_completion(self, prompt: str, model: str = "gpt-4", temperature: float = 0.7, chat_history: list = None):
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        if isinstance(error, (openai.error.RateLimitError, openai.error.ServiceUnavailableError,
+                              openai.error.Timeout, openai.error.APIConnectionError, openai.error.TryAgain)):
+            return True
+        return getattr(error, 'http_status', None) in RETRYABLE_STATUSES
+
+    @staticmethod
+    def _estimate_tokens(messages: list, max_tokens: int) -> int:
+        # roughly 4 characters per token, plus the completion budget; image parts are billed per tile
+        tokens = max_tokens or 0
+        for message in messages:
+            content = message.get("content", "")
+            if isinstance(content, list):
+                for part in content:
+                    tokens += len(part.get("text", "")) // 4 if part.get("type") == "text" else IMAGE_PART_TOKENS
+            else:
+                tokens += len(str(content)) // 4
+        return tokens
+
+    def _create_chat_completion(self, **request):
         """
-        Sends a chat completion request to the OpenAI API.
+        Calls openai.ChatCompletion.create with this client's credentials, rate limits and retry policy.
 
-        :param prompt: The prompt text to send to the model.
-        :param model: The model to use (default: "gpt-4").
-        :param temperature: Sampling temperature (default: 0.7).
-        :param chat_history: List of dictionaries representing the chat history (optional).
+        :param request: Keyword arguments for ChatCompletion.create.
+        :return: The API response.
+        """
+        request.setdefault("api_key", self.api_key)
+        request.setdefault("request_timeout", self.request_timeout)
+        if self.organization_id:
+            request.setdefault("organization", self.organization_id)
+        if self.api_base:
+            request.setdefault("api_base", self.api_base)
+        estimated = self._estimate_tokens(request.get("messages", []), request.get("max_tokens"))
+
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(estimated)
+            try:
+                with metrics.timer(metrics.HTTP_SECONDS, target="openai"):
+                    response = openai.ChatCompletion.create(**request)
+            except Exception as e:
+                if attempt == self.max_retries or not self._is_retryable(e):
+                    raise
+                headers = getattr(e, 'headers', None) or {}
+                retry_after = headers.get('retry-after') or headers.get('Retry-After')
+                delay = float(retry_after) if retry_after else backoff_delay(attempt)
+                print(f"OpenAI request failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            if self.rate_limiter is not None and not request.get("stream"):
+                usage = getattr(response, 'usage', None)
+                self.rate_limiter.record_usage(estimated, usage.get('total_tokens') if usage else None)
+            return response
+
+    def _chat_completion(self, messages: list, model: str, temperature: float, max_tokens: int = 150,
+                         cache_extra: dict = None) -> str:
+        """
+        Runs a non-streaming chat completion, serving it from the cache when possible.
+
+        :param messages: The messages to send.
+        :param model: The model to use.
+        :param temperature: Sampling temperature.
+        :param max_tokens: Maximum tokens in the completion (default: 150).
+        :param cache_extra: Extra request fields that change the answer and must be part of the cache key.
         :return: The completion text.
         """
-        messages = chat_history if chat_history else []
-        messages.append({"role": "user", "content": prompt})
+        key = None
+        if self.cache is not None and self.cache.should_cache(temperature):
+            key = self.cache.make_key(model=model, messages=messages, temperature=temperature,
+                                      max_tokens=max_tokens, **(cache_extra or {}))
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
 
-        response = openai.ChatCompletion.create(
+        start = time.perf_counter()
+        response = self._create_chat_completion(
             model=model,
             messages=messages,
             temperature=temperature,
-            max_tokens=150
+            max_tokens=max_tokens
         )
-        return response.choices[0].message['content'].strip()
+        content = response.choices[0].message['content'].strip()
+        if key is not None:
+            self.cache.set(key, content, latency=time.perf_counter() - start)
+        return content
+
+    @staticmethod
+    def _build_messages(prompt: str, chat_history: list = None, conversation: ConversationManager = None) -> list:
+        """
+        Builds the request messages without mutating the caller's chat_history list.
+
+        :param prompt: The prompt text to send to the model.
+        :param chat_history: List of dictionaries representing the chat history (optional).
+        :param conversation: A ConversationManager that owns and compacts the history (optional).
+        :return: A new list of messages ending with the user prompt.
+        """
+        if conversation is not None:
+            return conversation.prepare(prompt)
+        messages = list(chat_history) if chat_history else []
+        messages.append({"role": "user", "content": prompt})
+        return messages
+
+    def generate_completion(self, prompt: str, model: str = "gpt-4", temperature: float = 0.7, chat_history: list = None,
+                            conversation: ConversationManager = None, max_tokens: int = 150):
+        """
+        Sends a chat completion request to the OpenAI API.
 
-    def generate_streaming_completion(self, prompt: str, model: str = "gpt-4", chat_history: list = None):
+        :param prompt: The prompt text to send to the model.
+        :param model: The model to use (default: "gpt-4").
+        :param temperature: Sampling temperature (default: 0.7).
+        :param chat_history: List of dictionaries representing the chat history (optional). It is not modified.
+        :param conversation: A ConversationManager to read history from and record this turn in (optional).
+        :param max_tokens: Maximum tokens in the completion (default: 150).
+        :return: The completion text.
+        """
+        messages = self._build_messages(prompt, chat_history, conversation)
+        content = self._chat_completion(messages, model, temperature, max_tokens)
+        if conversation is not None:
+            conversation.record(prompt, content)
+        return content
+
+    def generate_completions_batch(self, prompts: list, model: str = "gpt-4", temperature: float = 0.7,
+                                   max_tokens: int = 150, system_prompt: str = None, max_workers: int = 16,
+                                   return_exceptions: bool = False) -> list:
+        """
+        Runs many independent completions concurrently, respecting the client's rate limiter.
+
+        :param prompts: The prompt texts, one completion each.
+        :param model: The model to use (default: "gpt-4").
+        :param temperature: Sampling temperature (default: 0.7).
+        :param max_tokens: Maximum tokens per completion (default: 150).
+        :param system_prompt: A system message prepended to every prompt (optional).
+        :param max_workers: Number of requests in flight at once (default: 16).
+        :param return_exceptions: Put the exception in place of a failed result instead of raising (default: False).
+        :return: The completion texts, in the same order as prompts.
+        """
+        def _run(prompt):
+            messages = [{"role": "system", "content": system_prompt}] if system_prompt else []
+            messages.append({"role": "user", "content": prompt})
+            try:
+                return self._chat_completion(messages, model, temperature, max_tokens)
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                return e
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(_run, prompts))
+
+    def generate_streaming_completion(self, prompt: str, model: str = "gpt-4", chat_history: list = None,
+                                      conversation: ConversationManager = None):
         """
         Sends a completion request to the OpenAI API with streaming response.
 
         :param prompt: The prompt text to send to the model.
         :param model: The model to use (default: "gpt-4").
-        :param chat_history: List of dictionaries representing the chat history (optional).
+        :param chat_history: List of dictionaries representing the chat history (optional). It is not modified.
+        :param conversation: A ConversationManager to read history from; the full reply is recorded once the
+            stream finishes (optional).
         :return: Generator that streams the completion text.
         """
-        messages = chat_history if chat_history else []
-        messages.append({"role": "user", "content": prompt})
+        messages = self._build_messages(prompt, chat_history, conversation)
 
-        stream = openai.ChatCompletion.create(
+        stream = self._create_chat_completion(
             model=model,
             messages=messages,
             stream=True,
         )
+        parts = []
         for chunk in stream:
             if 'content' in chunk.choices[0].delta:
-                yield chunk.choices[0].delta['content']
+                parts.append(chunk.choices[0].delta['content'])
+                yield parts[-1]
+        if conversation is not None:
+            conversation.record(prompt, "".join(parts))
+
+    def _load_image_bytes(self, image_url: str) -> bytes:
+        """
+        Returns the raw bytes of an image URL or local path, reusing bytes fetched earlier by this client.
 
-    def generate_image_prompt(self, image_url: str, prompt: str, model: str = "gpt-4", temperature: float = 0.7):
+        :param image_url: An http(s) URL or a local file path.
+        :return: The encoded image bytes.
         """
-        Fetches an image from a URL and generates a prompt based on the image.
+        with self._image_lock:
+            if image_url in self._image_bytes:
+                self._image_bytes.move_to_end(image_url)
+                return self._image_bytes[image_url]
+
+        if image_url.startswith(("http://", "https://")):
+            data = get_transport().fetch_bytes(image_url, target="openai_image")
+        else:
+            with open(image_url, "rb") as f:
+                data = f.read()
 
-        :param image_url: The URL of the image.
+        with self._image_lock:
+            self._image_bytes[image_url] = data
+            while len(self._image_bytes) > IMAGE_CACHE_SIZE:
+                self._image_bytes.popitem(last=False)
+        return data
+
+    @staticmethod
+    def _downscale_to_data_url(data: bytes, max_side: int = 512, quality: int = 90) -> str:
+        """
+        Downscales an image so its longest side is at most max_side and re-encodes it as a base64 JPEG data URL.
+
+        Chroma subsampling is disabled so small garment colour patches keep their true colour after encoding.
+
+        :param data: The encoded image bytes.
+        :param max_side: Longest side in pixels after downscaling (default: 512).
+        :param quality: JPEG quality (default: 90).
+        :return: A data URL suitable for an image_url message part.
+        """
+        image = Image.open(BytesIO(data))
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+            image = Image.alpha_composite(background, image)
+        image = image.convert("RGB")
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        buffer = BytesIO()
+        image.save(buffer, format="JPEG", quality=quality, subsampling=0, optimize=True)
+        return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+    def generate_image_prompt(self, image_url: str, prompt: str, model: str = "gpt-4o", temperature: float = 0.7,
+                              detail: str = "low", max_side: int = 512, send_url: bool = True,
+                              max_tokens: int = 150):
+        """
+        Sends an image and a prompt to a vision-capable model.
+
+        Public http(s) URLs are sent as a URL reference so nothing is downloaded or uploaded client-side. Local
+        paths, or URLs with send_url=False (e.g. private or short-lived links), are downloaded once, downscaled
+        and sent inline as a compact JPEG.
+
+        :param image_url: The URL or local path of the image.
         :param prompt: The prompt text to send to the model.
-        :param model: The model to use (default: "gpt-4").
+        :param model: A vision-capable model (default: "gpt-4o").
         :param temperature: Sampling temperature (default: 0.7).
+        :param detail: Vision detail level, "low", "high" or "auto" (default: "low", a single 512px tile).
+        :param max_side: Longest side of inline images in pixels (default: 512).
+        :param send_url: Send http(s) URLs by reference instead of inlining the image (default: True).
+        :param max_tokens: Maximum tokens in the completion (default: 150).
         :return: The completion text.
         """
-        response = requests.get(image_url)
-        image = Image.open(BytesIO(response.content))
-
-        # Here you can add any image processing if needed
+        if send_url and image_url.startswith(("http://", "https://")):
+            image_ref = image_url
+        else:
+            cache_key = (image_url, max_side)
+            with self._image_lock:
+                image_ref = self._data_urls.get(cache_key)
+            if image_ref is None:
+                image_ref = self._downscale_to_data_url(self._load_image_bytes(image_url), max_side)
+                with self._image_lock:
+                    self._data_urls[cache_key] = image_ref
+                    while len(self._data_urls) > IMAGE_CACHE_SIZE:
+                        self._data_urls.pop(next(iter(self._data_urls)))
 
-        # Convert image to a format that can be sent to OpenAI (e.g., base64)
-        # For simplicity, we assume the image is already in a suitable format
-
-        # Generate prompt based on the image
-        messages = [{"role": "user", "content": prompt}]
-        response = openai.ChatCompletion.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=150
-        )
-        return response.choices[0].message['content'].strip()
+        messages = [{"role": "user", "content": [
+            {"type": "text", "text": prompt},
+            {"type": "image_url", "image_url": {"url": image_ref, "detail": detail}},
+        ]}]
+        return self._chat_completion(messages, model, temperature, max_tokens,
+                                     cache_extra={"image_url": image_url, "max_side": max_side})
 
 # Example Usage
 if __name__ == "__main__":
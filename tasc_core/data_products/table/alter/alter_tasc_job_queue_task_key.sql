@@ -0,0 +1,6 @@
+-- Migration for tasc_prod.tasc_job_queue tables created with UNIQUE (queue, job_key) (see create_tasc_job_queue.sql).
+-- Jobs are unique per task, so the same image_url can be queued for both 'colours' and 'remove_bg'.
+-- Safe to run more than once.
+ALTER TABLE tasc_prod.tasc_job_queue DROP CONSTRAINT IF EXISTS tasc_job_queue_queue_job_key_key;
+ALTER TABLE tasc_prod.tasc_job_queue DROP CONSTRAINT IF EXISTS tasc_job_queue_queue_task_job_key_key;
+ALTER TABLE tasc_prod.tasc_job_queue ADD CONSTRAINT tasc_job_queue_queue_task_job_key_key UNIQUE (queue, task, job_key);
@@ -0,0 +1,6 @@
+-- Migration for tasc_prod.tasc_products_shopify tables created before row_hash existed (see
+-- create_tasc_products_shopify.sql). Without row_hash, upsert_df(detect_changes=True) rewrites every row.
+-- Safe to run more than once.
+ALTER TABLE tasc_prod.tasc_products_shopify ADD COLUMN IF NOT EXISTS row_hash BIGINT;
+CREATE INDEX IF NOT EXISTS tasc_products_shopify_child_product_id_idx
+    ON tasc_prod.tasc_products_shopify (child_product_id);
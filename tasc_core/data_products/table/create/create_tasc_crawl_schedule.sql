@@ -0,0 +1,26 @@
+-- Per-partner crawl schedule kept by tasc_core/utils/util_crawl_scheduler.py: estimated catalogue change rate, the
+-- crawl interval derived from it and when the partner is next due.
+DROP TABLE IF EXISTS tasc_prod.tasc_crawl_schedule CASCADE;
+CREATE TABLE tasc_prod.tasc_crawl_schedule (
+    partner_uid INT PRIMARY KEY,
+    partner_name VARCHAR(255),
+    url TEXT NOT NULL,
+    host VARCHAR(255),
+    change_rate_per_hour DOUBLE PRECISION,
+    crawl_interval_seconds DOUBLE PRECISION,
+    decayed_crawls DOUBLE PRECISION DEFAULT 0,
+    decayed_changes DOUBLE PRECISION DEFAULT 0,
+    decayed_seconds DOUBLE PRECISION DEFAULT 0,
+    last_fingerprint BIGINT,
+    last_variant_count INT,
+    pages INT DEFAULT 1,
+    last_crawl_tms TIMESTAMP,
+    last_change_tms TIMESTAMP,
+    next_crawl_tms TIMESTAMP,
+    crawls INT DEFAULT 0,
+    changes INT DEFAULT 0,
+    consecutive_failures INT DEFAULT 0,
+    last_error TEXT,
+    last_modified_tms TIMESTAMP
+);
+CREATE INDEX tasc_crawl_schedule_next_idx ON tasc_prod.tasc_crawl_schedule (next_crawl_tms);
@@ -0,0 +1,13 @@
+DROP TABLE IF EXISTS tasc_prod.tasc_image_features CASCADE;
+CREATE TABLE tasc_prod.tasc_image_features (
+    feature_key CHAR(64) PRIMARY KEY,
+    image_hash VARCHAR(255),
+    model_name VARCHAR(255),
+    model_version VARCHAR(255),
+    params TEXT,
+    kind VARCHAR(32),
+    payload BYTEA,
+    created_at_tms TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX tasc_image_features_image_hash_idx ON tasc_prod.tasc_image_features (image_hash);
+CREATE INDEX tasc_image_features_model_idx ON tasc_prod.tasc_image_features (model_name, model_version);
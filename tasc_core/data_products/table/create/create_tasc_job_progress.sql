@@ -0,0 +1,11 @@
+DROP TABLE IF EXISTS tasc_prod.tasc_job_progress CASCADE;
+CREATE TABLE tasc_prod.tasc_job_progress (
+    scope VARCHAR(255),
+    item_key TEXT,
+    status VARCHAR(32),
+    attempts INT DEFAULT 0,
+    error TEXT,
+    updated_at_tms TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (scope, item_key)
+);
+CREATE INDEX tasc_job_progress_status_idx ON tasc_prod.tasc_job_progress (scope, status);
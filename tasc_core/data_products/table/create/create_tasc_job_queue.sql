@@ -0,0 +1,26 @@
+-- Work queue for image and enrichment jobs (see tasc_core/utils/util_job_queue.py). Workers lease jobs with
+-- SELECT ... FOR UPDATE SKIP LOCKED, so any number of worker nodes can claim from the same queue without a broker.
+DROP TABLE IF EXISTS tasc_prod.tasc_job_queue CASCADE;
+CREATE TABLE tasc_prod.tasc_job_queue (
+    job_id BIGSERIAL PRIMARY KEY,
+    queue VARCHAR(255) NOT NULL,
+    task VARCHAR(64) NOT NULL,
+    job_key TEXT NOT NULL,
+    payload JSONB,
+    priority INT NOT NULL DEFAULT 0,
+    status VARCHAR(32) NOT NULL DEFAULT 'queued',
+    attempts INT NOT NULL DEFAULT 0,
+    max_attempts INT NOT NULL DEFAULT 3,
+    lease_owner VARCHAR(255),
+    lease_expires_tms TIMESTAMP,
+    available_at_tms TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    result JSONB,
+    error TEXT,
+    created_at_tms TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at_tms TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (queue, task, job_key)
+);
+-- Claim order: highest priority first, then oldest
+CREATE INDEX tasc_job_queue_claim_idx ON tasc_prod.tasc_job_queue (queue, priority DESC, job_id)
+    WHERE status IN ('queued', 'leased');
+CREATE INDEX tasc_job_queue_status_idx ON tasc_prod.tasc_job_queue (queue, status);
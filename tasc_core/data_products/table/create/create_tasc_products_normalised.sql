@@ -0,0 +1,119 @@
+-- Normalised storage of Shopify catalogues: product-level fields once per product, one row per variant and per
+-- image. v_tasc_products_shopify exposes the same rows in the flat layout of tasc_products_shopify.
+DROP VIEW IF EXISTS tasc_prod.v_tasc_products_shopify;
+DROP TABLE IF EXISTS tasc_prod.tasc_product_images CASCADE;
+DROP TABLE IF EXISTS tasc_prod.tasc_product_variants CASCADE;
+DROP TABLE IF EXISTS tasc_prod.tasc_products CASCADE;
+
+CREATE TABLE tasc_prod.tasc_products (
+    parent_product_id VARCHAR(255) PRIMARY KEY,
+    product_title VARCHAR(255),
+    product_desc TEXT,
+    handle VARCHAR(255),
+    vendor VARCHAR(255),
+    product_type VARCHAR(255),
+    tags TEXT,
+    published_at TIMESTAMP,
+    created_at TIMESTAMP,
+    updated_at TIMESTAMP,
+    sizes TEXT,
+    asof_dt DATE,
+    created_at_tms TIMESTAMP,
+    created_by VARCHAR(255),
+    last_modified_tms TIMESTAMP,
+    last_modified_by VARCHAR(255),
+    source_date DATE,
+    source_datetime TIMESTAMP,
+    row_hash BIGINT
+);
+CREATE INDEX tasc_products_vendor_idx ON tasc_prod.tasc_products (vendor);
+CREATE INDEX tasc_products_handle_idx ON tasc_prod.tasc_products (vendor, handle);
+CREATE INDEX tasc_products_updated_at_idx ON tasc_prod.tasc_products (updated_at);
+
+CREATE TABLE tasc_prod.tasc_product_variants (
+    id SERIAL PRIMARY KEY,
+    child_product_id VARCHAR(255) NOT NULL UNIQUE,
+    parent_product_id VARCHAR(255) NOT NULL REFERENCES tasc_prod.tasc_products (parent_product_id) ON DELETE CASCADE,
+    variant_title VARCHAR(255),
+    sku VARCHAR(255),
+    price DECIMAL(10, 2),
+    grams INT,
+    available BOOLEAN,
+    requires_shipping BOOLEAN,
+    taxable BOOLEAN,
+    featured_image TEXT,
+    position INT,
+    asof_dt DATE,
+    created_at_tms TIMESTAMP,
+    created_by VARCHAR(255),
+    last_modified_tms TIMESTAMP,
+    last_modified_by VARCHAR(255),
+    source_date DATE,
+    source_datetime TIMESTAMP,
+    row_hash BIGINT
+);
+CREATE INDEX tasc_product_variants_parent_idx ON tasc_prod.tasc_product_variants (parent_product_id);
+
+CREATE TABLE tasc_prod.tasc_product_images (
+    parent_product_id VARCHAR(255) NOT NULL REFERENCES tasc_prod.tasc_products (parent_product_id) ON DELETE CASCADE,
+    position INT NOT NULL,
+    image_url TEXT,
+    asof_dt DATE,
+    created_at_tms TIMESTAMP,
+    created_by VARCHAR(255),
+    last_modified_tms TIMESTAMP,
+    last_modified_by VARCHAR(255),
+    row_hash BIGINT,
+    PRIMARY KEY (parent_product_id, position)
+);
+
+CREATE VIEW tasc_prod.v_tasc_products_shopify AS
+SELECT
+    v.id,
+    v.parent_product_id,
+    v.child_product_id,
+    p.product_title,
+    p.product_desc,
+    p.handle,
+    p.vendor,
+    p.product_type,
+    p.tags,
+    p.published_at,
+    p.created_at,
+    p.updated_at,
+    v.variant_title,
+    v.sku,
+    v.price,
+    v.grams,
+    v.available,
+    v.requires_shipping,
+    v.taxable,
+    v.featured_image,
+    v.position,
+    p.sizes,
+    i.product_image_1_url,
+    i.product_image_2_url,
+    i.product_image_3_url,
+    i.product_image_4_url,
+    i.product_image_5_url,
+    v.asof_dt,
+    v.created_at_tms,
+    v.created_by,
+    v.last_modified_tms,
+    v.last_modified_by,
+    v.source_date,
+    v.source_datetime
+FROM tasc_prod.tasc_product_variants v
+JOIN tasc_prod.tasc_products p ON p.parent_product_id = v.parent_product_id
+LEFT JOIN (
+    SELECT
+        parent_product_id,
+        MAX(CASE WHEN position = 1 THEN image_url END) AS product_image_1_url,
+        MAX(CASE WHEN position = 2 THEN image_url END) AS product_image_2_url,
+        MAX(CASE WHEN position = 3 THEN image_url END) AS product_image_3_url,
+        MAX(CASE WHEN position = 4 THEN image_url END) AS product_image_4_url,
+        MAX(CASE WHEN position = 5 THEN image_url END) AS product_image_5_url
+    FROM tasc_prod.tasc_product_images
+    WHERE position <= 5
+    GROUP BY parent_product_id
+) i ON i.parent_product_id = v.parent_product_id;
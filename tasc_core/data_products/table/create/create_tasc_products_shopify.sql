@@ -33,5 +33,7 @@ CREATE TABLE tasc_prod.tasc_products_shopify (
     last_modified_tms TIMESTAMP,
     last_modified_by VARCHAR(255),
     source_date DATE,
-    source_datetime TIMESTAMP
-);
\ No newline at end of file
+    source_datetime TIMESTAMP,
+    row_hash BIGINT
+);
+CREATE INDEX tasc_products_shopify_child_product_id_idx ON tasc_prod.tasc_products_shopify (child_product_id);
\ No newline at end of file
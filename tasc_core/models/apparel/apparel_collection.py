@@ -0,0 +1,126 @@
+import pandas as pd
+
+from tasc_core.models.apparel.apparel import Apparel
+
+
+class ApparelCollection:
+    """
+    An in-memory catalogue of apparel items keyed by item_id (the Shopify variant id), with bulk updates of stock
+    and price.
+
+    Apparel.update_stock and apply_discount change one object at a time and print; the bulk methods here apply a
+    whole sync's deltas in one pass and stay silent, so a stock sync can run every few minutes
+    (see tasc_core.utils.util_stock_sync).
+
+    Examples:
+        Here is how you might keep a collection current between full ingests:
+
+            collection = ApparelCollection.from_dataframe(nebula.select_df("SELECT * FROM tasc_prod.v_tasc_products_shopify"))
+            sync_stock(urls, nebula=nebula, collection=collection)
+
+            # 10% off everything from one brand
+            collection.apply_discount_bulk(10, item_ids=[item.item_id for item in collection if item.brand == 'Brand'])
+
+    Attributes:
+        items (dict): Apparel items by item_id.
+    """
+
+    def __init__(self, items=None):
+        self.items = {}
+        for item in items or []:
+            self.add(item)
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """
+        Builds a collection from catalogue rows, one item per variant.
+
+        Args:
+            df (DataFrame): Rows of tasc_products_shopify or v_tasc_products_shopify.
+
+        Returns:
+            ApparelCollection: The items, with price and availability taken from each variant.
+        """
+        def column(name):
+            return df[name].tolist() if name in df.columns else [None] * len(df)
+
+        items = [
+            Apparel(item_id=str(item_id), product_id=str(product_id), name=name, apparel_type=apparel_type,
+                    colour=None, material=None, style=None, brand=brand, gender=None, price=price,
+                    availability=availability)
+            for item_id, product_id, name, apparel_type, brand, price, availability in zip(
+                column('child_product_id'), column('parent_product_id'), column('product_title'),
+                column('product_type'), column('vendor'), column('price'), column('available'))
+        ]
+        return cls(items)
+
+    def add(self, item):
+        self.items[str(item.item_id)] = item
+
+    def get(self, item_id):
+        return self.items.get(str(item_id))
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items.values())
+
+    def __contains__(self, item_id):
+        return str(item_id) in self.items
+
+    def stock_frame(self):
+        """
+        Current price and availability of every item, in the column names of the catalogue tables.
+
+        Returns:
+            DataFrame: child_product_id, parent_product_id, price and available.
+        """
+        return pd.DataFrame(
+            [(item_id, item.product_id, item.price, item.availability) for item_id, item in self.items.items()],
+            columns=['child_product_id', 'parent_product_id', 'price', 'available'])
+
+    def apply_stock_deltas(self, deltas):
+        """
+        Applies the changes found by util_stock_sync.diff_stock to the items in place.
+
+        Args:
+            deltas (DataFrame): child_product_id with the new price and/or available.
+
+        Returns:
+            int: Number of items updated. Deltas for unknown items are ignored.
+        """
+        updated = 0
+        has_price, has_available = 'price' in deltas.columns, 'available' in deltas.columns
+        for row in deltas.itertuples(index=False):
+            item = self.items.get(str(row.child_product_id))
+            if item is None:
+                continue
+            if has_price:
+                item.price = None if pd.isna(row.price) else float(row.price)
+            if has_available:
+                item.availability = None if pd.isna(row.available) else bool(row.available)
+            updated += 1
+        return updated
+
+    def apply_discount_bulk(self, discount_percentage, item_ids=None):
+        """
+        Applies a percentage discount to many items at once.
+
+        Args:
+            discount_percentage (float): Discount to apply, e.g. 15 for 15% off.
+            item_ids (list): Items to discount. Defaults to the whole collection.
+
+        Returns:
+            int: Number of items discounted.
+        """
+        keys = self.items.keys() if item_ids is None else [str(item_id) for item_id in item_ids]
+        factor = 1 - discount_percentage / 100
+        discounted = 0
+        for key in keys:
+            item = self.items.get(key)
+            if item is None or item.price is None:
+                continue
+            item.price = round(float(item.price) * factor, 2)
+            discounted += 1
+        return discounted
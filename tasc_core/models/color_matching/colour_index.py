@@ -0,0 +1,419 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+# Canonical colour vocabulary used to name palette colours. Hex values are sRGB.
+NAMED_COLOURS = {
+    'black': '#000000',
+    'charcoal': '#36454f',
+    'grey': '#808080',
+    'silver': '#c0c0c0',
+    'white': '#ffffff',
+    'off white': '#f5f5ef',
+    'cream': '#fffdd0',
+    'ivory': '#fffff0',
+    'beige': '#d9c8a9',
+    'stone': '#b8ad9b',
+    'sand': '#c2b280',
+    'camel': '#c19a6b',
+    'tan': '#d2b48c',
+    'khaki': '#a9a06b',
+    'brown': '#6f4e37',
+    'chocolate': '#3f2a1d',
+    'burgundy': '#800020',
+    'maroon': '#5c1a1b',
+    'crimson': '#c8102e',
+    'red': '#e32227',
+    'coral': '#ff7f50',
+    'orange': '#ff8c00',
+    'rust': '#b7410e',
+    'mustard': '#e1ad01',
+    'yellow': '#ffd700',
+    'olive': '#708238',
+    'khaki green': '#728c69',
+    'sage': '#9caf88',
+    'lime': '#32cd32',
+    'green': '#228b22',
+    'forest green': '#0b3d0b',
+    'mint': '#98e0b5',
+    'teal': '#008080',
+    'turquoise': '#40e0d0',
+    'sky blue': '#87ceeb',
+    'light blue': '#add8e6',
+    'royal blue': '#1c39f0',
+    'blue': '#1f4fbf',
+    'cobalt': '#0047ab',
+    'navy': '#1b2a4a',
+    'purple': '#6a0dad',
+    'lilac': '#c8a2c8',
+    'lavender': '#b57edc',
+    'pink': '#ffc0cb',
+    'hot pink': '#ff69b4',
+    'fuchsia': '#c2185b',
+    'magenta': '#ff00ff',
+}
+
+# For colours inside the sRGB gamut the CIE76 (euclidean LAB) distance is at most ~7.4x the CIEDE2000 distance
+# (measured over all pairs of a 26-level sRGB grid; the worst pairs involve saturated blues and purples, where the
+# CIEDE2000 rotation term shortens distances). It caps candidate_radius, the per-colour search radius used by
+# query_radius.
+CANDIDATE_SLACK = 8.0
+
+
+def hex_to_lab(hex_colours) -> np.ndarray:
+    """Converts sRGB hex strings to CIE LAB (D65) in one vectorised pass.
+
+    Args:
+        hex_colours (list): hex strings, e.g. ['#1b2a4a', 'ffffff']
+
+    Returns:
+        np.ndarray: float32 array of shape (n, 3) with L in [0, 100] and a, b roughly in [-128, 127]
+    """
+    rgb = np.array([[int(h.lstrip('#')[i:i + 2], 16) for i in (0, 2, 4)] for h in hex_colours], dtype=np.float64)
+    return rgb_to_lab(rgb.reshape(-1, 3))
+
+
+def rgb_to_lab(rgb) -> np.ndarray:
+    """Converts 8-bit sRGB values of shape (n, 3) to CIE LAB (D65)."""
+    rgb = np.asarray(rgb, dtype=np.float64) / 255.0
+    linear = np.where(rgb > 0.04045, ((rgb + 0.055) / 1.055) ** 2.4, rgb / 12.92)
+    xyz = linear @ np.array([[0.4124564, 0.2126729, 0.0193339],
+                             [0.3575761, 0.7151522, 0.1191920],
+                             [0.1804375, 0.0721750, 0.9503041]])
+    xyz /= np.array([0.95047, 1.0, 1.08883])
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    lab = np.stack([116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2])], axis=1)
+    return lab.astype(np.float32)
+
+
+def opencv_lab_to_cielab(lab) -> np.ndarray:
+    """Converts 8-bit OpenCV LAB values (as returned by ImageProcessor clustering) to CIE LAB.
+
+    OpenCV scales L to [0, 255] and offsets a and b by 128 for uint8 images.
+    """
+    lab = np.asarray(lab, dtype=np.float32).reshape(-1, 3)
+    return np.stack([lab[:, 0] * (100.0 / 255.0), lab[:, 1] - 128.0, lab[:, 2] - 128.0], axis=1)
+
+
+def ciede2000(lab1, lab2, k_l: float = 1.0, k_c: float = 1.0, k_h: float = 1.0) -> np.ndarray:
+    """Vectorised CIEDE2000 colour difference. Inputs broadcast against each other along all but the last axis.
+
+    Args:
+        lab1 (array-like): CIE LAB colours, shape (..., 3)
+        lab2 (array-like): CIE LAB colours, shape (..., 3)
+
+    Returns:
+        np.ndarray: ΔE00 for every broadcast pair
+    """
+    lab1 = np.asarray(lab1, dtype=np.float64)
+    lab2 = np.asarray(lab2, dtype=np.float64)
+    l1, a1, b1 = lab1[..., 0], lab1[..., 1], lab1[..., 2]
+    l2, a2, b2 = lab2[..., 0], lab2[..., 1], lab2[..., 2]
+
+    c_bar7 = ((np.hypot(a1, b1) + np.hypot(a2, b2)) / 2) ** 7
+    g = 0.5 * (1 - np.sqrt(c_bar7 / (c_bar7 + 25.0 ** 7)))
+    a1p, a2p = (1 + g) * a1, (1 + g) * a2
+    c1p, c2p = np.hypot(a1p, b1), np.hypot(a2p, b2)
+    h1p = np.degrees(np.arctan2(b1, a1p)) % 360
+    h2p = np.degrees(np.arctan2(b2, a2p)) % 360
+    chroma_zero = (c1p * c2p) == 0
+
+    dhp = h2p - h1p
+    dhp = np.where(dhp > 180, dhp - 360, np.where(dhp < -180, dhp + 360, dhp))
+    dhp = np.where(chroma_zero, 0.0, dhp)
+    d_l = l2 - l1
+    d_c = c2p - c1p
+    d_h = 2 * np.sqrt(c1p * c2p) * np.sin(np.radians(dhp) / 2)
+
+    l_bar = (l1 + l2) / 2
+    c_bar_p = (c1p + c2p) / 2
+    h_sum = h1p + h2p
+    h_bar = np.where(np.abs(h1p - h2p) > 180, np.where(h_sum < 360, (h_sum + 360) / 2, (h_sum - 360) / 2), h_sum / 2)
+    h_bar = np.where(chroma_zero, h_sum, h_bar)
+
+    t = (1 - 0.17 * np.cos(np.radians(h_bar - 30)) + 0.24 * np.cos(np.radians(2 * h_bar))
+         + 0.32 * np.cos(np.radians(3 * h_bar + 6)) - 0.20 * np.cos(np.radians(4 * h_bar - 63)))
+    d_theta = 30 * np.exp(-(((h_bar - 275) / 25) ** 2))
+    c_bar_p7 = c_bar_p ** 7
+    r_c = 2 * np.sqrt(c_bar_p7 / (c_bar_p7 + 25.0 ** 7))
+    s_l = 1 + (0.015 * (l_bar - 50) ** 2) / np.sqrt(20 + (l_bar - 50) ** 2)
+    s_c = 1 + 0.045 * c_bar_p
+    s_h = 1 + 0.015 * c_bar_p * t
+    r_t = -np.sin(np.radians(2 * d_theta)) * r_c
+
+    term_l = d_l / (k_l * s_l)
+    term_c = d_c / (k_c * s_c)
+    term_h = d_h / (k_h * s_h)
+    return np.sqrt(np.maximum(term_l ** 2 + term_c ** 2 + term_h ** 2 + r_t * term_c * term_h, 0.0))
+
+
+def _hue_distance(a, b) -> np.ndarray:
+    return np.abs((np.asarray(a) - b + 180) % 360 - 180)
+
+
+def candidate_radius(lab, max_delta_e: float, slack: float = CANDIDATE_SLACK) -> np.ndarray:
+    """Per-colour CIE76 radius containing every colour within max_delta_e (CIEDE2000), from the weighting functions.
+
+    A pair within max_delta_e differs by at most max_delta_e * S_L in L and max_delta_e * S_C / sqrt(1 - |R_T| / 2)
+    in the a'b' plane (S_H <= S_C, and |R_T| bounds the rotation cross term). S_L, S_C and R_T depend on the pair's
+    mean lightness, chroma and hue, which the radius itself bounds, so the bound is iterated to a fixed point from
+    the query colour. Greys, whites and warm neutrals get 1.3-3x max_delta_e instead of CANDIDATE_SLACK; saturated
+    colours and anything near blue, where CIEDE2000 itself reaches far in LAB, stay at or near the cap.
+
+    Args:
+        lab (np.ndarray): CIE LAB query colours, shape (n, 3)
+        max_delta_e (float): CIEDE2000 threshold
+        slack (float, optional): cap on radius / max_delta_e. Defaults to CANDIDATE_SLACK.
+
+    Returns:
+        np.ndarray: radius per query colour
+    """
+    lab = np.asarray(lab, dtype=np.float64).reshape(-1, 3)
+    # a' = (1 + G) a with 0 <= G <= 0.5 stretches chroma by up to 1.5x and pulls the hue towards the a axis
+    chroma = np.hypot(1.5 * lab[:, 1], lab[:, 2])
+    hue_lab = np.degrees(np.arctan2(lab[:, 2], lab[:, 1])) % 360
+    hue_prime = np.degrees(np.arctan2(lab[:, 2], 1.5 * lab[:, 1])) % 360
+    # distance from the query hue range to 275°, where the rotation term peaks
+    hue_offset = np.where(_hue_distance(hue_lab, hue_prime) > 90, 0.0,
+                          np.minimum(_hue_distance(hue_lab, 275), _hue_distance(hue_prime, 275)))
+    between = _hue_distance(hue_lab, 275) + _hue_distance(hue_prime, 275) <= _hue_distance(hue_lab, hue_prime) + 1e-9
+    hue_offset = np.where(between, 0.0, hue_offset)
+
+    cap = max_delta_e * slack
+    radius = np.full(len(lab), float(max_delta_e))
+    for _ in range(50):
+        l_far = np.clip(np.abs(lab[:, 0] - 50) + radius / 2, 0, 50)
+        s_l = 1 + 0.015 * l_far ** 2 / np.sqrt(20 + l_far ** 2)
+        c_bar = chroma + radius / 2
+        c_bar7 = c_bar ** 7
+        # the candidate's hue is within asin(radius / chroma) of the query's, so the mean hue within half that
+        spread = np.degrees(np.arcsin(np.clip(radius / np.maximum(chroma, 1e-9), 0, 1))) / 2
+        d_theta = 30 * np.exp(-((np.maximum(hue_offset - spread, 0) / 25) ** 2))
+        r_t = 2 * np.sqrt(c_bar7 / (c_bar7 + 25.0 ** 7)) * np.sin(np.radians(2 * d_theta))
+        s_c = (1 + 0.045 * c_bar) / np.sqrt(1 - r_t / 2)
+        updated = np.minimum(max_delta_e * np.maximum(s_l, s_c), cap)
+        if np.all(updated - radius < 1e-3):
+            return updated
+        radius = updated
+    return radius
+
+
+class ColourIndex:
+    """Spatial index over product colour palettes in CIE LAB space.
+
+    Every palette colour of every product is stored as one row of a compact float32 matrix, with a parallel
+    array mapping rows back to products. A KD-tree over that matrix answers "which products have a colour near
+    this one" as a radius query, and a second KD-tree over the canonical vocabulary in NAMED_COLOURS maps
+    arbitrary LAB values to a colour name. Candidates from the KD-trees are always re-ranked with CIEDE2000.
+
+    Example:
+        Index palettes straight from ImageProcessor and search them::
+
+            from tasc_core.models.color_matching.colour_index import ColourIndex
+
+            index = ColourIndex()
+            _, lab = processor.extract_colors(image_url=url, return_lab=True)
+            index.add_opencv_palettes(['123'], [lab])
+            index.query_radius(['#1b2a4a'], max_delta_e=10)
+
+    """
+
+    def __init__(self, named_colours: dict = None, candidate_slack: float = CANDIDATE_SLACK) -> None:
+        named_colours = named_colours or NAMED_COLOURS
+        self.colour_names = np.array(list(named_colours.keys()))
+        self.colour_lab = hex_to_lab(list(named_colours.values()))
+        self.candidate_slack = candidate_slack
+        self._names_tree = cKDTree(self.colour_lab)
+
+        self.product_ids = []
+        self._product_pos = {}
+        self._pending_lab = []
+        self._pending_owner = []
+        self.palette_lab = np.empty((0, 3), dtype=np.float32)
+        self.palette_owner = np.empty(0, dtype=np.int32)
+        self._palette_tree = None
+
+    def __len__(self) -> int:
+        return len(self.product_ids)
+
+    def add_palettes(self, product_ids: list, palettes: list) -> None:
+        """Adds CIE LAB palettes for a batch of products. Re-adding a product replaces its palette.
+
+        Args:
+            product_ids (list): product identifiers, one per palette
+            palettes (list): one array-like of shape (k, 3) per product, in CIE LAB
+        """
+        if len(product_ids) != len(palettes):
+            raise ValueError("product_ids and palettes must have the same length")
+
+        replaced = [pid for pid in product_ids if pid in self._product_pos]
+        if replaced:
+            self.remove(replaced)
+
+        for product_id, palette in zip(product_ids, palettes):
+            palette = np.asarray(palette, dtype=np.float32).reshape(-1, 3)
+            pos = len(self.product_ids)
+            self.product_ids.append(product_id)
+            self._product_pos[product_id] = pos
+            self._pending_lab.append(palette)
+            self._pending_owner.append(np.full(len(palette), pos, dtype=np.int32))
+        self._palette_tree = None
+
+    def add_opencv_palettes(self, product_ids: list, palettes: list) -> None:
+        """Same as add_palettes, but for the 8-bit OpenCV LAB centres produced by ImageProcessor."""
+        self.add_palettes(product_ids, [opencv_lab_to_cielab(palette) for palette in palettes])
+
+    def add_hex_palettes(self, product_ids: list, palettes: list) -> None:
+        """Same as add_palettes, but for palettes of sRGB hex strings, e.g. the output of extract_colors."""
+        self.add_palettes(product_ids, [hex_to_lab(palette) for palette in palettes])
+
+    def remove(self, product_ids: list) -> None:
+        """Removes products from the index. Product positions are compacted, so this is O(n) per call."""
+        self._flush()
+        drop = {self._product_pos[pid] for pid in product_ids if pid in self._product_pos}
+        if not drop:
+            return None
+
+        keep_products = np.array([pos not in drop for pos in range(len(self.product_ids))], dtype=bool)
+        new_pos = np.cumsum(keep_products, dtype=np.int32) - 1
+        keep_rows = keep_products[self.palette_owner]
+        self.palette_lab = self.palette_lab[keep_rows]
+        self.palette_owner = new_pos[self.palette_owner[keep_rows]]
+        self.product_ids = [pid for pos, pid in enumerate(self.product_ids) if keep_products[pos]]
+        self._product_pos = {pid: pos for pos, pid in enumerate(self.product_ids)}
+        self._palette_tree = None
+
+    def build(self) -> None:
+        """Builds the palette KD-tree. Called lazily by the query methods after any change."""
+        self._flush()
+        self._palette_tree = cKDTree(self.palette_lab) if len(self.palette_lab) else None
+
+    def _flush(self) -> None:
+        if self._pending_lab:
+            self.palette_lab = np.concatenate([self.palette_lab] + self._pending_lab).astype(np.float32, copy=False)
+            self.palette_owner = np.concatenate([self.palette_owner] + self._pending_owner)
+            self._pending_lab = []
+            self._pending_owner = []
+
+    @staticmethod
+    def _to_lab(colours) -> np.ndarray:
+        if len(colours) and isinstance(colours[0], str):
+            return hex_to_lab(colours)
+        return np.asarray(colours, dtype=np.float32).reshape(-1, 3)
+
+    def name_colours(self, colours, candidates: int = 5):
+        """Maps colours to the closest name in the canonical vocabulary.
+
+        Args:
+            colours (list): hex strings or CIE LAB triples
+            candidates (int, optional): euclidean nearest names re-ranked by CIEDE2000. Defaults to 5.
+
+        Returns:
+            tuple: (list of names, np.ndarray of ΔE00 to the chosen name)
+        """
+        lab = self._to_lab(colours)
+        candidates = min(candidates, len(self.colour_names))
+        _, idx = self._names_tree.query(lab, k=candidates)
+        idx = idx.reshape(len(lab), candidates)
+        delta_e = ciede2000(lab[:, None, :], self.colour_lab[idx])
+        best = np.argmin(delta_e, axis=1)
+        rows = np.arange(len(lab))
+        return self.colour_names[idx[rows, best]].tolist(), delta_e[rows, best]
+
+    def name_palettes(self) -> dict:
+        """Returns the distinct colour names in every indexed product's palette, keyed by product id."""
+        self._flush()
+        if not len(self.palette_lab):
+            return {}
+        names, _ = self.name_colours(self.palette_lab)
+        result = {pid: [] for pid in self.product_ids}
+        for owner, name in zip(self.palette_owner, names):
+            product_names = result[self.product_ids[owner]]
+            if name not in product_names:
+                product_names.append(name)
+        return result
+
+    def query_radius(self, colours, max_delta_e: float = 10.0, exhaustive: bool = False) -> list:
+        """Finds products whose palette has at least one colour within max_delta_e (CIEDE2000) of each query colour.
+
+        Args:
+            colours (list): hex strings or CIE LAB triples, queried as one batch
+            max_delta_e (float, optional): CIEDE2000 threshold. Defaults to 10.0.
+            exhaustive (bool, optional): search max_delta_e * candidate_slack for every colour instead of
+                candidate_radius. Defaults to False.
+
+        Returns:
+            list: one list per query colour of (product_id, ΔE00) tuples, closest first
+        """
+        if self._palette_tree is None:
+            self.build()
+        lab = self._to_lab(colours)
+        if self._palette_tree is None:
+            return [[] for _ in range(len(lab))]
+
+        if exhaustive:
+            radius = max_delta_e * self.candidate_slack
+        else:
+            radius = candidate_radius(lab, max_delta_e, self.candidate_slack)
+        candidate_rows = self._palette_tree.query_ball_point(lab, r=radius)
+        results = []
+        for query, rows in zip(lab, candidate_rows):
+            if not rows:
+                results.append([])
+                continue
+            rows = np.asarray(rows, dtype=np.int64)
+            delta_e = ciede2000(query[None, :], self.palette_lab[rows])
+            hit = delta_e < max_delta_e
+            results.append(self._best_per_product(self.palette_owner[rows[hit]], delta_e[hit]))
+        return results
+
+    def query_nearest(self, colours, k: int = 10, candidates: int = 64) -> list:
+        """Finds the k products with the closest palette colour to each query colour.
+
+        Args:
+            colours (list): hex strings or CIE LAB triples, queried as one batch
+            k (int, optional): number of products per query. Defaults to 10.
+            candidates (int, optional): palette rows fetched from the KD-tree before CIEDE2000 re-ranking.
+                Defaults to 64.
+
+        Returns:
+            list: one list per query colour of (product_id, ΔE00) tuples, closest first
+        """
+        if self._palette_tree is None:
+            self.build()
+        lab = self._to_lab(colours)
+        if self._palette_tree is None:
+            return [[] for _ in range(len(lab))]
+
+        candidates = min(max(candidates, k), len(self.palette_lab))
+        _, idx = self._palette_tree.query(lab, k=candidates)
+        idx = idx.reshape(len(lab), candidates)
+        delta_e = ciede2000(lab[:, None, :], self.palette_lab[idx])
+        return [self._best_per_product(self.palette_owner[row_idx], row_de)[:k] for row_idx, row_de in zip(idx, delta_e)]
+
+    def _best_per_product(self, owners: np.ndarray, delta_e: np.ndarray) -> list:
+        if not len(owners):
+            return []
+        order = np.lexsort((delta_e, owners))
+        owners, delta_e = owners[order], delta_e[order]
+        first = np.concatenate(([True], owners[1:] != owners[:-1]))
+        owners, delta_e = owners[first], delta_e[first]
+        ranked = np.argsort(delta_e, kind='stable')
+        return [(self.product_ids[owners[i]], float(delta_e[i])) for i in ranked]
+
+    def save(self, path: str) -> None:
+        """Saves the palette matrix and product ids to a compressed .npz file."""
+        self._flush()
+        np.savez_compressed(path, palette_lab=self.palette_lab, palette_owner=self.palette_owner,
+                            product_ids=np.array(self.product_ids, dtype=object))
+
+    @classmethod
+    def load(cls, path: str, named_colours: dict = None) -> 'ColourIndex':
+        """Loads an index previously written with save()."""
+        data = np.load(path, allow_pickle=True)
+        index = cls(named_colours)
+        index.palette_lab = data['palette_lab'].astype(np.float32, copy=False)
+        index.palette_owner = data['palette_owner'].astype(np.int32, copy=False)
+        index.product_ids = data['product_ids'].tolist()
+        index._product_pos = {pid: pos for pos, pid in enumerate(index.product_ids)}
+        return index
@@ -0,0 +1,221 @@
+"""Catalogue ingestion: products.json -> tasc_products_shopify -> image download -> colour extraction.
+
+The stages run concurrently through util_pipeline.Pipeline: stores are crawled and inserted while images of
+earlier stores are being downloaded and clustered, so a run takes about as long as its slowest stage. Progress is
+checkpointed per store URL, and inserts per store, so re-running after a crash picks up where it stopped without
+inserting a store twice.
+
+Example:
+    from tasc_core.utils.util_nebuladb import NebulaConnector
+
+    colours, stats = run_ingestion(
+        ["https://www.example-store.com/products.json?limit=250"],
+        nebula=NebulaConnector(),
+        progress_path="data/processed/ingestion_progress.sqlite")
+"""
+import os
+from datetime import date, datetime
+from io import BytesIO
+
+import pandas as pd
+
+from tasc_core.models.image_recognition.image_dedup import IMAGE_URL_COLUMNS, normalise_image_url
+from tasc_core.utils.util_checkpoint import ProgressStore
+from tasc_core.utils.util_http import get_transport
+from tasc_core.utils.util_pipeline import Pipeline, Stage
+from tasc_core.utils.util_shopify_product_parser import ShopifyProductParser
+
+# VARCHAR(255) columns of tasc_prod.tasc_products_shopify
+VARCHAR_COLUMNS = ['parent_product_id', 'child_product_id', 'product_title', 'handle', 'vendor', 'product_type',
+                   'variant_title', 'sku']
+VARCHAR_LENGTH = 255
+
+# Normalised frame -> (table, conflict columns), in foreign key order
+NORMALISED_TABLES = [
+    ('products', 'tasc_products', ['parent_product_id']),
+    ('variants', 'tasc_product_variants', ['child_product_id']),
+    ('images', 'tasc_product_images', ['parent_product_id', 'position']),
+]
+
+_colour_processor = None
+
+
+def truncate_columns(df: pd.DataFrame, columns: list = None, max_length: int = VARCHAR_LENGTH) -> pd.DataFrame:
+    """Cuts string columns to the width of their VARCHAR column so COPY does not reject the batch."""
+    df = df.copy()
+    for column in columns or VARCHAR_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].where(df[column].isna(), df[column].astype(str).str.slice(0, max_length))
+    return df
+
+
+def _add_audit_columns(df: pd.DataFrame) -> pd.DataFrame:
+    now = datetime.now()
+    df['asof_dt'] = date.today()
+    df['created_at_tms'] = now
+    df['created_by'] = 'ingestion_pipeline'
+    df['last_modified_tms'] = now
+    df['last_modified_by'] = 'ingestion_pipeline'
+    return df
+
+
+def fetch_products(url: str) -> pd.DataFrame:
+    """Crawls one products.json URL into rows ready for tasc_prod.tasc_products_shopify."""
+    parser = ShopifyProductParser(url)
+    parser.load_json()
+    return _add_audit_columns(truncate_columns(parser.to_dataframe()))
+
+
+def fetch_products_normalised(url: str) -> dict:
+    """Crawls one products.json URL into product, variant and image frames (see create_tasc_products_normalised.sql)."""
+    parser = ShopifyProductParser(url)
+    parser.load_json()
+    return {name: _add_audit_columns(truncate_columns(frame))
+            for name, frame in parser.to_normalised_dataframes().items()}
+
+
+def insert_normalised(nebula, frames: dict, table_schema: str = 'tasc_prod') -> dict:
+    """Upserts normalised frames, parents first so variant and image foreign keys resolve, and deletes the variants
+    and images the crawled products no longer have. Everything is written in one transaction, so readers never see
+    a product with a mix of old and new children.
+
+    Products and variants already stored are only rewritten when their content changed (see upsert_df), so a
+    daily re-crawl of a store costs roughly its changes.
+    """
+    counts = {}
+    parent_ids = frames['products']['parent_product_id'].tolist() if not frames['products'].empty else []
+    with nebula.transaction([table_name for _, table_name, _ in NORMALISED_TABLES]) as connection:
+        for name, table_name, conflict_columns in NORMALISED_TABLES:
+            frame = frames[name]
+            if not frame.empty:
+                counts[name] = nebula.upsert_df(table_name, table_schema, frame, conflict_columns,
+                                                connection=connection)
+            if name != 'products' and parent_ids:
+                counts.setdefault(name, {})['deleted'] = nebula.delete_missing(
+                    table_name, table_schema, frame, conflict_columns, 'parent_product_id', parent_ids,
+                    connection=connection)
+    return counts
+
+
+def list_images(df) -> list:
+    """Unique image URLs of a store's products, as (sub_key, url) pairs for a fan-out stage.
+
+    Takes either the flat DataFrame of fetch_products or the frames of fetch_products_normalised.
+    """
+    if isinstance(df, dict):
+        return _unique_images(df['images']['image_url'].tolist())
+    columns = [column for column in IMAGE_URL_COLUMNS if column in df.columns]
+    return _unique_images(pd.unique(df[columns].values.ravel()) if columns else [])
+
+
+def _unique_images(urls) -> list:
+    seen = set()
+    images = []
+    for url in urls:
+        if not isinstance(url, str) or not url:
+            continue
+        normalised = normalise_image_url(url)
+        if normalised not in seen:
+            seen.add(normalised)
+            images.append((normalised, url))
+    return images
+
+
+def download_image(image_url: str) -> dict:
+    """Downloads one image over the shared transport, so connections to the CDN are reused across items."""
+    return {'image_url': image_url, 'data': get_transport().fetch_bytes(image_url, target="image"), 'colours': None}
+
+
+def _init_colour_worker() -> None:
+    global _colour_processor
+    from tasc_core.models.image_recognition.image_colour_recognition_model import ImageProcessor
+    _colour_processor = ImageProcessor()
+
+
+def extract_colours(item: dict) -> dict:
+    """Runs colour clustering on downloaded image bytes. Runs in a worker process."""
+    if item['colours'] is None:
+        from PIL import Image
+        if _colour_processor is None:
+            _init_colour_worker()
+        item['colours'] = _colour_processor.extract_colors(image=Image.open(BytesIO(item['data'])))
+    return {'image_url': item['image_url'], 'image_hash': item.get('image_hash'), 'colours': item['colours']}
+
+
+def build_ingestion_pipeline(nebula=None, progress: ProgressStore = None, feature_store=None, results: list = None,
+                             table_schema: str = 'tasc_prod', table_name: str = 'tasc_products_shopify',
+                             crawl_workers: int = 4, download_workers: int = 16, colour_workers: int = None,
+                             normalised: bool = False) -> Pipeline:
+    """Wires the ingestion stages together.
+
+    Args:
+        nebula (NebulaConnector): Connection used to insert products. Products are not inserted when None.
+        progress (ProgressStore): Where progress is checkpointed. The run cannot resume when None.
+        feature_store (FeatureStore): Palettes already stored for an image are reused and new ones are written back.
+        results (list): Each image's {'image_url', 'image_hash', 'colours'} is appended to it.
+        crawl_workers (int): Concurrent products.json requests.
+        download_workers (int): Concurrent image downloads.
+        colour_workers (int): Colour clustering processes. Defaults to the number of CPUs.
+        normalised (bool): Write tasc_products, tasc_product_variants and tasc_product_images instead of the flat
+            `table_name`.
+
+    Returns:
+        Pipeline: Run it with pipeline.run(urls).
+    """
+    def insert_products(df) -> None:
+        if nebula is None:
+            return None
+        if normalised:
+            insert_normalised(nebula, df, table_schema)
+        else:
+            nebula.insert_df(table_schema, table_name, df)
+
+    def download(image_url: str) -> dict:
+        item = download_image(image_url)
+        if feature_store is not None:
+            from tasc_core.utils.util_feature_store import content_hash
+            item['image_hash'] = content_hash(item['data'])
+            item['colours'] = feature_store.get(item['image_hash'])
+            if item['colours'] is not None:
+                item['data'] = None
+        return item
+
+    def record(item: dict) -> None:
+        if feature_store is not None and item['image_hash'] is not None:
+            feature_store.put(item['image_hash'], item['colours'])
+        if results is not None:
+            results.append(item)
+        return None
+
+    return Pipeline('ingestion', [
+        Stage('crawl', fetch_products_normalised if normalised else fetch_products, workers=crawl_workers),
+        Stage('insert', insert_products, workers=2, side_effect=True),
+        Stage('images', list_images, fan_out=True, queue_size=2),
+        Stage('download', download, workers=download_workers),
+        Stage('colours', extract_colours, workers=colour_workers or os.cpu_count() or 1, kind='process',
+              initializer=_init_colour_worker),
+        Stage('record', record),
+    ], progress=progress)
+
+
+def run_ingestion(urls: list, nebula=None, progress_path: str = None, feature_store=None, snapshot_root: str = None,
+                  **kwargs) -> tuple:
+    """Crawls, inserts and colour-tags every store in `urls`, resuming from `progress_path` if it exists.
+
+    When `snapshot_root` is given, today's rows are exported from Nebula to the local catalogue snapshot afterwards
+    (see util_catalogue_snapshot), so read-heavy jobs see the new sync without querying the database.
+
+    Returns:
+        tuple: A DataFrame of image_url, image_hash and colours for the images processed in this run, and the
+            pipeline stats.
+    """
+    results = []
+    progress = ProgressStore(progress_path) if progress_path else None
+    pipeline = build_ingestion_pipeline(nebula=nebula, progress=progress, feature_store=feature_store,
+                                        results=results, **kwargs)
+    stats = pipeline.run(urls)
+    if snapshot_root and nebula is not None:
+        from tasc_core.utils.util_catalogue_snapshot import export_snapshot
+        table = 'tasc_prod.v_tasc_products_shopify' if kwargs.get('normalised') else 'tasc_prod.tasc_products_shopify'
+        export_snapshot(nebula, snapshot_root, table=table, asof_dt=date.today().isoformat())
+    return pd.DataFrame(results, columns=['image_url', 'image_hash', 'colours']), stats
@@ -0,0 +1,272 @@
+"""Queue worker: claims jobs from a util_job_queue.JobQueue and runs the matching model function.
+
+Start one per core or per box against the same queue; they share the work through the job table with no other
+coordination. Each worker claims a batch, keeps the batch's leases alive with a heartbeat thread while it runs, and
+writes every result back fenced by its lease.
+
+Tasks map to handlers taking a job payload and returning a JSON-serialisable result:
+
+- colours: {'image_url'} -> ImageProcessor.extract_colors
+- garment_colours: {'image_url'} -> GarmentColourModel.extract
+- remove_bg: {'image_url', 'output_path'} -> remove_bg_bytes, written to output_path
+- enrich: {'image_url', 'prompt', 'model'?} -> OpenAIClient.generate_image_prompt
+- stock_sync: {'url'} -> util_stock_sync.sync_stock
+
+Register more with @register_handler('name').
+
+Example:
+    python -m tasc_core.models.engine.worker --queue images --batch-size 8 --concurrency 4
+"""
+import argparse
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from tasc_core.utils import util_metrics as metrics
+from tasc_core.utils.util_job_queue import JobQueue
+
+HANDLERS = {}
+
+# Models are loaded once per worker process and shared by its jobs
+_models = {}
+_models_lock = threading.Lock()
+
+
+def register_handler(task: str):
+    """Decorator registering a function as the handler of `task`."""
+    def decorator(fn):
+        HANDLERS[task] = fn
+        return fn
+    return decorator
+
+
+def _model(name: str, factory):
+    with _models_lock:
+        if name not in _models:
+            _models[name] = factory()
+        return _models[name]
+
+
+@register_handler('colours')
+def colours(payload: dict) -> dict:
+    from tasc_core.models.image_recognition.image_colour_recognition_model import ImageProcessor
+    # extract_colors stores the cluster count on the processor, so each call gets its own
+    return {'colours': ImageProcessor().extract_colors(image_url=payload['image_url'])}
+
+
+@register_handler('garment_colours')
+def garment_colours(payload: dict) -> dict:
+    from tasc_core.models.image_recognition.garment_colour_model import GarmentColourModel
+    model = _model('garment_colours', GarmentColourModel)
+    garments = model.extract(image_url=payload['image_url'])
+    for garment in garments:
+        garment['lab'] = [[int(v) for v in colour] for colour in garment['lab']]
+    return {'garments': garments}
+
+
+@register_handler('remove_bg')
+def remove_bg(payload: dict) -> dict:
+    from tasc_core.models.image_recognition.image_background_removal_model import remove_bg_bytes
+    from tasc_core.utils.util_http import get_transport
+    data = get_transport().fetch_bytes(payload['image_url'], target="image")
+    output, info = remove_bg_bytes(data, matting=payload.get('matting', 'adaptive'), return_info=True)
+    os.makedirs(os.path.dirname(payload['output_path']) or '.', exist_ok=True)
+    with open(payload['output_path'], 'wb') as f:
+        f.write(output)
+    return {'output_path': payload['output_path'], **info}
+
+
+@register_handler('enrich')
+def enrich(payload: dict) -> dict:
+    from tasc_core.api.openai_api import OpenAIClient
+    client = _model('openai', lambda: OpenAIClient(api_key=os.getenv('OPENAI_API_KEY')))
+    text = client.generate_image_prompt(payload['image_url'], payload['prompt'],
+                                        model=payload.get('model', 'gpt-4o'))
+    return {'text': text}
+
+
+@register_handler('stock_sync')
+def stock_sync(payload: dict) -> dict:
+    from tasc_core.utils.util_nebuladb import NebulaConnector
+    from tasc_core.utils.util_stock_sync import sync_stock
+    return sync_stock([payload['url']], nebula=_model('nebula', NebulaConnector))
+
+
+class Worker:
+    def __init__(self, queue: JobQueue, handlers: dict = None, worker_id: str = None, batch_size: int = 4,
+                 concurrency: int = 1, lease_seconds: float = 300, heartbeat_seconds: float = 60,
+                 idle_sleep: float = 2.0, retry_delay: float = 30, reap_seconds: float = 60,
+                 verbose: bool = True) -> None:
+        """
+        Args:
+            queue (JobQueue): Queue to claim from.
+            handlers (dict): Task name -> handler. Defaults to HANDLERS.
+            worker_id (str): Lease owner name. Defaults to host:pid:random.
+            batch_size (int): Jobs claimed per round trip.
+            concurrency (int): Jobs of a batch run at once, in threads.
+            lease_seconds (float): Lease length; a job is claimable again this long after its worker stops
+                heart-beating.
+            heartbeat_seconds (float): How often leases of running jobs are extended. Must be well under
+                lease_seconds.
+            idle_sleep (float): Wait before polling again when the queue is empty.
+            retry_delay (float): Failed jobs are retried after retry_delay * attempts seconds.
+            reap_seconds (float): How often jobs whose lease expired on their last attempt are marked failed (see
+                JobQueue.reap), checked after every batch and idle poll.
+        """
+        if heartbeat_seconds >= lease_seconds:
+            raise ValueError("heartbeat_seconds must be shorter than lease_seconds")
+        self.queue = queue
+        self.handlers = handlers if handlers is not None else HANDLERS
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.idle_sleep = idle_sleep
+        self.retry_delay = retry_delay
+        self.reap_seconds = reap_seconds
+        self.verbose = verbose
+        self.stats = {'done': 0, 'failed': 0, 'lost': 0, 'reaped': 0}
+        self._last_reap = 0.0
+        self._running = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def stop(self) -> None:
+        """Asks the worker to stop after the batch it is running."""
+        self._stop.set()
+
+    def _count(self, outcome: str) -> None:
+        with self._lock:
+            self.stats[outcome] += 1
+
+    def _heartbeat(self, finished: threading.Event) -> None:
+        while not finished.wait(self.heartbeat_seconds):
+            with self._lock:
+                running = list(self._running.values())
+            try:
+                held = self.queue.heartbeat(running, self.worker_id, self.lease_seconds)
+                lost = [job.job_id for job in running if job.job_id not in held]
+                if lost and self.verbose:
+                    print(f'{self.worker_id} lost leases of jobs {lost}')
+            except Exception as e:
+                print(f'Heartbeat failed: {e}')
+
+    def _run_job(self, job) -> None:
+        handler = self.handlers.get(job.task)
+        start = time.perf_counter()
+        try:
+            if handler is None:
+                raise ValueError(f"No handler for task {job.task}")
+            result = handler(job.payload)
+        except Exception as e:
+            metrics.inc(metrics.ERRORS, job=self.queue.queue, stage=job.task)
+            self._count('failed' if self.queue.fail(job, self.worker_id, f'{type(e).__name__}: {e}',
+                                                    self.retry_delay) else 'lost')
+            if self.verbose:
+                print(f'Job {job.job_id} ({job.task} {job.job_key}) failed on attempt {job.attempts}: {e}')
+            return
+        finally:
+            metrics.observe(metrics.STAGE_SECONDS, time.perf_counter() - start, job=self.queue.queue, stage=job.task)
+            with self._lock:
+                self._running.pop(job.job_id, None)
+        self._count('done' if self.queue.complete(job, self.worker_id, result) else 'lost')
+
+    def reap(self, force: bool = False) -> int:
+        """Marks failed the jobs that died on their last attempt, at most every reap_seconds unless forced."""
+        if not force and time.monotonic() - self._last_reap < self.reap_seconds:
+            return 0
+        self._last_reap = time.monotonic()
+        try:
+            reaped = self.queue.reap()
+        except Exception as e:
+            print(f'Reaping expired jobs failed: {e}')
+            return 0
+        self.stats['reaped'] += reaped
+        if reaped and self.verbose:
+            print(f'{self.worker_id} marked {reaped} expired jobs failed')
+        return reaped
+
+    def run_batch(self) -> int:
+        """Claims and runs one batch. Returns the number of jobs claimed."""
+        jobs = self.queue.claim(self.worker_id, self.batch_size, self.lease_seconds)
+        if not jobs:
+            return 0
+        with self._lock:
+            self._running.update({job.job_id: job for job in jobs})
+        finished = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(finished,), daemon=True)
+        heartbeat.start()
+        try:
+            if self.concurrency > 1:
+                with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                    list(executor.map(self._run_job, jobs))
+            else:
+                for job in jobs:
+                    self._run_job(job)
+        finally:
+            finished.set()
+            heartbeat.join()
+        return len(jobs)
+
+    def run(self, max_jobs: int = None, exit_when_empty: bool = False) -> dict:
+        """
+        Claims and runs jobs until stopped.
+
+        Args:
+            max_jobs (int): Stop after about this many jobs (a batch is always finished).
+            exit_when_empty (bool): Stop the first time the queue has nothing claimable.
+
+        Returns:
+            dict: Jobs done, failed and lost (lease expired before the result was written) by this worker, and jobs
+                reaped (their lease expired on the last attempt, whichever worker held it).
+        """
+        if self.verbose:
+            print(f'Worker {self.worker_id} on queue {self.queue.queue}')
+        claimed = 0
+        with metrics.profile_job(f'worker_{self.queue.queue}'):
+            while not self._stop.is_set() and (max_jobs is None or claimed < max_jobs):
+                count = self.run_batch()
+                claimed += count
+                self.reap(force=count == 0 and exit_when_empty)
+                if count == 0:
+                    if exit_when_empty:
+                        break
+                    self._stop.wait(self.idle_sleep)
+        if self.verbose:
+            print(f'Worker {self.worker_id} stopped: {self.stats}')
+        return dict(self.stats)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Run a tasc_core job queue worker')
+    parser.add_argument('--queue', required=True, help='Queue name to claim from')
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--lease-seconds', type=float, default=300)
+    parser.add_argument('--heartbeat-seconds', type=float, default=60)
+    parser.add_argument('--reap-seconds', type=float, default=60)
+    parser.add_argument('--max-jobs', type=int, default=None)
+    parser.add_argument('--exit-when-empty', action='store_true')
+    parser.add_argument('--metrics-port', type=int, default=None, help='Serve Prometheus metrics on this port')
+    args = parser.parse_args()
+
+    from tasc_core.utils.util_nebuladb import NebulaConnector
+
+    if args.metrics_port:
+        metrics.enable()
+        metrics.start_metrics_server(args.metrics_port)
+    worker = Worker(JobQueue(NebulaConnector(), args.queue), batch_size=args.batch_size,
+                    concurrency=args.concurrency, lease_seconds=args.lease_seconds,
+                    heartbeat_seconds=args.heartbeat_seconds, reap_seconds=args.reap_seconds)
+    try:
+        worker.run(max_jobs=args.max_jobs, exit_when_empty=args.exit_when_empty)
+    except KeyboardInterrupt:
+        worker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""Per-garment colours: one decode, one Mask R-CNN pass, then colour clustering inside each instance mask.
+
+ImageProcessor.extract_colors clusters the whole image, so a lookbook photo of a jacket, trousers and shoes gets one
+blended palette. GarmentColourModel runs detection on the decoded image and clusters only the pixels of each
+detected instance, in parallel threads, giving one palette per garment along with its class.
+
+Where masks overlap (a jacket worn over a shirt), each pixel is given to the highest scoring instance, so the
+visible garment owns it.
+
+The default predictor is the COCO Mask R-CNN used in image_object_detection. COCO only knows a few apparel classes
+(tie, handbag, backpack...), so for slot-level colours pass a predictor trained on a fashion dataset such as
+DeepFashion2 or ModaNet, with its class names.
+
+Example:
+    model = GarmentColourModel()
+    for garment in model.extract(image_url="https://cdn.shopify.com/s/files/1/example-lookbook.jpg"):
+        print(garment['class_name'], garment['score'], garment['colours'])
+"""
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from tasc_core.models.image_recognition.image_colour_recognition_model import ImageProcessor
+from tasc_core.utils import util_metrics as metrics
+from tasc_core.utils.util_http import get_transport
+
+DEFAULT_CONFIG = 'COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml'
+
+
+def build_predictor(config: str = DEFAULT_CONFIG, weights: str = None, score_threshold: float = 0.5,
+                    device: str = None) -> tuple:
+    """
+    Builds a Detectron2 predictor from a model zoo config.
+
+    Args:
+        config (str): Model zoo config path.
+        weights (str): Checkpoint path or URL. Defaults to the model zoo checkpoint of `config`.
+        score_threshold (float): Instances scoring below this are dropped.
+        device (str): "cpu" or "cuda". Defaults to Detectron2's choice.
+
+    Returns:
+        tuple: The DefaultPredictor and the list of class names of its training dataset.
+    """
+    from detectron2 import model_zoo
+    from detectron2.config import get_cfg
+    from detectron2.data import MetadataCatalog
+    from detectron2.engine import DefaultPredictor
+
+    cfg = get_cfg()
+    cfg.merge_from_file(model_zoo.get_config_file(config))
+    cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = score_threshold
+    cfg.MODEL.WEIGHTS = weights or model_zoo.get_checkpoint_url(config)
+    if device:
+        cfg.MODEL.DEVICE = device
+    class_names = MetadataCatalog.get(cfg.DATASETS.TRAIN[0]).get('thing_classes', None) or []
+    return DefaultPredictor(cfg), list(class_names)
+
+
+class GarmentColourModel:
+    def __init__(self, predictor=None, class_names: list = None, classes: list = None, min_mask_pixels: int = 400,
+                 max_workers: int = 4, processor: ImageProcessor = None) -> None:
+        """
+        Args:
+            predictor: A Detectron2 predictor (or any callable returning {'instances': Instances} for a BGR array).
+                Built with build_predictor() on first use when None.
+            class_names (list): Names of the predictor's class ids. Defaults to those of build_predictor().
+            classes (list): Only keep instances of these class names. Keeps all when None.
+            min_mask_pixels (int): Instances with fewer visible pixels are skipped, they are too small to colour.
+            max_workers (int): Threads clustering masks of one image concurrently.
+            processor (ImageProcessor): Does the colour clustering.
+        """
+        self.predictor = predictor
+        self.class_names = class_names
+        self.classes = set(classes) if classes else None
+        self.min_mask_pixels = min_mask_pixels
+        self.max_workers = max_workers
+        self.processor = processor or ImageProcessor()
+
+    def _load(self) -> None:
+        if self.predictor is None:
+            self.predictor, class_names = build_predictor()
+            if self.class_names is None:
+                self.class_names = class_names
+
+    @staticmethod
+    def decode(image=None, image_url: str = None, image_path: str = None) -> np.ndarray:
+        """Decodes the image once into the RGB array shared by detection and clustering."""
+        if image is None:
+            if image_url:
+                data = get_transport().fetch_bytes(image_url, target="image")
+            elif image_path:
+                with open(image_path, 'rb') as f:
+                    data = f.read()
+            else:
+                raise Exception("No image source provided!")
+            with metrics.timer(metrics.DECODE_SECONDS):
+                image = Image.open(BytesIO(data))
+                image.load()
+        if isinstance(image, Image.Image):
+            return np.asarray(image.convert('RGB'))
+        return np.asarray(image)
+
+    def detect(self, rgb: np.ndarray) -> list:
+        """
+        Runs the predictor and resolves overlapping masks.
+
+        Returns:
+            list: One dict per kept instance with class_id, class_name, score, box and its pixel mask.
+        """
+        self._load()
+        with metrics.timer(metrics.INFERENCE_SECONDS, model="mask_rcnn"):
+            outputs = self.predictor(np.ascontiguousarray(rgb[:, :, ::-1]))  # Detectron2 expects BGR
+        instances = outputs['instances'].to('cpu')
+        if len(instances) == 0:
+            return []
+        masks = instances.pred_masks.numpy().astype(bool)
+        scores = instances.scores.numpy()
+        class_ids = instances.pred_classes.numpy()
+        boxes = instances.pred_boxes.tensor.numpy()
+
+        # Each pixel belongs to the highest scoring instance covering it
+        owner = np.where(masks.any(axis=0), np.argmax(masks * scores[:, None, None], axis=0), -1)
+        detections = []
+        for i in np.argsort(-scores):
+            class_id = int(class_ids[i])
+            class_name = self.class_names[class_id] if self.class_names and class_id < len(self.class_names) \
+                else str(class_id)
+            if self.classes is not None and class_name not in self.classes:
+                continue
+            mask = owner == i
+            if mask.sum() < self.min_mask_pixels:
+                continue
+            detections.append({'class_id': class_id, 'class_name': class_name, 'score': float(scores[i]),
+                               'box': [round(float(v), 1) for v in boxes[i]], 'mask': mask})
+        return detections
+
+    def extract(self, image=None, image_url: str = None, image_path: str = None, return_masks: bool = False) -> list:
+        """
+        Detects garments and extracts the dominant colours of each.
+
+        Args:
+            image (PIL.Image | np.ndarray): An already decoded RGB image.
+            image_url (str): URL to fetch the image from.
+            image_path (str): Local path to load the image from.
+            return_masks (bool): Keep each instance's boolean mask in the result.
+
+        Returns:
+            list: Per-garment dicts, highest score first: class_id, class_name, score, box (x0, y0, x1, y1), pixels,
+                colours (up to 3 hex colours, dominant first) and lab (their OpenCV LAB centres).
+        """
+        rgb = self.decode(image, image_url, image_path)
+        detections = self.detect(rgb)
+
+        def colour(detection: dict) -> dict:
+            pixels = rgb[detection['mask']]
+            detection['pixels'] = int(len(pixels))
+            detection['colours'], detection['lab'] = self.processor.extract_colors_from_pixels(pixels,
+                                                                                               return_lab=True)
+            if not return_masks:
+                del detection['mask']
+            return detection
+
+        if len(detections) <= 1:
+            return [colour(detection) for detection in detections]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(detections))) as executor:
+            return list(executor.map(colour, detections))
+
+
+# Example usage
+if __name__ == "__main__":
+    model = GarmentColourModel()
+    image_path = "lookbook.jpg"
+
+    try:
+        for garment in model.extract(image_path=image_path):
+            print(f"{garment['class_name']} ({garment['score']:.2f}): {garment['colours']}")
+    except Exception as e:
+        print(e)
@@ -1,24 +1,29 @@
-import requests
 from PIL import Image
 from io import BytesIO
 import numpy as np
 from sklearn.cluster import KMeans, MeanShift
 from sklearn.metrics import silhouette_score
 import cv2
+from tasc_core.utils import util_metrics as metrics
+from tasc_core.utils.util_http import get_transport
 
 
 class ImageProcessor:
-    def __init__(self, num_colors=3):
+    def __init__(self, num_colors=3, random_state=None):
         self.num_colors = num_colors
+        # Seed for the KMeans fits of extract_colors, set it for repeatable palettes
+        self.random_state = random_state
 
     def fetch_image_from_url(self, image_url):
         """Fetches an image from a given URL."""
-        response = requests.get(image_url)
-        if response.status_code == 200:
-            image = Image.open(BytesIO(response.content))
-            return image
-        else:
-            raise Exception(f"Failed to fetch image. Status code: {response.status_code}")
+        try:
+            content = get_transport().fetch_bytes(image_url, target="image")
+        except Exception as err:
+            raise Exception(f"Failed to fetch image: {err}")
+        with metrics.timer(metrics.DECODE_SECONDS):
+            image = Image.open(BytesIO(content))
+            image.load()
+        return image
 
     def load_image_from_path(self, image_path):
         """Loads an image from a local file path."""
@@ -47,10 +52,11 @@ class ImageProcessor:
         best_score = -1
 
         for n_clusters in range(2, max_clusters + 1):
-            kmeans = KMeans(n_clusters=n_clusters)
-            labels = kmeans.fit_predict(processed_image)
-
-            score = silhouette_score(processed_image, labels)
+            with metrics.timer(metrics.CLUSTERING_SECONDS, algorithm="kmeans_search"):
+                kmeans = KMeans(n_clusters=n_clusters, random_state=self.random_state)
+                labels = kmeans.fit_predict(processed_image)
+            with metrics.timer(metrics.CLUSTERING_SECONDS, algorithm="silhouette"):
+                score = silhouette_score(processed_image, labels)
             if score > best_score:
                 best_num_clusters = n_clusters
                 best_score = score
@@ -63,8 +69,9 @@ class ImageProcessor:
         processed_image = self.pre_process_image(image)
 
         # Fit KMeans to the processed image
-        kmeans = KMeans(n_clusters=self.num_colors)
-        kmeans.fit(processed_image)
+        kmeans = KMeans(n_clusters=self.num_colors, random_state=self.random_state)
+        with metrics.timer(metrics.CLUSTERING_SECONDS, algorithm="kmeans"):
+            kmeans.fit(processed_image)
 
         # Extract the cluster centers (dominant colors)
         colors = kmeans.cluster_centers_[:, :3].astype(int)  # Use only LAB colors
@@ -76,28 +83,66 @@ class ImageProcessor:
 
         # Fit MeanShift to the image
         meanshift = MeanShift()
-        meanshift.fit(processed_image)
+        with metrics.timer(metrics.CLUSTERING_SECONDS, algorithm="meanshift"):
+            meanshift.fit(processed_image)
 
         # Extract the cluster centers (dominant colors)
         colors = meanshift.cluster_centers_[:, :3].astype(int)  # Use only LAB colors
         return [tuple(color) for color in colors]
 
+    def extract_colors_from_pixels(self, pixels, max_clusters=6, max_pixels=22500, return_lab=False):
+        """
+        Clusters an arbitrary set of RGB pixels, e.g. the pixels inside one detection mask:
+        - Subsamples to at most max_pixels (the pixel count of the 150x150 image pre_process_image uses)
+        - Picks the cluster count by silhouette score on a sample, like find_optimal_clusters
+        - Returns colours ordered by the share of pixels they cover, dominant first
+
+        Leaves self.num_colors untouched, so one processor can cluster several regions in parallel threads.
+        """
+        pixels = np.asarray(pixels, dtype=np.uint8).reshape(-1, 3)
+        if len(pixels) == 0:
+            return ([], []) if return_lab else []
+        if len(pixels) > max_pixels:
+            pixels = pixels[np.random.default_rng(0).choice(len(pixels), max_pixels, replace=False)]
+        lab_pixels = cv2.cvtColor(pixels.reshape(1, -1, 3), cv2.COLOR_RGB2LAB).reshape(-1, 3).astype(np.float32)
+
+        distinct = len(np.unique(lab_pixels, axis=0))
+        best_labels, best_centres, best_score = np.zeros(len(lab_pixels), dtype=int), lab_pixels[:1], -1
+        for n_clusters in range(2, min(max_clusters, distinct) + 1):
+            with metrics.timer(metrics.CLUSTERING_SECONDS, algorithm="kmeans_region"):
+                kmeans = KMeans(n_clusters=n_clusters, n_init=3, random_state=0)
+                labels = kmeans.fit_predict(lab_pixels)
+            with metrics.timer(metrics.CLUSTERING_SECONDS, algorithm="silhouette"):
+                score = silhouette_score(lab_pixels, labels, sample_size=min(len(lab_pixels), 2000), random_state=0)
+            if score > best_score:
+                best_labels, best_centres, best_score = labels, kmeans.cluster_centers_, score
+
+        order = np.argsort(-np.bincount(best_labels, minlength=len(best_centres)))
+        colors = [tuple(color) for color in best_centres[order].astype(int)]
+        hex_colors = self.colors_to_hex(colors)
+        if return_lab:
+            return hex_colors[:3], colors[:3]
+        return hex_colors[:3]
+
     def colors_to_hex(self, colors):
-        """Converts LAB colors to RGB and then to hexadecimal."""
-        hex_colors = []
-        for color in colors:
-            lab_color = np.uint8([[list(color)]])
-            rgb_color = cv2.cvtColor(lab_color, cv2.COLOR_LAB2RGB)[0][0]
-            hex_colors.append('#{:02x}{:02x}{:02x}'.format(rgb_color[0], rgb_color[1], rgb_color[2]))
-        return hex_colors
-
-    def extract_colors(self, image_url=None, image_path=None, use_meanshift=False):
+        """Converts LAB colors to RGB and then to hexadecimal in a single cvtColor call."""
+        if len(colors) == 0:
+            return []
+        lab_colors = np.clip(np.asarray(colors), 0, 255).astype(np.uint8).reshape(1, -1, 3)
+        rgb_colors = cv2.cvtColor(lab_colors, cv2.COLOR_LAB2RGB)[0]
+        return ['#{:02x}{:02x}{:02x}'.format(r, g, b) for r, g, b in rgb_colors]
+
+    def extract_colors(self, image_url=None, image_path=None, use_meanshift=False, return_lab=False, image=None):
         """
         Full process to extract the best 3 dominant colors:
-        - Can fetch from URL or load from path
+        - Can fetch from URL, load from path or take an already decoded PIL image
         - Uses KMeans as the default, can use MeanShift if specified
+        - If return_lab is True, also returns the OpenCV LAB cluster centres so they can be
+          added to a ColourIndex without a second pass over the pixels
         """
-        if image_url:
+        if image is not None:
+            image = image.convert("RGB")
+        elif image_url:
             image = self.fetch_image_from_url(image_url)
         elif image_path:
             image = self.load_image_from_path(image_path)
@@ -118,6 +163,8 @@ class ImageProcessor:
         hex_colors = self.colors_to_hex(colors)
 
         # Return only the top 3 dominant colors in hex format
+        if return_lab:
+            return hex_colors[:3], colors[:3]
         return hex_colors[:3]
 
 
@@ -0,0 +1,235 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from tasc_core.utils.util_http import get_transport
+
+IMAGE_URL_COLUMNS = [f'product_image_{i}_url' for i in range(1, 6)]
+
+# Query parameters that never change the image served
+TRACKING_PARAMS = {'fbclid', 'gclid', '_pos', '_sid', '_ss'}
+
+
+def normalise_image_url(image_url: str) -> str:
+    """Normalises an image URL so trivially different references to one file compare equal.
+
+    The scheme and fragment are dropped, the host is lower-cased and tracking parameters (utm_*, TRACKING_PARAMS)
+    are removed, with the rest of the query sorted. Shopify's `?v=` is kept: a product image replaced at the same
+    CDN path gets a new `v`, and must be hashed again rather than inherit the old image's id.
+    """
+    parts = urlsplit(image_url.strip())
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if k not in TRACKING_PARAMS and not k.startswith('utm_'))
+    return urlunsplit(('https', parts.netloc.lower(), parts.path, urlencode(query), ''))
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int(np.packbits(bits.astype(np.uint8).ravel()).view('>u8')[0])
+
+
+def _grayscale(image: Image.Image, size: tuple) -> np.ndarray:
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGBA', image.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, image)
+    return np.asarray(image.convert('L').resize(size, Image.LANCZOS), dtype=np.float32)
+
+
+def average_hash(image: Image.Image) -> int:
+    """64-bit aHash: 8x8 grayscale thumbnail thresholded at its mean."""
+    pixels = _grayscale(image, (8, 8))
+    return _bits_to_int(pixels > pixels.mean())
+
+
+def difference_hash(image: Image.Image) -> int:
+    """64-bit dHash: sign of the horizontal gradient of a 9x8 grayscale thumbnail."""
+    pixels = _grayscale(image, (9, 8))
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def perceptual_hash(image: Image.Image) -> int:
+    """64-bit pHash: low-frequency 8x8 block of the DCT of a 32x32 thumbnail, thresholded at its median."""
+    pixels = _grayscale(image, (32, 32))
+    low = cv2.dct(pixels)[:8, :8].ravel()
+    # the DC term dominates the median, so it is excluded when computing the threshold
+    return _bits_to_int(low > np.median(low[1:]))
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class HammingIndex:
+    """Multi-index hashing over 64-bit hashes for Hamming-radius lookup.
+
+    Each hash is split into `blocks` chunks of 64 // blocks bits (16 bits for max_radius 3, 8 bits for 7), with one
+    exact-match table per chunk. By the pigeonhole principle two hashes within distance r < blocks share at least one
+    identical chunk, so only the rows in the matching buckets need a full popcount check instead of the whole
+    collection.
+    """
+
+    def __init__(self, max_radius: int = 3) -> None:
+        # 16 chunks of 4 bits is the finest split worth indexing
+        if not 0 <= max_radius < 16:
+            raise ValueError(f"max_radius must be between 0 and 15, got {max_radius}")
+        self.blocks = max_radius + 1
+        if 64 % self.blocks:
+            self.blocks = next(b for b in (2, 4, 8, 16) if b > max_radius)
+        self.block_bits = 64 // self.blocks
+        self.max_radius = max_radius
+        self.hashes = []
+        self.values = []
+        self._tables = [{} for _ in range(self.blocks)]
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def _chunks(self, value: int) -> list:
+        mask = (1 << self.block_bits) - 1
+        return [(value >> (i * self.block_bits)) & mask for i in range(self.blocks)]
+
+    def add(self, value: int, payload) -> None:
+        row = len(self.hashes)
+        self.hashes.append(value)
+        self.values.append(payload)
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            table.setdefault(chunk, []).append(row)
+
+    def query(self, value: int, radius: int = None) -> list:
+        """Returns (payload, distance) for every stored hash within `radius` of `value`, closest first."""
+        radius = self.max_radius if radius is None else radius
+        if radius > self.max_radius:
+            raise ValueError(f"radius {radius} is larger than the index max_radius {self.max_radius}")
+        rows = set()
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            rows.update(table.get(chunk, ()))
+        hits = [(self.values[row], hamming_distance(value, self.hashes[row])) for row in rows]
+        return sorted([hit for hit in hits if hit[1] <= radius], key=lambda hit: hit[1])
+
+
+class ImageDeduplicator:
+    """Maps image URLs to canonical image ids so downstream models run once per unique image.
+
+    URLs are first collapsed by normalise_image_url, which needs no download. Remaining URLs are downloaded and
+    hashed in batch; an image is a duplicate of an existing canonical image when both its pHash and dHash are
+    within `radius` bits. The canonical id is derived from the pHash of the first image seen in a group.
+
+    Example:
+        dedup = ImageDeduplicator()
+        df = dedup.dedupe_dataframe(df)           # adds product_image_1_id..product_image_5_id
+        for image_id, image_url in dedup.unique_images().items():
+            processor.extract_colors(image_url=image_url)
+    """
+
+    def __init__(self, radius: int = 3, max_workers: int = 8, timeout: float = 10.0,
+                 retry_after: float = 600.0) -> None:
+        """
+        Args:
+            radius (int): Hamming distance, in bits, up to which two hashes count as the same image. At most 15.
+            max_workers (int): Download threads.
+            timeout (float): Per-request timeout in seconds.
+            retry_after (float): Seconds before a URL whose download or hashing failed is tried again.
+        """
+        self.radius = radius
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.url_to_id = {}
+        self._failed_until = {}
+        self.canonical_urls = {}
+        self.hashes = {}
+        self._normalised_to_id = {}
+        self._phash_index = HammingIndex(max_radius=radius)
+
+    def _fetch_and_hash(self, image_url: str):
+        try:
+            data = get_transport().fetch_bytes(image_url, target="image", timeout=self.timeout)
+            image = Image.open(BytesIO(data))
+            return average_hash(image), difference_hash(image), perceptual_hash(image)
+        except Exception as e:
+            print(f"Could not hash image {image_url}: {e}")
+            return None
+
+    def hash_urls(self, image_urls: list) -> list:
+        """Downloads and hashes a batch of URLs concurrently. Failed downloads return None."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(self._fetch_and_hash, image_urls))
+
+    def assign(self, image_url: str, hashes: tuple) -> str:
+        """Assigns an already-hashed image to a canonical id, creating a new one if no near-duplicate exists."""
+        a_hash, d_hash, p_hash = hashes
+        for image_id, _ in self._phash_index.query(p_hash, self.radius):
+            if hamming_distance(d_hash, self.hashes[image_id][1]) <= self.radius:
+                return image_id
+
+        image_id = f'img_{p_hash:016x}'
+        suffix = 1
+        while image_id in self.hashes:
+            image_id = f'img_{p_hash:016x}_{suffix}'
+            suffix += 1
+        self.hashes[image_id] = (a_hash, d_hash, p_hash)
+        self.canonical_urls[image_id] = image_url
+        self._phash_index.add(p_hash, image_id)
+        return image_id
+
+    def add_urls(self, image_urls: list) -> dict:
+        """Maps a batch of image URLs to canonical image ids. Unhashable images map to None and are retried by
+        later calls once retry_after seconds have passed.
+
+        Args:
+            image_urls (list): image URLs, duplicates allowed
+
+        Returns:
+            dict: image_url -> canonical image id
+        """
+        to_hash = []
+        now = time.monotonic()
+        for url in dict.fromkeys(u for u in image_urls if u):
+            if url in self.url_to_id or self._failed_until.get(url, 0) > now:
+                continue
+            normalised = normalise_image_url(url)
+            if normalised in self._normalised_to_id:
+                self.url_to_id[url] = self._normalised_to_id[normalised]
+            else:
+                to_hash.append(url)
+
+        # URLs that only differ after normalisation within this batch are downloaded once
+        first_of = {}
+        for url in to_hash:
+            first_of.setdefault(normalise_image_url(url), url)
+        unique = list(first_of.values())
+
+        for url, hashes in zip(unique, self.hash_urls(unique)):
+            if hashes:
+                image_id = self.assign(url, hashes)
+                self.url_to_id[url] = image_id
+                self._normalised_to_id[normalise_image_url(url)] = image_id
+        retry_at = time.monotonic() + self.retry_after
+        for url in to_hash:
+            image_id = self.url_to_id.get(first_of[normalise_image_url(url)])
+            if image_id:
+                self.url_to_id[url] = image_id
+                self._failed_until.pop(url, None)
+            else:
+                self._failed_until[url] = retry_at
+
+        return {url: self.url_to_id.get(url) for url in image_urls if url}
+
+    def dedupe_dataframe(self, df):
+        """Adds a product_image_{i}_id column next to every product_image_{i}_url column of a parser DataFrame."""
+        columns = [col for col in IMAGE_URL_COLUMNS if col in df.columns]
+        urls = df[columns].stack().dropna().unique().tolist()
+        mapping = self.add_urls(urls)
+        df = df.copy()
+        for col in columns:
+            df[col.replace('_url', '_id')] = df[col].map(mapping)
+        return df
+
+    def unique_images(self) -> dict:
+        """Returns canonical image id -> one representative URL to run models on."""
+        return dict(self.canonical_urls)
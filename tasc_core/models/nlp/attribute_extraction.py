@@ -0,0 +1,321 @@
+import json
+import re
+
+import pandas as pd
+
+from tasc_core.models.color_matching.colour_index import NAMED_COLOURS
+from tasc_core.models.nlp.text_search_index import strip_html
+
+# Canonical value -> surface forms. Every surface form also matches its plural through the matcher.
+MATERIALS = {
+    'cotton': ['cotton', 'organic cotton', 'pima cotton', 'supima'],
+    'linen': ['linen', 'flax'],
+    'wool': ['wool', 'lambswool', 'virgin wool', 'boiled wool'],
+    'merino': ['merino', 'merino wool'],
+    'cashmere': ['cashmere'],
+    'silk': ['silk'],
+    'denim': ['denim', 'selvedge', 'selvage'],
+    'leather': ['leather', 'calfskin', 'lambskin', 'nappa', 'full grain'],
+    'suede': ['suede', 'nubuck'],
+    'polyester': ['polyester', 'recycled polyester'],
+    'nylon': ['nylon', 'polyamide', 'ripstop'],
+    'viscose': ['viscose', 'rayon', 'lyocell', 'tencel', 'modal'],
+    'elastane': ['elastane', 'spandex', 'lycra'],
+    'fleece': ['fleece', 'sherpa', 'polar fleece'],
+    'corduroy': ['corduroy', 'cord'],
+    'jersey': ['jersey'],
+    'canvas': ['canvas'],
+    'mesh': ['mesh'],
+    'gore-tex': ['gore-tex', 'goretex', 'gore tex'],
+}
+
+STYLES = {
+    'casual': ['casual', 'everyday', 'laid back', 'relaxed style'],
+    'formal': ['formal', 'tailored', 'tailoring', 'suit', 'suiting', 'evening'],
+    'smart casual': ['smart casual', 'smart'],
+    'streetwear': ['streetwear', 'street', 'graphic', 'skate'],
+    'athletic': ['athletic', 'sport', 'sports', 'training', 'running', 'gym', 'performance', 'activewear'],
+    'vintage': ['vintage', 'retro', 'heritage', 'washed', 'distressed'],
+    'minimalist': ['minimal', 'minimalist', 'essential', 'essentials', 'basic', 'basics'],
+    'outdoor': ['outdoor', 'hiking', 'trail', 'technical', 'waterproof'],
+}
+
+SEASONS = {
+    'summer': ['summer', 'ss', 'spring/summer', 'lightweight', 'beach', 'swim', 'short sleeve'],
+    'winter': ['winter', 'aw', 'autumn/winter', 'insulated', 'padded', 'puffer', 'thermal', 'heavyweight'],
+    'spring': ['spring'],
+    'autumn': ['autumn', 'fall'],
+    'all season': ['all season', 'all-season', 'year round', 'year-round', 'trans-seasonal'],
+}
+
+FITS = {
+    'slim': ['slim', 'slim fit', 'skinny', 'fitted', 'tapered'],
+    'regular': ['regular', 'regular fit', 'classic fit', 'true to size', 'standard fit'],
+    'relaxed': ['relaxed', 'relaxed fit', 'loose', 'loose fit', 'easy fit'],
+    'oversized': ['oversized', 'oversize', 'boxy', 'drop shoulder', 'dropped shoulder'],
+    'wide': ['wide', 'wide leg', 'wide fit', 'baggy'],
+    'straight': ['straight', 'straight leg', 'straight fit'],
+    'narrow': ['narrow', 'narrow fit'],
+}
+
+CLOTHING_TYPES = ['shirt', 't-shirt', 'tee', 'top', 'tank', 'vest', 'blouse', 'polo', 'hoodie', 'hoody', 'sweatshirt',
+                  'sweater', 'jumper', 'cardigan', 'knit', 'crewneck', 'dress', 'skirt', 'jeans', 'trousers', 'pants',
+                  'chinos', 'joggers', 'sweatpants', 'leggings', 'shorts', 'jacket', 'coat', 'parka', 'blazer',
+                  'gilet', 'overshirt', 'suit', 'jumpsuit', 'romper', 'dungarees', 'overalls', 'bodysuit', 'bra',
+                  'briefs', 'boxers', 'underwear', 'pyjamas', 'swimsuit', 'bikini', 'clothing', 'apparel']
+FOOTWEAR_TYPES = ['shoe', 'sneaker', 'trainer', 'boot', 'loafer', 'sandal', 'slide', 'mule', 'heel', 'derby',
+                  'oxford', 'brogue', 'espadrille', 'slipper', 'clog', 'footwear', 'dress shoe']
+ACCESSORY_TYPES = ['bag', 'belt', 'hat', 'cap', 'beanie', 'scarf', 'glove', 'sock', 'wallet', 'sunglasses',
+                   'jewellery', 'jewelry', 'necklace', 'ring', 'bracelet', 'earring', 'watch', 'tie', 'keyring',
+                   'accessory', 'accessories', 'tote', 'backpack']
+# Garment details that contain a footwear or accessory word. The matcher prefers the longest form, so these
+# phrases shadow the single words inside them ("tie-dye hoodie" is not a tie, "cap sleeve dress" not a cap).
+GARMENT_DETAILS = ['tie dye', 'tie front', 'tie waist', 'tie neck', 'self tie', 'cap sleeve', 'belt loop', 'belted',
+                   'watch pocket', 'boot cut', 'boot leg', 'ring spun', 'bag pocket', 'heel tab', 'glove fit']
+
+ALPHA_SIZES = ['XXXS', 'XXS', 'XS', 'S', 'M', 'L', 'XL', 'XXL', 'XXXL', '2XL', '3XL', '4XL', 'ONE SIZE', 'OS']
+
+# Relative trust in each source text field; a title hit is worth more than a passing mention in the description.
+FIELD_WEIGHTS = {'product_title': 1.0, 'tags': 0.9, 'product_type': 0.8, 'product_desc': 0.5}
+
+
+class VocabularyMatcher:
+    """Precompiled matcher mapping every surface form of a vocabulary to its canonical value.
+
+    All surface forms are compiled into a single case-insensitive regex alternation, longest form first and
+    bounded by word edges, so one scan over a text finds every vocabulary hit. Python's regex engine shares
+    common prefixes across the alternation, which gives Aho-Corasick-like behaviour without an extra dependency.
+    """
+
+    def __init__(self, vocabulary: dict) -> None:
+        self.canonical = {}
+        for value, forms in vocabulary.items():
+            for form in [value] + list(forms):
+                self.canonical[form.lower()] = value
+        forms = sorted(self.canonical, key=len, reverse=True)
+        alternation = '|'.join(re.escape(form).replace(r'\ ', r'[\s\-]+') for form in forms)
+        self.pattern = re.compile(rf'(?<![a-z0-9])(?:{alternation})(?:e?s)?(?![a-z0-9])', re.IGNORECASE)
+
+    def _lookup(self, match: str):
+        match = re.sub(r'[\s\-]+', ' ', match.lower())
+        if match in self.canonical:
+            return self.canonical[match]
+        for suffix in ('es', 's'):
+            if match.endswith(suffix) and match[:-len(suffix)] in self.canonical:
+                return self.canonical[match[:-len(suffix)]]
+        return self.canonical.get(match.replace(' ', '-'))
+
+    def find(self, text: str) -> list:
+        """Returns the canonical values of every hit in `text`, in order of appearance."""
+        if not text:
+            return []
+        return [value for value in (self._lookup(m) for m in self.pattern.findall(text)) if value]
+
+    def find_series(self, texts: pd.Series) -> pd.Series:
+        """Vectorised find() over a Series of texts."""
+        hits = texts.fillna('').astype(str).str.findall(self.pattern)
+        return hits.map(lambda matches: [value for value in map(self._lookup, matches) if value])
+
+
+def normalise_sizes(sizes: str) -> str:
+    """Normalises a parser `sizes` string ("s, M, Large, UK 8") into canonical comma-separated sizes."""
+    words = {'extra small': 'XS', 'small': 'S', 'medium': 'M', 'large': 'L', 'extra large': 'XL',
+             'one size': 'ONE SIZE', 'os': 'ONE SIZE'}
+    if sizes is None or pd.isna(sizes):
+        return ''
+    result = []
+    for size in str(sizes).split(','):
+        size = size.strip()
+        if not size:
+            continue
+        key = size.lower()
+        if key in words:
+            size = words[key]
+        elif size.upper() in ALPHA_SIZES:
+            size = size.upper()
+        if size not in result:
+            result.append(size)
+    return ', '.join(result)
+
+
+class AttributeExtractor:
+    """Batched rule-plus-dictionary extraction of Apparel attributes from ShopifyProductParser output.
+
+    Each attribute vocabulary is matched against title, tags, product_type and the HTML-stripped description.
+    Hits are weighted by FIELD_WEIGHTS, the highest scoring canonical value wins, and its confidence is its share
+    of the total weight scaled by the strongest field it was seen in. Rows whose confidence falls below a
+    threshold can be sent to an LLM with fill_low_confidence(); everything else never touches the model.
+
+    Example:
+        parser = ShopifyProductParser(url)
+        parser.load_json()
+        df = parser.to_dataframe()
+
+        extractor = AttributeExtractor()
+        attributes = extractor.extract(df)
+        attributes = extractor.fill_low_confidence(df, attributes, OpenAIClient(api_key))
+    """
+
+    def __init__(self, vocabularies: dict = None, field_weights: dict = None) -> None:
+        vocabularies = vocabularies or {
+            'material': MATERIALS,
+            'style': STYLES,
+            'season': SEASONS,
+            'fit': FITS,
+            'colour': {name: [] for name in NAMED_COLOURS},
+        }
+        self.matchers = {name: VocabularyMatcher(vocabulary) for name, vocabulary in vocabularies.items()}
+        self.field_weights = field_weights or FIELD_WEIGHTS
+        self.type_matcher = VocabularyMatcher({'Clothing': CLOTHING_TYPES, 'Footwear': FOOTWEAR_TYPES,
+                                               'Accessory': ACCESSORY_TYPES, 'detail': GARMENT_DETAILS})
+
+    def _field_texts(self, df: pd.DataFrame) -> dict:
+        texts = {}
+        for field in self.field_weights:
+            if field not in df.columns:
+                continue
+            column = df[field].fillna('').astype(str)
+            texts[field] = column.map(strip_html) if field == 'product_desc' else column
+        return texts
+
+    @staticmethod
+    def _resolve(weighted_hits: list) -> tuple:
+        scores = {}
+        best_field = {}
+        for value, weight in weighted_hits:
+            scores[value] = scores.get(value, 0.0) + weight
+            best_field[value] = max(best_field.get(value, 0.0), weight)
+        if not scores:
+            return None, 0.0
+        value = max(scores, key=scores.get)
+        return value, round(scores[value] / sum(scores.values()) * best_field[value], 3)
+
+    def _apparel_type(self, row_texts: list) -> str:
+        """Decides from the first text, in order of trust, that names a type. A garment word wins within it."""
+        for text in row_texts:
+            hits = [value for value in self.type_matcher.find(text) if value != 'detail']
+            if 'Clothing' in hits:
+                return 'Clothing'
+            footwear, accessory = hits.count('Footwear'), hits.count('Accessory')
+            if footwear > accessory:
+                return 'Footwear'
+            if accessory > footwear:
+                return 'Accessory'
+        return 'Clothing'
+
+    def extract(self, df: pd.DataFrame, chunk_size: int = 5000) -> pd.DataFrame:
+        """Turns parser rows into typed attribute columns.
+
+        Descriptions are identical across the variants of a product, so matching runs once per parent product
+        and the result is broadcast back to the variant rows.
+
+        Args:
+            df (DataFrame): output of ShopifyProductParser.to_dataframe() or a tasc_products_shopify read
+            chunk_size (int, optional): products matched per chunk, to bound peak memory. Defaults to 5000.
+
+        Returns:
+            DataFrame: indexed like `df`, with apparel_type, size and one value and `<name>_confidence` column
+            per attribute vocabulary. Value columns are object dtype with None where nothing was found.
+        """
+        key = 'parent_product_id' if 'parent_product_id' in df.columns else None
+        products = df.drop_duplicates(subset=[key]) if key else df
+
+        chunks = []
+        for start in range(0, len(products), chunk_size):
+            chunk = products.iloc[start:start + chunk_size]
+            texts = self._field_texts(chunk)
+            result = pd.DataFrame(index=chunk.index)
+
+            for name, matcher in self.matchers.items():
+                per_field = {field: matcher.find_series(text) for field, text in texts.items()}
+                resolved = [
+                    self._resolve([(value, self.field_weights[field])
+                                   for field in per_field for value in per_field[field].iat[i]])
+                    for i in range(len(chunk))
+                ]
+                result[name] = pd.Series([value for value, _ in resolved], index=chunk.index, dtype=object)
+                result[f'{name}_confidence'] = [confidence for _, confidence in resolved]
+
+            type_texts = [texts[f] for f in ('product_type', 'product_title', 'tags') if f in texts]
+            result['apparel_type'] = [self._apparel_type([t.iat[i] for t in type_texts]) for i in range(len(chunk))]
+            if key:
+                result[key] = chunk[key].values
+            chunks.append(result)
+
+        attributes = pd.concat(chunks) if chunks else pd.DataFrame()
+        if key:
+            attributes = df[[key]].merge(attributes, on=key, how='left').set_index(df.index).drop(columns=[key])
+        sizes = df['sizes'].map(normalise_sizes) if 'sizes' in df.columns else pd.Series('', index=df.index)
+        attributes['size'] = pd.Series([size or None for size in sizes], index=df.index, dtype=object)
+        return attributes
+
+    def low_confidence_mask(self, attributes: pd.DataFrame, threshold: float = 0.5, names: list = None):
+        """Boolean mask of rows where any of `names` has confidence below `threshold` and no LLM answer yet."""
+        names = names or [name for name in self.matchers if name != 'colour']
+        mask = (attributes[[f'{name}_confidence' for name in names]] < threshold).any(axis=1)
+        if 'llm_filled' in attributes.columns:
+            mask &= ~attributes['llm_filled'].astype(bool)
+        return mask
+
+    def allowed_values(self, name: str) -> list:
+        """Sorted canonical values of an attribute vocabulary."""
+        return sorted(set(self.matchers[name].canonical.values()))
+
+    def fill_low_confidence(self, df: pd.DataFrame, attributes: pd.DataFrame, client, threshold: float = 0.5,
+                            names: list = None, model: str = "gpt-4") -> pd.DataFrame:
+        """Asks an LLM for the attributes of low-confidence products only.
+
+        One request is made per low-confidence parent product; its answer is applied to all of that product's
+        variant rows and, once an answer is parsed (even one of nulls), the rows are flagged in an `llm_filled`
+        column, so they are not sent again. Rows whose request failed are retried on the next call.
+
+        Args:
+            df (DataFrame): the parser rows passed to extract()
+            attributes (DataFrame): the output of extract()
+            client (OpenAIClient): client used for the fallback completions
+            threshold (float, optional): confidence below which a row is sent to the LLM. Defaults to 0.5.
+            names (list, optional): attributes to fill. Defaults to every vocabulary except colour.
+            model (str, optional): completion model. Defaults to "gpt-4".
+
+        Returns:
+            DataFrame: a copy of `attributes` with low-confidence values filled where the LLM answered
+        """
+        names = names or [name for name in self.matchers if name != 'colour']
+        attributes = attributes.copy()
+        if 'llm_filled' not in attributes.columns:
+            attributes['llm_filled'] = False
+        mask = self.low_confidence_mask(attributes, threshold, names)
+        if not mask.any():
+            return attributes
+
+        key = 'parent_product_id' if 'parent_product_id' in df.columns else None
+        todo = df[mask].drop_duplicates(subset=[key]) if key else df[mask]
+        def field(row, column) -> str:
+            value = row.get(column)
+            return '' if value is None or pd.isna(value) else str(value)
+
+        allowed = "; ".join(f"{name}: {', '.join(self.allowed_values(name))}" for name in names)
+        for index, row in todo.iterrows():
+            prompt = (
+                "Extract clothing attributes from this product listing. Answer with a JSON object with the keys "
+                f"{', '.join(names)}; use null when unknown. Allowed values: {allowed}\n\n"
+                f"Title: {field(row, 'product_title')}\nType: {field(row, 'product_type')}\n"
+                f"Tags: {field(row, 'tags')}\nDescription: {strip_html(field(row, 'product_desc'))[:1500]}"
+            )
+            try:
+                answer = json.loads(client.generate_completion(prompt, model=model, temperature=0))
+                if not isinstance(answer, dict):
+                    raise ValueError(f"expected a JSON object, got {type(answer).__name__}")
+            except Exception as e:
+                print(f"LLM attribute fallback failed for row {index}: {e}")
+                continue
+
+            rows = mask & (df[key] == row[key]) if key else attributes.index == index
+            # answered, even if only with nulls: the product is not sent again
+            attributes.loc[rows, 'llm_filled'] = True
+            for name in names:
+                value = answer.get(name)
+                low = rows & (attributes[f'{name}_confidence'] < threshold)
+                if value in self.allowed_values(name) and low.any():
+                    attributes.loc[low, name] = value
+        return attributes
@@ -0,0 +1,305 @@
+import heapq
+import math
+import pickle
+import re
+import unicodedata
+from array import array
+from html import unescape
+from html.parser import HTMLParser
+
+import pandas as pd
+
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or our that the this to was we were will with
+you your
+""".split())
+
+# Field weights applied to term frequencies, so a title hit counts more than a description hit.
+FIELD_WEIGHTS = {'product_title': 3, 'tags': 2, 'product_type': 2, 'vendor': 1, 'product_desc': 1}
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+
+    def handle_data(self, data):
+        self.parts.append(data)
+
+
+def strip_html(html: str) -> str:
+    """Returns the visible text of a Shopify body_html fragment."""
+    if not html:
+        return ''
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return unescape(' '.join(extractor.parts))
+
+
+def _stem(token: str) -> str:
+    # light plural folding only: 'dresses' -> 'dress', 'hoodies' -> 'hoody', 'shirts' -> 'shirt'
+    if len(token) > 4 and token.endswith('ies'):
+        return token[:-3] + 'y'
+    if len(token) > 4 and token.endswith(('sses', 'xes', 'ches', 'shes')):
+        return token[:-2]
+    if len(token) > 3 and token.endswith('s') and not token.endswith(('ss', 'us', 'is')):
+        return token[:-1]
+    return token
+
+
+def tokenise(text: str) -> list:
+    """Lower-cases, strips accents, splits on non-alphanumerics, drops stopwords and folds plurals."""
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii').lower()
+    return [_stem(token) for token in _TOKEN_RE.findall(text) if token not in STOPWORDS]
+
+
+def _encode_postings(doc_ids: list, freqs: list, previous: int = 0) -> bytes:
+    """Delta + varint encodes a sorted posting list of (doc_id, term frequency) pairs.
+
+    `previous` is the last doc id already encoded, so new postings can be appended to an existing blob.
+    """
+    out = bytearray()
+    for doc_id, freq in zip(doc_ids, freqs):
+        for value in (doc_id - previous, freq):
+            while value >= 0x80:
+                out.append((value & 0x7F) | 0x80)
+                value >>= 7
+            out.append(value)
+        previous = doc_id
+    return bytes(out)
+
+
+def _decode_postings(data: bytes):
+    doc_id = 0
+    value = shift = 0
+    is_freq = False
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        if is_freq:
+            yield doc_id, value
+        else:
+            doc_id += value
+        is_freq = not is_freq
+        value = shift = 0
+
+
+class TextSearchIndex:
+    """In-process inverted index with BM25 ranking over tasc_products_shopify.
+
+    One document is indexed per parent product (variants only contribute their sizes). Posting lists are stored
+    delta/varint-compressed; documents added since the last merge sit in small uncompressed tail lists and are
+    folded into the compressed lists by merge(), which search() calls automatically. Updating a product
+    tombstones its old document id, and compact() rewrites the postings without tombstones.
+
+    Example:
+        You can build the index from a catalogue read and query it without going back to Postgres::
+
+            from tasc_core.utils.util_nebuladb import NebulaConnector
+
+            nebula = NebulaConnector()
+            df = nebula.select_df("SELECT * FROM tasc_prod.tasc_products_shopify")
+
+            index = TextSearchIndex()
+            index.update_from_dataframe(df)
+            index.search("black linen shirt", vendor="cole buxton", size="M")
+
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self._last_doc = {}
+        self._tail = {}
+        self.doc_product_ids = []
+        self.doc_lengths = array('I')
+        self.deleted = set()
+        self.product_to_doc = {}
+        self.attributes = {'vendor': {}, 'product_type': {}, 'size': {}}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.product_to_doc)
+
+    @staticmethod
+    def _text(value) -> str:
+        """A field value as text, with None and NaN (missing values of a pandas frame) as empty."""
+        return '' if value is None or pd.isna(value) else str(value)
+
+    @classmethod
+    def _normalise_attribute(cls, value) -> str:
+        return cls._text(value).strip().lower()
+
+    def _add_document(self, product_id, fields: dict, sizes: set) -> None:
+        if product_id in self.product_to_doc:
+            self.remove([product_id])
+
+        term_freqs = {}
+        length = 0
+        for field, weight in FIELD_WEIGHTS.items():
+            text = self._text(fields.get(field))
+            tokens = tokenise(strip_html(text) if field == 'product_desc' else text)
+            length += len(tokens)
+            for token in tokens:
+                term_freqs[token] = term_freqs.get(token, 0) + weight
+
+        doc_id = len(self.doc_product_ids)
+        self.doc_product_ids.append(product_id)
+        self.doc_lengths.append(length)
+        self._total_length += length
+        self.product_to_doc[product_id] = doc_id
+        for term, freq in term_freqs.items():
+            self._tail.setdefault(term, []).append((doc_id, freq))
+
+        for name, value in (('vendor', fields.get('vendor')), ('product_type', fields.get('product_type'))):
+            value = self._normalise_attribute(value)
+            if value:
+                self.attributes[name].setdefault(value, set()).add(doc_id)
+        for size in sizes:
+            self.attributes['size'].setdefault(self._normalise_attribute(size), set()).add(doc_id)
+
+    def update_from_dataframe(self, df) -> int:
+        """Adds or replaces every product present in a ShopifyProductParser / tasc_products_shopify DataFrame.
+
+        Args:
+            df (DataFrame): rows with parent_product_id, product_title, product_desc, tags, vendor, product_type
+                and sizes columns. Several variant rows per product are expected.
+
+        Returns:
+            int: number of products indexed
+        """
+        products = {}
+        for row in df.to_dict('records'):
+            product_id = str(row['parent_product_id'])
+            entry = products.get(product_id)
+            if entry is None:
+                entry = products[product_id] = (row, set())
+            for size in self._text(row.get('sizes')).split(','):
+                if size.strip():
+                    entry[1].add(size.strip())
+
+        for product_id, (row, sizes) in products.items():
+            self._add_document(product_id, row, sizes)
+        self.merge()
+        return len(products)
+
+    def remove(self, product_ids: list) -> None:
+        """Removes products from the index. Their postings are dropped on the next compact()."""
+        for product_id in product_ids:
+            doc_id = self.product_to_doc.pop(str(product_id), None)
+            if doc_id is None:
+                continue
+            self.deleted.add(doc_id)
+            self._total_length -= self.doc_lengths[doc_id]
+            for values in self.attributes.values():
+                for docs in values.values():
+                    docs.discard(doc_id)
+
+    def merge(self) -> None:
+        """Appends the uncompressed tail lists to the compressed posting lists.
+
+        Doc ids only ever grow, so the tail is delta-encoded from the last stored doc id and concatenated without
+        decoding the existing blob.
+        """
+        for term, tail in self._tail.items():
+            encoded = _encode_postings([d for d, _ in tail], [f for _, f in tail], self._last_doc.get(term, 0))
+            self.postings[term] = self.postings.get(term, b'') + encoded
+            self._last_doc[term] = tail[-1][0]
+        self._tail = {}
+
+    def compact(self) -> None:
+        """Rewrites all posting lists without tombstoned documents and renumbers the remaining documents."""
+        self.merge()
+        if not self.deleted:
+            return None
+        live = [doc for doc in range(len(self.doc_product_ids)) if doc not in self.deleted]
+        new_id = {old: new for new, old in enumerate(live)}
+        for term in list(self.postings):
+            kept = [(new_id[d], f) for d, f in _decode_postings(self.postings[term]) if d in new_id]
+            if kept:
+                self.postings[term] = _encode_postings([d for d, _ in kept], [f for _, f in kept])
+                self._last_doc[term] = kept[-1][0]
+            else:
+                del self.postings[term]
+                del self._last_doc[term]
+        self.doc_product_ids = [self.doc_product_ids[d] for d in live]
+        self.doc_lengths = array('I', (self.doc_lengths[d] for d in live))
+        self.product_to_doc = {pid: doc for doc, pid in enumerate(self.doc_product_ids)}
+        for values in self.attributes.values():
+            for key in list(values):
+                values[key] = {new_id[d] for d in values[key] if d in new_id}
+        self.deleted = set()
+
+    def _allowed_docs(self, vendor=None, product_type=None, size=None):
+        allowed = None
+        for name, value in (('vendor', vendor), ('product_type', product_type), ('size', size)):
+            if value is None:
+                continue
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            docs = set()
+            for v in values:
+                docs |= self.attributes[name].get(self._normalise_attribute(v), set())
+            allowed = docs if allowed is None else allowed & docs
+        return allowed
+
+    def search(self, query: str, k: int = 10, vendor=None, product_type=None, size=None) -> list:
+        """Ranks products against a keyword query with BM25.
+
+        Args:
+            query (str): free-text query
+            k (int, optional): number of results. Defaults to 10.
+            vendor (str | list, optional): only return products from these vendors
+            product_type (str | list, optional): only return products of these types
+            size (str | list, optional): only return products offered in one of these sizes
+
+        Returns:
+            list: (parent_product_id, score) tuples, best first
+        """
+        if self._tail:
+            self.merge()
+        n_docs = len(self.product_to_doc)
+        if n_docs == 0:
+            return []
+        allowed = self._allowed_docs(vendor, product_type, size)
+        if allowed is not None and not allowed:
+            return []
+
+        avg_length = max(self._total_length / n_docs, 1.0)
+        scores = {}
+        for term in set(tokenise(query)):
+            data = self.postings.get(term)
+            if not data:
+                continue
+            postings = [(d, f) for d, f in _decode_postings(data) if d not in self.deleted]
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, freq in postings:
+                if allowed is not None and doc_id not in allowed:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * freq * (self.k1 + 1) / (freq + norm)
+
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.doc_product_ids[doc_id], score) for doc_id, score in best]
+
+    def save(self, path: str) -> None:
+        """Pickles the merged index to a file."""
+        self.merge()
+        with open(path, 'wb') as f:
+            pickle.dump(self.__dict__, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path: str) -> 'TextSearchIndex':
+        index = cls()
+        with open(path, 'rb') as f:
+            index.__dict__.update(pickle.load(f))
+        return index
@@ -0,0 +1,279 @@
+"""Local columnar snapshot of tasc_prod.tasc_products_shopify.
+
+The catalogue only changes at sync time, so read-heavy jobs (matching, search indexing, colour backfills) can scan a
+local copy instead of pulling the table from the database on every run. export_snapshot() writes the table as an
+Arrow dataset partitioned by vendor and asof_dt (root/vendor=.../asof_dt=.../part-0.arrow), and CatalogueSnapshot
+reads it back with column projection and filters applied while scanning, so only the files, row groups and columns
+needed are touched.
+
+The default format is uncompressed Arrow IPC, which is memory-mapped on read: columns are used in place from the
+page cache without a copy or decode step. format="parquet" gives smaller files at the cost of decoding on read.
+
+Example:
+    from tasc_core.utils.util_nebuladb import NebulaConnector
+
+    export_snapshot(NebulaConnector(), "data/processed/catalogue")          # after a sync
+
+    snapshot = CatalogueSnapshot("data/processed/catalogue")
+    df = snapshot.to_pandas(columns=["parent_product_id", "product_title", "price"],
+                            vendor=["Vendor A", "Vendor B"], filters=[("available", "=", True)], latest=True)
+"""
+import itertools
+import json
+import os
+from datetime import date, datetime
+from decimal import Decimal
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+PARTITION_COLUMNS = ['vendor', 'asof_dt']
+PARTITIONING = ds.partitioning(pa.schema([('vendor', pa.string()), ('asof_dt', pa.string())]), flavor='hive')
+MANIFEST_FILE = '_manifest.json'
+
+# Rows read from the database per chunk while exporting
+EXPORT_CHUNK_ROWS = 100_000
+
+
+def _file_format(format: str):
+    if format == 'ipc':
+        return ds.IpcFileFormat()
+    if format == 'parquet':
+        return ds.ParquetFileFormat()
+    raise ValueError(f"Unknown snapshot format: {format}")
+
+
+# information_schema.columns data_type -> Arrow type; anything else (text, varchar, uuid, json, arrays) is a string
+_PG_TYPES = {
+    'smallint': pa.int64(), 'integer': pa.int64(), 'bigint': pa.int64(),
+    'real': pa.float64(), 'double precision': pa.float64(), 'numeric': pa.float64(),
+    'boolean': pa.bool_(), 'date': pa.date32(),
+    'timestamp without time zone': pa.timestamp('us'), 'timestamp with time zone': pa.timestamp('us', tz='UTC'),
+}
+
+
+# column python_type -> Arrow type, for databases without information_schema (SQLite)
+_PY_TYPES = {int: pa.int64(), float: pa.float64(), Decimal: pa.float64(), bool: pa.bool_(), date: pa.date32(),
+             datetime: pa.timestamp('us')}
+
+
+def table_schema(connector, table: str, columns: list = None):
+    """Arrow schema of a table from its declared column types, in table (or `columns`) order.
+
+    Postgres is read from information_schema; other databases go through the SQLAlchemy inspector.
+
+    Returns:
+        pa.Schema | None: None when the table is not found.
+    """
+    from sqlalchemy import inspect, text
+
+    schema_name, _, table_name = table.rpartition('.')
+    if connector.engine.dialect.name == 'postgresql':
+        with connector.engine.connect() as connection:
+            rows = connection.execute(text("SELECT column_name, data_type FROM information_schema.columns "
+                                           "WHERE table_schema = :schema AND table_name = :table "
+                                           "ORDER BY ordinal_position"),
+                                      {'schema': schema_name or 'public', 'table': table_name}).fetchall()
+        types = {name: _PG_TYPES.get(data_type, pa.string()) for name, data_type in rows}
+    else:
+        types = {}
+        try:
+            declared = inspect(connector.engine).get_columns(table_name, schema=schema_name or None)
+        except Exception:
+            return None
+        for column in declared:
+            try:
+                python_type = column['type'].python_type
+            except NotImplementedError:
+                python_type = str
+            types[column['name']] = _PY_TYPES.get(python_type, pa.string())
+    if not types:
+        return None
+    types.update({name: pa.string() for name in PARTITION_COLUMNS if name in types})
+    return pa.schema([(name, types[name]) for name in (columns or types)])
+
+
+def _infer_schema(df: pd.DataFrame) -> pa.Schema:
+    """Arrow schema inferred from rows, with all-null columns typed as strings rather than null."""
+    inferred = pa.Table.from_pandas(_normalise_chunk(df), preserve_index=False).schema
+    return pa.schema([(field.name, pa.string() if pa.types.is_null(field.type) else field.type) for field in inferred])
+
+
+def _normalise_chunk(df: pd.DataFrame, schema: pa.Schema = None) -> pd.DataFrame:
+    """Prepares one chunk for conversion: partition columns as strings, DECIMAL as float and Python objects as
+    strings where the schema (if given) expects a string."""
+    df = df.copy()
+    for column in PARTITION_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].map(lambda v: None if pd.isna(v) else
+                                        v.isoformat() if isinstance(v, (date, datetime)) else str(v))
+    for column in df.columns:
+        target = schema.field(column).type if schema is not None else None
+        if column in PARTITION_COLUMNS or (df[column].dtype != object and not (target and pa.types.is_string(target))):
+            continue
+        # DECIMAL columns come back from the driver as Decimal objects; ids and mixed-type columns as Python objects
+        if target is not None:
+            to_float = pa.types.is_floating(target)
+        else:
+            values = df[column].dropna()
+            to_float = len(values) > 0 and isinstance(values.iloc[0], Decimal)
+        if to_float:
+            df[column] = pd.to_numeric(df[column], errors='coerce').astype('float64')
+        elif target is None or pa.types.is_string(target):
+            df[column] = df[column].map(lambda v: None if v is None or (isinstance(v, float) and pd.isna(v))
+                                        else str(v)).astype(object)
+    return df
+
+
+def export_snapshot(source, root: str, table: str = 'tasc_prod.tasc_products_shopify', asof_dt: str = None,
+                    format: str = 'ipc', columns: list = None) -> dict:
+    """Writes the product table (or a DataFrame of it) to a vendor/asof_dt partitioned dataset under `root`.
+
+    Partitions being written are replaced, others are left alone, so exporting one sync's asof_dt after each sync
+    keeps the snapshot current without rewriting history. Rows are read and written one chunk at a time, so memory
+    use is bounded by EXPORT_CHUNK_ROWS rather than the table size. The schema comes from the table's declared column
+    types, so a column that is null throughout the first chunk still gets its real type.
+
+    Args:
+        source (DbConnector | DataFrame): Database to read `table` from, or the rows themselves.
+        root (str): Dataset directory.
+        table (str): Table to export when source is a connector.
+        asof_dt (str): Only export rows of this sync date (YYYY-MM-DD). Exports the whole table when None.
+        format (str): "ipc" (memory-mapped, zero-copy reads) or "parquet" (compressed).
+        columns (list): Columns to export. Defaults to all.
+
+    Returns:
+        dict: The manifest written next to the data: rows, columns, format, asof_dt and export time.
+    """
+    os.makedirs(root, exist_ok=True)
+    connection = None
+    if isinstance(source, pd.DataFrame):
+        df = source if asof_dt is None else source[source['asof_dt'].astype(str) == str(asof_dt)]
+        df = df[columns] if columns else df
+        chunks = iter([df] if len(df) else [])
+        schema = _infer_schema(df) if len(df) else None
+    else:
+        from sqlalchemy import text
+
+        select = ', '.join(columns) if columns else '*'
+        query = f'SELECT {select} FROM {table}'
+        if asof_dt is not None:
+            query += f" WHERE asof_dt = '{asof_dt}'"
+        schema = table_schema(source, table, columns)
+        connection = source.engine.connect().execution_options(stream_results=True)
+        chunks = pd.read_sql_query(text(query), connection, chunksize=EXPORT_CHUNK_ROWS)
+
+    rows = 0
+    try:
+        first = next(chunks, None)
+        if first is None or first.empty:
+            print('No rows to export')
+            return {}
+        if schema is None:
+            # a DataFrame source has no declared types: fall back to the first chunk's
+            schema = _infer_schema(first)
+
+        def _batches():
+            nonlocal rows
+            for chunk in itertools.chain([first], chunks):
+                chunk_table = pa.Table.from_pandas(_normalise_chunk(chunk, schema), schema=schema, preserve_index=False)
+                rows += chunk_table.num_rows
+                yield from chunk_table.to_batches()
+
+        ds.write_dataset(_batches(), root, schema=schema, format=_file_format(format), partitioning=PARTITIONING,
+                         existing_data_behavior='delete_matching',
+                         basename_template='part-{i}.' + ('arrow' if format == 'ipc' else 'parquet'))
+    finally:
+        if connection is not None:
+            connection.close()
+
+    manifest = {'table': table, 'rows': rows, 'columns': schema.names, 'format': format,
+                'asof_dt': asof_dt, 'exported_at': datetime.now().isoformat(timespec='seconds')}
+    with open(os.path.join(root, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+class CatalogueSnapshot:
+    """Reader over a dataset written by export_snapshot.
+
+    Filters on vendor and asof_dt prune whole partitions without opening them. Other filters are pushed into the
+    scan (Parquet row-group statistics are used to skip data), and only the requested columns are read.
+    """
+
+    def __init__(self, root: str, format: str = None) -> None:
+        self.root = root
+        manifest_path = os.path.join(root, MANIFEST_FILE)
+        self.manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                self.manifest = json.load(f)
+        self.format = format or self.manifest.get('format', 'ipc')
+        self.dataset = ds.dataset(root, format=_file_format(self.format), partitioning=PARTITIONING,
+                                  filesystem=pafs.LocalFileSystem(use_mmap=True))
+
+    @property
+    def columns(self) -> list:
+        return self.dataset.schema.names
+
+    def asof_dates(self) -> list:
+        """Sync dates present in the snapshot, oldest first."""
+        dates = set()
+        for fragment in self.dataset.get_fragments():
+            value = ds.get_partition_keys(fragment.partition_expression).get('asof_dt')
+            if value is not None:
+                dates.add(value)
+        return sorted(dates)
+
+    def _expression(self, vendor=None, asof_dt=None, filters: list = None, latest: bool = False):
+        expressions = []
+        if vendor is not None:
+            vendors = [vendor] if isinstance(vendor, str) else list(vendor)
+            expressions.append(ds.field('vendor').isin(vendors))
+        if latest and asof_dt is None:
+            dates = self.asof_dates()
+            asof_dt = dates[-1] if dates else None
+        if asof_dt is not None:
+            dates = [asof_dt] if isinstance(asof_dt, (str, date)) else list(asof_dt)
+            expressions.append(ds.field('asof_dt').isin([str(d) for d in dates]))
+        if filters:
+            expressions.append(pq.filters_to_expression(filters))
+        if not expressions:
+            return None
+        expression = expressions[0]
+        for other in expressions[1:]:
+            expression = expression & other
+        return expression
+
+    def scanner(self, columns: list = None, vendor=None, asof_dt=None, filters: list = None, latest: bool = False,
+                batch_size: int = 131_072) -> ds.Scanner:
+        """Builds a scan with projection and filters.
+
+        Args:
+            columns (list): Columns to read. Defaults to all.
+            vendor (str | list): Only these vendors.
+            asof_dt (str | list): Only these sync dates (YYYY-MM-DD).
+            filters (list): Further conditions as (column, op, value) tuples, e.g. [("price", "<", 50)].
+            latest (bool): Only the most recent sync date, when asof_dt is not given.
+        """
+        return self.dataset.scanner(columns=columns, filter=self._expression(vendor, asof_dt, filters, latest),
+                                    batch_size=batch_size)
+
+    def to_table(self, columns: list = None, vendor=None, asof_dt=None, filters: list = None,
+                 latest: bool = False) -> pa.Table:
+        return self.scanner(columns, vendor, asof_dt, filters, latest).to_table()
+
+    def to_pandas(self, columns: list = None, vendor=None, asof_dt=None, filters: list = None,
+                  latest: bool = False) -> pd.DataFrame:
+        return self.to_table(columns, vendor, asof_dt, filters, latest).to_pandas()
+
+    def iter_batches(self, columns: list = None, vendor=None, asof_dt=None, filters: list = None,
+                     latest: bool = False):
+        """Yields pyarrow RecordBatches, for scans that should not hold the whole result in memory."""
+        yield from self.scanner(columns, vendor, asof_dt, filters, latest).to_batches()
+
+    def count_rows(self, vendor=None, asof_dt=None, filters: list = None, latest: bool = False) -> int:
+        return self.dataset.count_rows(filter=self._expression(vendor, asof_dt, filters, latest))
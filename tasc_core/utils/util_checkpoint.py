@@ -0,0 +1,314 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from tasc_core.utils import util_metrics as metrics
+
+
+def shard_of(key: str, shard_count: int) -> int:
+    """Stable shard number of a work item key. Unlike hash(), the result is the same in every process and machine."""
+    return int.from_bytes(hashlib.sha1(str(key).encode('utf-8')).digest()[:8], 'big') % shard_count
+
+
+class ProgressStore:
+    """Records which work items of a run have completed, so a crashed or interrupted run can resume.
+
+    Progress is kept per `scope` (e.g. "colour_backfill", or "ingestion:insert" for one pipeline stage) in a local
+    SQLite file. Each item is "done", "failed" (retried on the next run) or "quarantined" (skipped until released
+    with release_quarantined()). Writes are committed immediately, so anything marked survives a crash.
+
+    Example:
+        progress = ProgressStore("data/processed/ingestion_progress.sqlite")
+        for url in urls:
+            if progress.is_done("ingestion", url):
+                continue
+            ...
+            progress.mark_done("ingestion", url)
+    """
+
+    placeholder = '?'
+
+    def __init__(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.table = 'progress'
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS progress (
+                scope TEXT,
+                item_key TEXT,
+                status TEXT,
+                attempts INTEGER DEFAULT 0,
+                error TEXT,
+                updated_at_tms TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (scope, item_key)
+            )""")
+        self._conn.commit()
+
+    def _sql(self, sql: str) -> str:
+        return sql.replace('?', self.placeholder).replace('{table}', self.table)
+
+    def _execute(self, sql: str, rows: list) -> None:
+        with self._lock:
+            self._conn.executemany(self._sql(sql), rows)
+            self._conn.commit()
+
+    def _query(self, sql: str, params: tuple) -> list:
+        with self._lock:
+            return self._conn.execute(self._sql(sql), params).fetchall()
+
+    def _set_many(self, scope: str, keys: list, status: str, error: str = None, attempts: int = 0) -> None:
+        self._execute("""
+            INSERT INTO {table} AS p (scope, item_key, status, attempts, error, updated_at_tms)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (scope, item_key) DO UPDATE SET status = EXCLUDED.status,
+                attempts = p.attempts + EXCLUDED.attempts, error = EXCLUDED.error,
+                updated_at_tms = EXCLUDED.updated_at_tms""",
+                      [(scope, str(key), status, attempts, error) for key in keys])
+
+    def mark_done(self, scope: str, key: str) -> None:
+        self._set_many(scope, [key], 'done')
+
+    def mark_many_done(self, scope: str, keys: list) -> None:
+        """Marks a batch of items done in one round trip."""
+        if keys:
+            self._set_many(scope, keys, 'done')
+
+    def mark_failed(self, scope: str, key: str, error: str, attempts: int = 1) -> None:
+        self._set_many(scope, [key], 'failed', error, attempts)
+
+    def mark_quarantined(self, scope: str, key: str, error: str, attempts: int = 1) -> None:
+        self._set_many(scope, [key], 'quarantined', error, attempts)
+
+    def is_done(self, scope: str, key: str) -> bool:
+        rows = self._query('SELECT status FROM {table} WHERE scope = ? AND item_key = ?', (scope, str(key)))
+        return bool(rows) and rows[0][0] == 'done'
+
+    def keys_with_status(self, scope: str, status: str) -> set:
+        rows = self._query('SELECT item_key FROM {table} WHERE scope = ? AND status = ?', (scope, status))
+        return {row[0] for row in rows}
+
+    def done_keys(self, scope: str) -> set:
+        return self.keys_with_status(scope, 'done')
+
+    def failed(self, scope: str) -> dict:
+        """Returns item_key -> error message for items whose last attempt failed."""
+        return dict(self._query("SELECT item_key, error FROM {table} WHERE scope = ? AND status = 'failed'",
+                                (scope,)))
+
+    def quarantined(self, scope: str) -> dict:
+        """Returns item_key -> error message for quarantined items."""
+        return dict(self._query("SELECT item_key, error FROM {table} WHERE scope = ? AND status = 'quarantined'",
+                                (scope,)))
+
+    def counts(self, scope: str) -> dict:
+        return dict(self._query('SELECT status, COUNT(*) FROM {table} WHERE scope = ? GROUP BY status', (scope,)))
+
+    def release_quarantined(self, scope: str) -> None:
+        """Makes quarantined items eligible again, e.g. after fixing the bug that made them fail."""
+        self._execute("UPDATE {table} SET status = 'failed', attempts = 0 WHERE scope = ? AND status = 'quarantined'",
+                      [(scope,)])
+
+    def reset(self, scope: str = None) -> None:
+        """Forgets progress for one scope, or for every scope when none is given."""
+        if scope is None:
+            self._execute('DELETE FROM {table}', [()])
+        else:
+            self._execute('DELETE FROM {table} WHERE scope = ? OR scope LIKE ?', [(scope, f'{scope}:%')])
+
+
+class NebulaProgressStore(ProgressStore):
+    """ProgressStore backed by tasc_prod.tasc_job_progress in Nebula, so workers on several machines share progress.
+
+    The table is created by data_products/table/create/create_tasc_job_progress.sql.
+
+    Example:
+        from tasc_core.utils.util_nebuladb import NebulaConnector
+
+        progress = NebulaProgressStore(NebulaConnector())
+    """
+
+    placeholder = '%s'
+
+    def __init__(self, nebula, table_schema: str = 'tasc_prod', table_name: str = 'tasc_job_progress') -> None:
+        self.nebula = nebula
+        self.table = f'{table_schema}.{table_name}'
+
+    def _execute(self, sql: str, rows: list) -> None:
+        conn = self.nebula.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.executemany(self._sql(sql), rows)
+                conn.commit()
+            finally:
+                cursor.close()
+        except Exception as e:
+            conn.rollback()
+            raise Exception(f'Could not write progress: {e}')
+        finally:
+            conn.close()
+
+    def _query(self, sql: str, params: tuple) -> list:
+        conn = self.nebula.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(self._sql(sql), params)
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+        finally:
+            conn.close()
+
+
+class CheckpointedExecutor:
+    """Runs a function over a long work list, recording per-item progress so a rerun only costs the remaining work.
+
+    Items already done in `scope` are skipped. An item that raises is retried up to `max_attempts` times in the run
+    and then quarantined with its error instead of aborting the batch; quarantined items are skipped on later runs
+    until released. Completions are written in batches of `checkpoint_every`, so a hard crash repeats at most that
+    many items. With `shard_index`/`shard_count`, each worker process or machine only takes the items whose key
+    hashes to its shard, and all of them can share one NebulaProgressStore.
+
+    Example:
+        def tag_colours(image_url):
+            return processor.extract_colors(image_url=image_url)
+
+        executor = CheckpointedExecutor(tag_colours, ProgressStore("data/processed/backfill.sqlite"),
+                                        scope="colour_backfill_v1", workers=4, kind="process",
+                                        on_result=lambda url, colours: results.append((url, colours)))
+        summary = executor.run(df["product_image_1_url"].dropna().unique())
+
+        # On machine 2 of 3, sharing progress in Nebula:
+        CheckpointedExecutor(tag_colours, NebulaProgressStore(NebulaConnector()), scope="colour_backfill_v1",
+                             shard_index=1, shard_count=3).run(urls)
+    """
+
+    def __init__(self, fn, progress: ProgressStore, scope: str, workers: int = 1, kind: str = 'thread',
+                 max_attempts: int = 2, checkpoint_every: int = 100, shard_index: int = 0, shard_count: int = 1,
+                 on_result=None, initializer=None, verbose: bool = True) -> None:
+        """
+        Args:
+            fn (callable): Takes one item value and returns its result. Must be module-level when kind is "process".
+            progress (ProgressStore): Where progress is recorded.
+            scope (str): Name of the job. Change it (e.g. add a version) to redo work already done.
+            workers (int): Items processed concurrently.
+            kind (str): "thread" for I/O-bound work, "process" for CPU-bound work such as colour extraction.
+            max_attempts (int): Attempts per item before it is quarantined.
+            checkpoint_every (int): Completions buffered before they are written to the progress store.
+            shard_index (int): This worker's shard, from 0 to shard_count - 1.
+            shard_count (int): Number of workers the work list is split across.
+            on_result (callable): Called in the calling process with (key, result) for every completed item, e.g. to
+                write results to the database. An item is only marked done after on_result returns.
+            initializer (callable): Run once in each worker process when kind is "process", e.g. to load a model.
+        """
+        if kind not in ('thread', 'process'):
+            raise ValueError(f"Unknown executor kind: {kind}")
+        if not 0 <= shard_index < shard_count:
+            raise ValueError(f"shard_index must be between 0 and {shard_count - 1}")
+        self.fn = fn
+        self.progress = progress
+        self.scope = scope
+        self.workers = workers
+        self.kind = kind
+        self.max_attempts = max_attempts
+        self.checkpoint_every = checkpoint_every
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.on_result = on_result
+        self.initializer = initializer
+        self.verbose = verbose
+
+    def _pending(self, items) -> iter:
+        """Yields the (key, value) pairs of this shard that are neither done nor quarantined."""
+        skip = self.progress.done_keys(self.scope) | self.progress.keys_with_status(self.scope, 'quarantined')
+        self.skipped = 0
+        for item in items:
+            key, value = item if isinstance(item, tuple) and len(item) == 2 else (str(item), item)
+            key = str(key)
+            if self.shard_count > 1 and shard_of(key, self.shard_count) != self.shard_index:
+                continue
+            if key in skip:
+                self.skipped += 1
+                continue
+            yield key, value
+
+    def run(self, items) -> dict:
+        """Processes every pending item of `items`, which are plain values (keyed by str(value)) or (key, value)
+        pairs.
+
+        Returns:
+            dict: Counts of completed, quarantined and skipped items, and the wall time.
+        """
+        with metrics.profile_job(self.scope):
+            return self._run(items)
+
+    def _run(self, items) -> dict:
+        if self.kind == 'process':
+            pool = ProcessPoolExecutor(max_workers=self.workers, initializer=self.initializer)
+        else:
+            pool = ThreadPoolExecutor(max_workers=self.workers)
+
+        start = time.perf_counter()
+        completed = quarantined = 0
+        finished = []
+        in_flight = {}
+        pending = self._pending(items)
+        exhausted = False
+        try:
+            while in_flight or not exhausted:
+                # keep at most 2 items per worker in flight so the work list is never materialised
+                while not exhausted and len(in_flight) < 2 * self.workers:
+                    try:
+                        key, value = next(pending)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    in_flight[pool.submit(self.fn, value)] = (key, value, 1, time.perf_counter())
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key, value, attempt, submitted = in_flight.pop(future)
+                    try:
+                        result = future.result()
+                        if self.on_result is not None:
+                            self.on_result(key, result)
+                    except Exception as e:
+                        if attempt < self.max_attempts:
+                            in_flight[pool.submit(self.fn, value)] = (key, value, attempt + 1, time.perf_counter())
+                            continue
+                        print(f"[{self.scope}] quarantining {key} after {attempt} attempts: {e}")
+                        metrics.inc(metrics.ERRORS, job=self.scope, stage='quarantine')
+                        self.progress.mark_quarantined(self.scope, key, str(e), attempts=attempt)
+                        quarantined += 1
+                        continue
+                    # includes time queued in the pool, i.e. the latency an item sees at this concurrency
+                    metrics.observe(metrics.STAGE_SECONDS, time.perf_counter() - submitted, job=self.scope,
+                                    stage='item')
+                    finished.append(key)
+                    completed += 1
+                if len(finished) >= self.checkpoint_every:
+                    self.progress.mark_many_done(self.scope, finished)
+                    finished = []
+        finally:
+            # also runs on KeyboardInterrupt, so completed work is not lost when a backfill is stopped by hand
+            self.progress.mark_many_done(self.scope, finished)
+            pool.shutdown(cancel_futures=True)
+
+        wall_seconds = time.perf_counter() - start
+        summary = {'completed': completed, 'quarantined': quarantined, 'skipped': self.skipped,
+                   'wall_seconds': round(wall_seconds, 3)}
+        if self.verbose:
+            print(f"[{self.scope}] shard {self.shard_index + 1}/{self.shard_count}: {completed} completed, "
+                  f"{quarantined} quarantined, {self.skipped} already done in {wall_seconds:.1f}s")
+        return summary
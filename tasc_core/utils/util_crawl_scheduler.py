@@ -0,0 +1,389 @@
+"""Adaptive crawl schedule for the partners in tasc_prod.tasc_xref_partners.
+
+Crawling every partner on one fixed schedule either leaves fast-moving catalogues stale or spends most requests on
+stores that change monthly. CrawlScheduler instead learns how often each partner's catalogue changes and crawls it
+accordingly:
+
+- Every crawl fingerprints the parsed catalogue (row hashes of the ShopifyProductParser frame, audit columns
+  excluded, so price and stock changes count) and compares it with the previous crawl's.
+- The change rate is estimated from those observations with the Poisson estimator for change detection at
+  intervals, lambda = -ln((n - x + 0.5) / (n + 0.5)) / mean interval, over exponentially decayed counts so the
+  estimate follows partners whose cadence shifts.
+- The crawl interval aims at `target_changes` expected changes per interval, clamped to [min_interval,
+  max_interval]. It shrinks at once when a partner speeds up and at most doubles per crawl when it slows down.
+  Failures back off exponentially.
+- If the intervals together would exceed the global request budget, every interval not already at max_interval is
+  stretched until they fit. At run time every page request takes a RateLimiter token and waits until its host
+  has had no request for `host_delay` seconds, so a paginated catalogue is fetched at the same pace.
+- Due partners are crawled in order of expected changes missed since their last crawl (rate x time since crawl).
+
+The schedule is kept in tasc_prod.tasc_crawl_schedule (data_products/table/create/create_tasc_crawl_schedule.sql).
+
+Example:
+    from tasc_core.utils.util_nebuladb import NebulaConnector
+
+    scheduler = CrawlScheduler(NebulaConnector(), requests_per_hour=1200)
+    scheduler.load()
+    scheduler.run_forever(on_sync=lambda state, df: print(state['partner_name'], len(df)))
+"""
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import numpy as np
+import pandas as pd
+
+from tasc_core.api.rate_limiter import RateLimiter
+from tasc_core.utils.util_nebuladb import AUDIT_COLUMNS, row_hash
+from tasc_core.utils.util_shopify_product_parser import ShopifyProductParser
+
+STATE_COLUMNS = ['partner_uid', 'partner_name', 'url', 'host', 'change_rate_per_hour', 'crawl_interval_seconds',
+                 'decayed_crawls', 'decayed_changes', 'decayed_seconds', 'last_fingerprint', 'last_variant_count',
+                 'pages', 'last_crawl_tms', 'last_change_tms', 'next_crawl_tms', 'crawls', 'changes',
+                 'consecutive_failures', 'last_error', 'last_modified_tms']
+# BIGINT and INT columns, read back as float64 when they hold NULLs
+INTEGER_COLUMNS = ['last_fingerprint', 'last_variant_count', 'pages', 'crawls', 'changes', 'consecutive_failures']
+
+# Most products.json pages fetched per crawl, in case a store ignores `page` and repeats its first page forever
+MAX_PAGES = 200
+# Page size Shopify uses when the URL sets no limit
+SHOPIFY_DEFAULT_LIMIT = 30
+
+
+def products_json_url(url: str, limit: int = 250) -> str:
+    """The products.json endpoint of a partner's primary URL."""
+    if 'products.json' in url:
+        return url
+    if not url.startswith(('http://', 'https://')):
+        url = 'https://' + url
+    return f"{url.rstrip('/')}/products.json?limit={limit}"
+
+
+def catalogue_fingerprint(df: pd.DataFrame) -> int:
+    """Order-independent 64-bit fingerprint of a parsed catalogue; equal fingerprints mean nothing changed."""
+    if df.empty:
+        return 0
+    columns = [col for col in df.columns if col not in AUDIT_COLUMNS]
+    hashes = np.sort(row_hash(df, columns).to_numpy())
+    combined = pd.util.hash_pandas_object(pd.Series(hashes), index=False).to_numpy(dtype='uint64')
+    return int(np.bitwise_xor.reduce(combined * np.arange(1, len(combined) + 1, dtype='uint64')).astype('int64'))
+
+
+def estimate_change_rate(crawls: float, changes: float, seconds: float) -> float:
+    """Changes per second from (decayed) counts of crawls, crawls that saw a change and seconds between crawls."""
+    if crawls <= 0 or seconds <= 0:
+        return 0.0
+    changes = min(changes, crawls)
+    return max(-math.log((crawls - changes + 0.5) / (crawls + 0.5)) / (seconds / crawls), 0.0)
+
+
+def page_url(url: str, page: int) -> str:
+    """`url` with its page query parameter set to `page`."""
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k != 'page'] + [('page', str(page))]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def fetch_catalogue(url: str, max_pages: int = MAX_PAGES, before_request=None) -> pd.DataFrame:
+    """
+    Fetches every page of a products.json catalogue, stopping at the first empty page or one shorter than the
+    page size, and parses it with ShopifyProductParser.
+
+    Args:
+        url (str): The products.json URL.
+        max_pages (int): Most pages to request.
+        before_request (callable): Called with no arguments before each page request, e.g. to wait for a rate
+            limit.
+
+    Returns:
+        DataFrame: The parsed catalogue, with the number of pages requested in df.attrs['pages'].
+    """
+    limit = int(dict(parse_qsl(urlsplit(url).query)).get('limit', SHOPIFY_DEFAULT_LIMIT))
+    frames, seen = [], set()
+    pages = 0
+    for page in range(1, max_pages + 1):
+        if before_request is not None:
+            before_request()
+        parser = ShopifyProductParser(page_url(url, page))
+        parser.load_json()
+        pages = page
+        products = parser.json_data.get('products') or []
+        ids = {product['id'] for product in products}
+        if not products or ids <= seen:
+            break
+        seen |= ids
+        frames.append(parser.to_dataframe())
+        if len(products) < limit:
+            break
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    df.attrs['pages'] = pages
+    return df
+
+
+class CrawlScheduler:
+    def __init__(self, nebula=None, requests_per_hour: float = 600, min_interval: float = 300,
+                 max_interval: float = 7 * 86400, initial_interval: float = 3600, target_changes: float = 0.5,
+                 half_life: float = 10, host_delay: float = 10.0, budget_utilisation: float = 0.8,
+                 workers: int = 4, fetch=None, table_schema: str = 'tasc_prod',
+                 table_name: str = 'tasc_crawl_schedule', verbose: bool = True) -> None:
+        """
+        Args:
+            nebula (NebulaConnector): Database holding the partner list and the schedule. State is kept in memory
+                only when None.
+            requests_per_hour (float): Global request budget across all partners.
+            min_interval (float): Shortest crawl interval in seconds, for the fastest-moving partners.
+            max_interval (float): Longest crawl interval in seconds, for partners that never change.
+            initial_interval (float): Interval after a partner's first crawl, before its rate is known.
+            target_changes (float): Expected catalogue changes per crawl interval. 0.5 crawls about twice per change.
+            half_life (float): Crawls after which an observation counts half in the change rate estimate.
+            host_delay (float): Minimum seconds between two requests to the same host.
+            budget_utilisation (float): Share of the budget planned for, leaving room for retries.
+            workers (int): Crawls run concurrently (always on different hosts).
+            fetch (callable): fetch(url, before_request=...) -> parsed catalogue DataFrame, calling before_request()
+                before each request it sends and with the number of requests it took in df.attrs['pages'] when more
+                than one. Defaults to fetch_catalogue.
+        """
+        self.nebula = nebula
+        self.requests_per_hour = requests_per_hour
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.initial_interval = initial_interval
+        self.target_changes = target_changes
+        self.decay = 0.5 ** (1 / half_life)
+        self.host_delay = host_delay
+        self.budget_utilisation = budget_utilisation
+        self.workers = workers
+        self.fetch = fetch or fetch_catalogue
+        self.table_schema = table_schema
+        self.table_name = table_name
+        self.verbose = verbose
+        self.limiter = RateLimiter(requests_per_minute=requests_per_hour / 60)
+        self.states = {}
+        self._host_ready = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    # ---- state ----
+
+    def add_partner(self, partner_uid, url: str, partner_name: str = None) -> dict:
+        """Adds a partner to the schedule, due immediately. Existing partners only get their URL and name updated."""
+        url = products_json_url(url)
+        state = self.states.get(partner_uid)
+        if state is None:
+            state = {column: None for column in STATE_COLUMNS}
+            state.update(partner_uid=partner_uid, decayed_crawls=0.0, decayed_changes=0.0, decayed_seconds=0.0,
+                         pages=1, crawls=0, changes=0, consecutive_failures=0, change_rate_per_hour=None,
+                         crawl_interval_seconds=self.initial_interval, next_crawl_tms=datetime.now())
+            self.states[partner_uid] = state
+        state.update(url=url, host=urlsplit(url).netloc, partner_name=partner_name)
+        return state
+
+    def load(self) -> None:
+        """Reads the saved schedule and the partner list, adding partners that have never been scheduled."""
+        if self.nebula is None:
+            return
+        # the fingerprint comes back as text, a 64-bit value read as float64 would never compare equal again
+        columns = [f'{c}::text AS {c}' if c == 'last_fingerprint' else c for c in STATE_COLUMNS]
+        schedule = self.nebula.select_df(f"SELECT {', '.join(columns)} "
+                                         f"FROM {self.table_schema}.{self.table_name}", cache=False)
+        for row in schedule.to_dict('records'):
+            state = {k: (None if not isinstance(v, str) and pd.isna(v) else v) for k, v in row.items()}
+            for column in INTEGER_COLUMNS:
+                if state[column] is not None:
+                    state[column] = int(state[column])
+            self.states[state['partner_uid']] = state
+        partners = self.nebula.select_df(
+            "SELECT DISTINCT ON (partner_uid) partner_uid, partner_name, partner_primary_url "
+            "FROM tasc_prod.tasc_xref_partners WHERE partner_primary_url IS NOT NULL "
+            "ORDER BY partner_uid, asof_dt DESC")
+        for row in partners.itertuples(index=False):
+            self.add_partner(row.partner_uid, row.partner_primary_url, row.partner_name)
+        if self.verbose:
+            print(f'Crawl schedule loaded: {len(self.states)} partners')
+
+    def save(self, states: list = None) -> None:
+        """Writes the given partners' state (all by default) to the schedule table."""
+        if self.nebula is None:
+            return
+        rows = pd.DataFrame(list(self.states.values()) if states is None else states, columns=STATE_COLUMNS)
+        if rows.empty:
+            return
+        rows['last_modified_tms'] = datetime.now()
+        for column in ['last_fingerprint', 'last_variant_count']:
+            rows[column] = rows[column].astype('Int64')
+        self.nebula.upsert_df(self.table_name, self.table_schema, rows, ['partner_uid'], detect_changes=False)
+
+    # ---- estimation ----
+
+    def record(self, state: dict, df: pd.DataFrame = None, error: Exception = None, now: datetime = None) -> dict:
+        """
+        Updates a partner's change rate and next crawl time from one crawl.
+
+        Args:
+            state (dict): The partner's schedule state.
+            df (DataFrame): The parsed catalogue, when the crawl succeeded.
+            error (Exception): The crawl's error, when it failed.
+            now (datetime): Crawl time. Defaults to now.
+        """
+        now = now or datetime.now()
+        with self._lock:
+            if error is not None:
+                state['consecutive_failures'] = (state['consecutive_failures'] or 0) + 1
+                state['last_error'] = str(error)[:2000]
+                interval = state['crawl_interval_seconds'] or self.initial_interval
+                backoff = interval * 2 ** state['consecutive_failures']
+                state['next_crawl_tms'] = now + timedelta(seconds=min(backoff, self.max_interval))
+                return state
+
+            fingerprint = catalogue_fingerprint(df)
+            previous = state['last_crawl_tms']
+            if previous is None or state['last_fingerprint'] is None:
+                interval = self.initial_interval
+            else:
+                elapsed = max((now - previous).total_seconds(), 1.0)
+                changed = fingerprint != state['last_fingerprint']
+                state['decayed_crawls'] = self.decay * state['decayed_crawls'] + 1
+                state['decayed_changes'] = self.decay * state['decayed_changes'] + changed
+                state['decayed_seconds'] = self.decay * state['decayed_seconds'] + elapsed
+                if changed:
+                    state['changes'] += 1
+                    state['last_change_tms'] = now
+                rate = estimate_change_rate(state['decayed_crawls'], state['decayed_changes'],
+                                            state['decayed_seconds'])
+                state['change_rate_per_hour'] = rate * 3600
+                target = self.target_changes / rate if rate > 0 else self.max_interval
+                # speed up at once, slow down gradually so one quiet crawl does not park a partner for a week
+                interval = min(target, 2 * (state['crawl_interval_seconds'] or self.initial_interval))
+            state['crawl_interval_seconds'] = min(max(interval, self.min_interval), self.max_interval)
+            state['last_fingerprint'] = fingerprint
+            state['last_variant_count'] = len(df)
+            state['pages'] = df.attrs.get('pages') or state['pages'] or 1
+            state['last_crawl_tms'] = now
+            state['crawls'] += 1
+            state['consecutive_failures'] = 0
+            state['last_error'] = None
+            state['next_crawl_tms'] = now + timedelta(seconds=state['crawl_interval_seconds'])
+        return state
+
+    def fit_budget(self) -> float:
+        """
+        Stretches crawl intervals so the planned request rate fits the budget, and reschedules accordingly.
+
+        Returns:
+            float: Planned requests per hour after fitting.
+        """
+        budget = self.requests_per_hour * self.budget_utilisation / 3600
+        with self._lock:
+            states = [s for s in self.states.values() if s['crawl_interval_seconds']]
+            for _ in range(5):
+                demand = sum((s['pages'] or 1) / s['crawl_interval_seconds'] for s in states)
+                stretchable = [s for s in states if s['crawl_interval_seconds'] < self.max_interval]
+                if demand <= budget or not stretchable:
+                    break
+                fixed = demand - sum((s['pages'] or 1) / s['crawl_interval_seconds'] for s in stretchable)
+                factor = (demand - fixed) / max(budget - fixed, 1e-9)
+                for state in stretchable:
+                    stretched = min(state['crawl_interval_seconds'] * factor, self.max_interval)
+                    if state['last_crawl_tms'] is not None:
+                        state['next_crawl_tms'] = state['last_crawl_tms'] + timedelta(seconds=stretched)
+                    state['crawl_interval_seconds'] = stretched
+            demand = sum((s['pages'] or 1) / s['crawl_interval_seconds'] for s in states)
+        return demand * 3600
+
+    # ---- scheduling ----
+
+    def priority(self, state: dict, now: datetime) -> float:
+        """Expected changes missed since the last crawl. Partners never crawled come first."""
+        if state['last_crawl_tms'] is None:
+            return math.inf
+        rate = (state['change_rate_per_hour'] or 0) / 3600
+        return rate * (now - state['last_crawl_tms']).total_seconds()
+
+    def due(self, now: datetime = None, limit: int = None) -> list:
+        """Partners due for a crawl, highest priority first, at most one per host and only hosts past host_delay."""
+        now = now or datetime.now()
+        ready = time.monotonic()
+        with self._lock:
+            candidates = [s for s in self.states.values()
+                          if s['url'] and (s['next_crawl_tms'] is None or s['next_crawl_tms'] <= now)]
+        candidates.sort(key=lambda s: self.priority(s, now), reverse=True)
+        picked, hosts = [], set()
+        for state in candidates:
+            if state['host'] in hosts or self._host_ready.get(state['host'], 0) > ready:
+                continue
+            hosts.add(state['host'])
+            picked.append(state)
+            if limit is not None and len(picked) >= limit:
+                break
+        return picked
+
+    def _pace(self, host: str) -> None:
+        """Blocks until a request to `host` fits both the global budget and host_delay, and books it."""
+        self.limiter.acquire()
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._host_ready.get(host, 0), now)
+            self._host_ready[host] = slot + self.host_delay
+        if slot > now:
+            time.sleep(slot - now)
+
+    def _crawl(self, state: dict, on_sync=None) -> dict:
+        try:
+            df = self.fetch(state['url'], before_request=lambda: self._pace(state['host']))
+        except Exception as e:
+            if self.verbose:
+                print(f"Crawl of {state['partner_name'] or state['partner_uid']} failed: {e}")
+            return self.record(state, error=e)
+        self.record(state, df)
+        if on_sync is not None:
+            on_sync(state, df)
+        return state
+
+    def run_once(self, max_crawls: int = None, on_sync=None) -> int:
+        """
+        Crawls the partners due now and saves their state.
+
+        Args:
+            max_crawls (int): Crawl at most this many partners.
+            on_sync (callable): on_sync(state, df) is called with each successfully parsed catalogue, e.g. to
+                upsert it.
+
+        Returns:
+            int: Number of partners crawled.
+        """
+        self.fit_budget()
+        batch = self.due(limit=max_crawls)
+        if not batch:
+            return 0
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(batch))) as executor:
+            crawled = list(executor.map(lambda state: self._crawl(state, on_sync), batch))
+        self.save(crawled)
+        return len(crawled)
+
+    def next_due_in(self) -> float:
+        """Seconds until the next partner is due, 0 if one is due now."""
+        with self._lock:
+            times = [s['next_crawl_tms'] for s in self.states.values() if s['next_crawl_tms'] is not None]
+        if not times:
+            return self.min_interval
+        return max((min(times) - datetime.now()).total_seconds(), 0.0)
+
+    def run_forever(self, on_sync=None, poll: float = 30.0) -> None:
+        """Crawls partners as they fall due until stop() is called."""
+        while not self._stop.is_set():
+            crawled = self.run_once(on_sync=on_sync)
+            if crawled == 0:
+                self._stop.wait(min(poll, max(self.next_due_in(), 1.0)))
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def summary(self) -> pd.DataFrame:
+        """One row per partner: change rate, interval and next crawl, fastest-moving first."""
+        df = pd.DataFrame(list(self.states.values()), columns=STATE_COLUMNS)
+        return df[['partner_uid', 'partner_name', 'host', 'change_rate_per_hour', 'crawl_interval_seconds',
+                   'crawls', 'changes', 'next_crawl_tms']].sort_values('change_rate_per_hour', ascending=False,
+                                                                       na_position='last')
@@ -1,6 +1,8 @@
 from pandas import DataFrame, read_sql_query
 from sqlalchemy.exc import SQLAlchemyError, OperationalError, InterfaceError
 from sqlalchemy import create_engine, text, engine as sa_engine
+from tasc_core.utils import util_metrics as metrics
+from tasc_core.utils.util_query_cache import QueryCache, written_tables
 
 
 class DbConnector:
@@ -21,6 +23,29 @@ class DbConnector:
         """
         connection_string = self.get_connection_string(server_adapter, host, database, port, username, password)
         self.engine = create_engine(connection_string)
+        self.cache = None
+
+    def enable_cache(self, max_bytes: int = 64 * 1024 ** 2, ttl: float = None, probe=None,
+                     probe_interval: float = 10.0) -> QueryCache:
+        """Serve repeated select_df queries from memory (see util_query_cache for how entries are invalidated).
+
+        Args:
+            max_bytes (int): Memory budget of the cache. Defaults to 64MB.
+            ttl (float): Seconds an entry is served without revalidation. Never expires when None.
+            probe (callable): Version probe catching writes made by other connections, e.g.
+                util_query_cache.pg_stat_probe.
+            probe_interval (float): Seconds a probed version is trusted before probing again.
+
+        Returns:
+            QueryCache: The cache, e.g. to read its stats.
+        """
+        self.cache = QueryCache(max_bytes=max_bytes, ttl=ttl, probe=probe, probe_interval=probe_interval)
+        return self.cache
+
+    def invalidate_cache(self, tables: list = None) -> None:
+        """Drops cached results reading any of `tables`, or all of them when tables is None."""
+        if self.cache is not None:
+            self.cache.invalidate(tables)
 
     @staticmethod
     def get_connection_string(server_adapter, host, database, port: int, username='', password=''):
@@ -35,11 +60,16 @@ class DbConnector:
         )
         return connection_url
 
-    def select_df(self, query: str) -> DataFrame:  # type: ignore
+    def select_df(self, query: str, params: dict = None, cache: bool = True) -> DataFrame:  # type: ignore
         """GET data from the database and return the results in a pandas DataFrame.
 
+        When a cache is enabled (see enable_cache), a repeated query is answered from memory with a copy of the
+        earlier result.
+
         Args:
             query (str): SQL SELECT query you want to execute
+            params (dict, optional): Values of :name bind parameters in the query. Defaults to None.
+            cache (bool, optional): Use the connector's cache, if enabled, for this query. Defaults to True.
 
         Returns:
             DataFrame: AEON response from your query
@@ -53,11 +83,27 @@ class DbConnector:
                 df = aeon.select_df("SELECT * FROM public.v_xref_idx_map LIMIT 10")
 
         """
+        key = tables = None
+        if cache and self.cache is not None:
+            key, tables = self.cache.key(query, params)
+            if key is not None:
+                tables = self.cache.resolve(self, tables)
+                key = key if tables is not None else None
+            if key is not None:
+                df = self.cache.get(key, self)
+                if df is not None:
+                    return df.copy()
+                # version is read before the query, so a write landing in between shows as a change later
+                version = self.cache.version(self, tables)
         try:
-            with self.engine.connect() as connection:
-                return read_sql_query(text(query), connection)
+            with metrics.timer(metrics.DB_SECONDS, op="select"), self.engine.connect() as connection:
+                df = read_sql_query(text(query), connection, params=params)
+            metrics.inc(metrics.DB_ROWS, len(df), op="select")
         except SQLAlchemyError as e:
             self.handle_error(e)
+        if key is not None:
+            self.cache.put(key, tables, df.copy(), version)
+        return df
 
     def execute_query(self, query: str) -> None:
         """Execute a SQL command. Used typically for commands that don't return a result, e.g. GRANT, ALTER
@@ -66,11 +112,16 @@ class DbConnector:
             query (str): SQL command
         """
         try:
-            with self.engine.connect() as connection:
+            with metrics.timer(metrics.DB_SECONDS, op="execute"), self.engine.connect() as connection:
                 connection.execute(text(query))
                 connection.commit()
         except SQLAlchemyError as e:
             self.handle_error(e)
+        finally:
+            if self.cache is not None:
+                tables = written_tables(query)
+                if tables is None or tables:
+                    self.cache.invalidate(tables)
 
     def handle_error(self, error):
         """Custom error handler for SQLAlchemy errors.
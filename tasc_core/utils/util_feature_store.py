@@ -0,0 +1,234 @@
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import zlib
+
+import numpy as np
+
+# Keys read or written per database round trip
+BATCH_SIZE = 500
+
+
+def content_hash(data: bytes) -> str:
+    """SHA-256 of encoded image bytes, used as the image part of a feature key when no canonical id exists."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def feature_key(image_hash: str, model_name: str, model_version: str, params: dict = None) -> str:
+    """Stable key for one model output on one image. Parameter order does not change the key."""
+    canonical = json.dumps([image_hash, model_name, model_version, params or {}], sort_keys=True,
+                           separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def encode_feature(value) -> tuple:
+    """Serialises a feature value into (kind, bytes).
+
+    Binary masks are bit-packed and zlib-compressed (a 1000x1000 mask typically shrinks to a few KB), other
+    arrays such as embeddings and LAB palettes are stored as compressed .npy, already-encoded images (bytes) as
+    is, and anything else as JSON.
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return 'bytes', bytes(value)
+    if isinstance(value, np.ndarray):
+        if value.dtype == bool or (value.dtype == np.uint8 and value.ndim == 2 and np.isin(value, (0, 255)).all()):
+            header = json.dumps({'shape': value.shape, 'scale': 1 if value.dtype == bool else 255}).encode('utf-8')
+            packed = np.packbits(value.astype(bool).ravel()).tobytes()
+            return 'mask', len(header).to_bytes(4, 'big') + header + zlib.compress(packed, 6)
+        buffer = io.BytesIO()
+        np.save(buffer, value, allow_pickle=False)
+        return 'ndarray', zlib.compress(buffer.getvalue(), 6)
+    return 'json', json.dumps(value, default=str).encode('utf-8')
+
+
+def decode_feature(kind: str, payload: bytes):
+    """Inverse of encode_feature."""
+    payload = bytes(payload)
+    if kind == 'bytes':
+        return payload
+    if kind == 'mask':
+        header_length = int.from_bytes(payload[:4], 'big')
+        header = json.loads(payload[4:4 + header_length])
+        shape = tuple(header['shape'])
+        bits = np.unpackbits(np.frombuffer(zlib.decompress(payload[4 + header_length:]), dtype=np.uint8))
+        mask = bits[:int(np.prod(shape))].reshape(shape).astype(bool)
+        return mask if header['scale'] == 1 else mask.astype(np.uint8) * 255
+    if kind == 'ndarray':
+        return np.load(io.BytesIO(zlib.decompress(payload)), allow_pickle=False)
+    return json.loads(payload.decode('utf-8'))
+
+
+class FeatureStore:
+    """Base class for precomputed per-image model outputs keyed by (image hash, model, version, params).
+
+    Subclasses implement _get_many and _put_many over encoded rows; batching, encoding and get_or_compute live
+    here so every backend behaves the same.
+    """
+
+    def __init__(self, model_name: str, model_version: str, params: dict = None) -> None:
+        self.model_name = model_name
+        self.model_version = model_version
+        self.params = params or {}
+
+    def key(self, image_hash: str) -> str:
+        return feature_key(image_hash, self.model_name, self.model_version, self.params)
+
+    def _get_many(self, keys: list) -> dict:
+        raise NotImplementedError
+
+    def _put_many(self, rows: list) -> None:
+        raise NotImplementedError
+
+    def get_many(self, image_hashes: list) -> dict:
+        """Returns image_hash -> decoded feature for every hash that has a stored feature."""
+        keys = {self.key(h): h for h in image_hashes}
+        found = {}
+        key_list = list(keys)
+        for start in range(0, len(key_list), BATCH_SIZE):
+            for key, (kind, payload) in self._get_many(key_list[start:start + BATCH_SIZE]).items():
+                found[keys[key]] = decode_feature(kind, payload)
+        return found
+
+    def put_many(self, features: dict) -> None:
+        """Stores image_hash -> feature. Existing entries for the same key are replaced."""
+        rows = []
+        params = json.dumps(self.params, sort_keys=True, default=str)
+        for image_hash, value in features.items():
+            kind, payload = encode_feature(value)
+            rows.append((self.key(image_hash), image_hash, self.model_name, self.model_version, params, kind,
+                         payload))
+        for start in range(0, len(rows), BATCH_SIZE):
+            self._put_many(rows[start:start + BATCH_SIZE])
+
+    def get(self, image_hash: str):
+        return self.get_many([image_hash]).get(image_hash)
+
+    def put(self, image_hash: str, value) -> None:
+        self.put_many({image_hash: value})
+
+    def get_or_compute(self, items: dict, compute_fn) -> dict:
+        """Returns features for every item, computing and storing only the ones that are missing.
+
+        Args:
+            items (dict): image_hash -> model input (e.g. image bytes, a path or a URL)
+            compute_fn (callable): takes a list of model inputs and returns a list of features in the same order
+
+        Returns:
+            dict: image_hash -> feature
+        """
+        found = self.get_many(list(items))
+        missing = [h for h in items if h not in found]
+        if missing:
+            computed = dict(zip(missing, compute_fn([items[h] for h in missing])))
+            self.put_many(computed)
+            found.update(computed)
+        return found
+
+
+class LocalFeatureStore(FeatureStore):
+    """Feature store backed by a local SQLite file.
+
+    Example:
+        store = LocalFeatureStore("data/processed/features.sqlite", "kmeans_palette", "1", {"num_colors": 3})
+        palettes = store.get_or_compute(
+            {content_hash(data): data for data in images},
+            lambda batch: [processor.extract_colors(image=Image.open(BytesIO(d))) for d in batch])
+    """
+
+    def __init__(self, path: str, model_name: str, model_version: str, params: dict = None) -> None:
+        super().__init__(model_name, model_version, params)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS image_features (
+                feature_key TEXT PRIMARY KEY,
+                image_hash TEXT,
+                model_name TEXT,
+                model_version TEXT,
+                params TEXT,
+                kind TEXT,
+                payload BLOB,
+                created_at_tms TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )""")
+        self._conn.execute('CREATE INDEX IF NOT EXISTS image_features_image_hash ON image_features (image_hash)')
+        self._conn.commit()
+
+    def _get_many(self, keys: list) -> dict:
+        placeholders = ','.join('?' * len(keys))
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT feature_key, kind, payload FROM image_features WHERE feature_key IN ({placeholders})',
+                keys).fetchall()
+        return {key: (kind, payload) for key, kind, payload in rows}
+
+    def _put_many(self, rows: list) -> None:
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO image_features '
+                '(feature_key, image_hash, model_name, model_version, params, kind, payload) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            self._conn.commit()
+
+
+class NebulaFeatureStore(FeatureStore):
+    """Feature store backed by tasc_prod.tasc_image_features in Nebula, through NebulaConnector.
+
+    The table is created by data_products/table/create/create_tasc_image_features.sql.
+
+    Example:
+        from tasc_core.utils.util_nebuladb import NebulaConnector
+
+        store = NebulaFeatureStore(NebulaConnector(), "u2net_mask", "1")
+        masks = store.get_many(image_hashes)
+    """
+
+    def __init__(self, nebula, model_name: str, model_version: str, params: dict = None,
+                 table_schema: str = 'tasc_prod', table_name: str = 'tasc_image_features') -> None:
+        super().__init__(model_name, model_version, params)
+        self.nebula = nebula
+        self.table = f'{table_schema}.{table_name}'
+
+    def _get_many(self, keys: list) -> dict:
+        conn = self.nebula.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(f'SELECT feature_key, kind, payload FROM {self.table} WHERE feature_key = ANY(%s)',
+                               (keys,))
+                return {key.strip(): (kind, payload) for key, kind, payload in cursor.fetchall()}
+            finally:
+                cursor.close()
+        finally:
+            conn.close()
+
+    def _put_many(self, rows: list) -> None:
+        from psycopg2 import Binary
+        from psycopg2.extras import execute_values
+
+        conn = self.nebula.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                execute_values(cursor, f"""
+                    INSERT INTO {self.table}
+                        (feature_key, image_hash, model_name, model_version, params, kind, payload)
+                    VALUES %s
+                    ON CONFLICT (feature_key) DO UPDATE SET kind = EXCLUDED.kind, payload = EXCLUDED.payload,
+                        created_at_tms = CURRENT_TIMESTAMP""",
+                               [row[:-1] + (Binary(row[-1]),) for row in rows])
+                conn.commit()
+            finally:
+                cursor.close()
+        except Exception as e:
+            conn.rollback()
+            raise Exception(f'Could not write features: {e}')
+        finally:
+            conn.close()
@@ -0,0 +1,287 @@
+"""Shared HTTP transport for outbound fetches: products.json crawls, product images and images sent to OpenAI.
+
+Most of our traffic goes to a handful of hosts (store domains and the Shopify CDN), so the cost of a fetch is
+dominated by the TCP and TLS handshakes when every call opens its own connection. HttpTransport keeps one pooled
+keep-alive client per process and adds the limits a bare requests.get() lacks:
+
+- connections are reused per host, up to `max_per_host` concurrent requests to any one host;
+- every request has a connect and a read timeout;
+- bodies are streamed and abandoned once they pass `max_body_bytes`;
+- resolved addresses are cached for `dns_cache_ttl` seconds;
+- backend="httpx" with http2=True multiplexes requests over one HTTP/2 connection per host (needs httpx[http2]).
+
+The backend can also be chosen with TASC_HTTP_BACKEND=httpx and TASC_HTTP2=1 for the shared transport.
+
+Example:
+    from tasc_core.utils.util_http import get_transport
+
+    transport = get_transport()
+    data = transport.fetch_bytes("https://cdn.shopify.com/s/files/1/example.jpg", target="image")
+    products = transport.get_json("https://www.example-store.com/products.json?limit=250", target="products_json")
+"""
+import json
+import os
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from tasc_core.utils import util_metrics as metrics
+
+# Largest response body read by fetch_bytes unless the caller passes its own limit
+MAX_BODY_BYTES = 50 * 1024 * 1024
+
+CHUNK_BYTES = 64 * 1024
+
+USER_AGENT = 'tasc-core/1.0'
+
+
+class ResponseTooLarge(ValueError):
+    """Raised when a response body is larger than the limit it was fetched with."""
+
+
+_installed_caches = []  # DnsCache instances serving socket.getaddrinfo, newest last
+_install_lock = threading.Lock()
+_system_getaddrinfo = None  # what socket.getaddrinfo was before the first install
+
+
+def _getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+    caches = _installed_caches
+    if caches:
+        return caches[-1].getaddrinfo(host, port, family, type, proto, flags)
+    return (_system_getaddrinfo or socket.getaddrinfo)(host, port, family, type, proto, flags)
+
+
+def _reset_locks_after_fork() -> None:
+    # a lock held by another thread at fork time would stay locked forever in the child
+    global _install_lock
+    _install_lock = threading.Lock()
+    for cache in _installed_caches:
+        cache._lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_locks_after_fork)
+
+
+class DnsCache:
+    """TTL cache in front of socket.getaddrinfo.
+
+    install() routes socket.getaddrinfo through the newest installed cache, which covers both backends and any
+    other client in the process; hostnames are left untouched, so TLS certificate checks and SNI still use the
+    original name. socket.getaddrinfo is patched once by a module-level hook, so caches can be installed in a
+    forked child or uninstalled in any order without chaining onto each other, and the original resolver is put
+    back when the last one is uninstalled.
+    """
+
+    def __init__(self, ttl: float = 300.0) -> None:
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        key = (host, port, family, type, proto, flags)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+        result = _system_getaddrinfo(host, port, family, type, proto, flags)
+        with self._lock:
+            self._entries[key] = (now + self.ttl, result)
+        return result
+
+    def install(self) -> None:
+        """Serves socket.getaddrinfo from this cache. Calling it again is a no-op."""
+        global _system_getaddrinfo
+        with _install_lock:
+            if self in _installed_caches:
+                return
+            if socket.getaddrinfo is not _getaddrinfo:
+                _system_getaddrinfo = socket.getaddrinfo
+                socket.getaddrinfo = _getaddrinfo
+            _installed_caches.append(self)
+
+    def uninstall(self) -> None:
+        """Stops serving lookups from this cache, restoring the original resolver when no cache is left."""
+        with _install_lock:
+            if self not in _installed_caches:
+                return
+            _installed_caches.remove(self)
+            if not _installed_caches and socket.getaddrinfo is _getaddrinfo:
+                socket.getaddrinfo = _system_getaddrinfo
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class HttpTransport:
+    """Pooled HTTP client with per-host concurrency caps, timeouts and response size limits.
+
+    One instance is meant to be shared by every thread of a process (see get_transport()).
+    """
+
+    def __init__(self, backend: str = 'requests', http2: bool = False, max_per_host: int = 8, max_hosts: int = 32,
+                 connect_timeout: float = 5.0, read_timeout: float = 30.0, retries: int = 2,
+                 dns_cache_ttl: float = 300.0, max_body_bytes: int = MAX_BODY_BYTES, headers: dict = None) -> None:
+        """
+        Args:
+            backend (str): "requests" (HTTP/1.1 keep-alive pool) or "httpx".
+            http2 (bool): Negotiate HTTP/2 where the server supports it. Only with backend="httpx".
+            max_per_host (int): Concurrent requests, and pooled connections, per host.
+            max_hosts (int): Hosts whose connection pools are kept open.
+            connect_timeout (float): Seconds to establish a connection.
+            read_timeout (float): Seconds to wait between bytes of the response.
+            retries (int): Retries of failed connects and 502/503/504 responses on idempotent requests.
+            dns_cache_ttl (float): Seconds resolved addresses are reused. 0 disables the cache.
+            max_body_bytes (int): Default limit of fetch_bytes().
+            headers (dict): Headers sent with every request.
+        """
+        if backend not in ('requests', 'httpx'):
+            raise ValueError(f"Unknown HTTP backend: {backend}")
+        if http2 and backend != 'httpx':
+            raise ValueError("HTTP/2 needs backend='httpx'")
+        self.backend = backend
+        self.http2 = http2
+        self.max_per_host = max_per_host
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_body_bytes = max_body_bytes
+        self._host_slots = {}
+        self._lock = threading.Lock()
+
+        self.dns_cache = DnsCache(dns_cache_ttl) if dns_cache_ttl else None
+        if self.dns_cache is not None:
+            self.dns_cache.install()
+
+        headers = {'User-Agent': USER_AGENT, **(headers or {})}
+        if backend == 'requests':
+            adapter = HTTPAdapter(pool_connections=max_hosts, pool_maxsize=max_per_host, pool_block=True,
+                                  max_retries=Retry(total=retries, connect=retries, read=0, backoff_factor=0.2,
+                                                    status_forcelist=(502, 503, 504), raise_on_status=False))
+            self.session = requests.Session()
+            self.session.headers.update(headers)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+        else:
+            import httpx
+
+            self.session = httpx.Client(
+                http2=http2, headers=headers, follow_redirects=True,
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(max_connections=max_per_host * max_hosts, max_keepalive_connections=max_hosts),
+                transport=httpx.HTTPTransport(http2=http2, retries=retries))
+
+    def _slot(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = self._host_slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return slot
+
+    def request(self, method: str, url: str, target: str = 'other', **kwargs):
+        """Sends a request and reads the whole response.
+
+        Returns:
+            requests.Response | httpx.Response: Both offer status_code, headers, content, json() and
+                raise_for_status().
+        """
+        if self.backend == 'requests':
+            kwargs.setdefault('timeout', self.timeout)
+        with self._slot(url), metrics.timer(metrics.HTTP_SECONDS, target=target):
+            response = self.session.request(method, url, **kwargs)
+        metrics.observe(metrics.HTTP_BYTES, len(response.content), buckets=metrics.SIZE_BUCKETS, target=target)
+        return response
+
+    def get(self, url: str, target: str = 'other', **kwargs):
+        return self.request('GET', url, target=target, **kwargs)
+
+    def fetch_bytes(self, url: str, target: str = 'other', max_bytes: int = None, **kwargs) -> bytes:
+        """Streams a GET response body, giving up as soon as it passes `max_bytes`.
+
+        Args:
+            url (str): URL to fetch.
+            target (str): Label of the HTTP metrics.
+            max_bytes (int): Size limit. Defaults to the transport's max_body_bytes.
+
+        Returns:
+            bytes: The response body.
+
+        Raises:
+            ResponseTooLarge: If the body, or its announced Content-Length, is over the limit.
+            requests.HTTPError | httpx.HTTPStatusError: On a 4xx or 5xx response.
+        """
+        max_bytes = max_bytes or self.max_body_bytes
+        with self._slot(url), metrics.timer(metrics.HTTP_SECONDS, target=target):
+            if self.backend == 'requests':
+                kwargs.setdefault('timeout', self.timeout)
+                with self.session.get(url, stream=True, **kwargs) as response:
+                    data = self._read_limited(url, response, response.iter_content(CHUNK_BYTES), max_bytes)
+            else:
+                with self.session.stream('GET', url, **kwargs) as response:
+                    data = self._read_limited(url, response, response.iter_bytes(CHUNK_BYTES), max_bytes)
+        metrics.observe(metrics.HTTP_BYTES, len(data), buckets=metrics.SIZE_BUCKETS, target=target)
+        return data
+
+    @staticmethod
+    def _read_limited(url: str, response, chunks, max_bytes: int) -> bytes:
+        response.raise_for_status()
+        length = response.headers.get('Content-Length')
+        if length is not None and length.isdigit() and int(length) > max_bytes:
+            raise ResponseTooLarge(f"{url} is {length} bytes, over the {max_bytes} byte limit")
+        buffer = bytearray()
+        for chunk in chunks:
+            buffer += chunk
+            if len(buffer) > max_bytes:
+                raise ResponseTooLarge(f"{url} is over the {max_bytes} byte limit")
+        return bytes(buffer)
+
+    def get_json(self, url: str, target: str = 'other', max_bytes: int = None, **kwargs):
+        """Fetches and decodes a JSON document, with the same size limit as fetch_bytes()."""
+        data = self.fetch_bytes(url, target=target, max_bytes=max_bytes, **kwargs)
+        with metrics.timer(metrics.DECODE_SECONDS, format="json"):
+            return json.loads(data)
+
+    def close(self) -> None:
+        self.session.close()
+        if self.dns_cache is not None:
+            self.dns_cache.uninstall()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+_transport = None
+_transport_pid = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> HttpTransport:
+    """The process-wide transport, created on first use from TASC_HTTP_BACKEND and TASC_HTTP2.
+
+    A forked worker process gets its own transport rather than sharing the parent's pooled sockets.
+    """
+    global _transport, _transport_pid
+    if _transport is None or _transport_pid != os.getpid():
+        with _transport_lock:
+            if _transport is None or _transport_pid != os.getpid():
+                http2 = os.getenv('TASC_HTTP2', '').lower() in ('1', 'true', 'yes')
+                backend = os.getenv('TASC_HTTP_BACKEND', 'httpx' if http2 else 'requests')
+                _transport = HttpTransport(backend=backend, http2=http2)
+                _transport_pid = os.getpid()
+    return _transport
+
+
+def set_transport(transport: HttpTransport) -> None:
+    """Replaces the process-wide transport, e.g. with different limits for a backfill job."""
+    global _transport, _transport_pid
+    with _transport_lock:
+        _transport = transport
+        _transport_pid = os.getpid()
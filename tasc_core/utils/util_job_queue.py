@@ -0,0 +1,195 @@
+"""Postgres-backed work queue for image and enrichment jobs, stored in Nebula.
+
+Jobs live in tasc_prod.tasc_job_queue (data_products/table/create/create_tasc_job_queue.sql). Workers claim them in
+batches with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent workers never block on or receive the same job, and
+capacity grows by starting more workers against the same table.
+
+A claimed job is leased to its worker until lease_expires_tms. Workers extend the lease with heartbeat() while a
+job runs; a job whose worker died becomes claimable again once its lease expires, until it has used max_attempts.
+Result writes are fenced by (lease_owner, attempts): complete() and fail() only apply while the caller still holds
+that attempt's lease, so a worker that lost its lease cannot overwrite the result of the attempt that replaced it,
+and repeating a completion is a no-op. Enqueueing is idempotent on (queue, task, job_key).
+
+It runs against any Postgres, e.g. a local one started with
+`docker run -e POSTGRES_PASSWORD=tasc -p 5432:5432 postgres:16`, by pointing NebulaConnector at it
+(NEBULA_DB_HOST=localhost etc.) and creating the table from the DDL.
+
+Example:
+    from tasc_core.utils.util_nebuladb import NebulaConnector
+
+    queue = JobQueue(NebulaConnector(), 'images')
+    queue.enqueue('colours', [{'image_url': url} for url in image_urls], key='image_url', priority=5)
+
+    jobs = queue.claim('worker-1', limit=8)
+    for job in jobs:
+        queue.complete(job, 'worker-1', {'colours': ['#112233']})
+"""
+import json
+from collections import namedtuple
+
+Job = namedtuple('Job', ['job_id', 'task', 'job_key', 'payload', 'attempts'])
+
+_CLAIM_SQL = """
+WITH claimable AS (
+    SELECT job_id FROM {table}
+    WHERE queue = %s
+      AND attempts < max_attempts
+      AND ((status = 'queued' AND available_at_tms <= now())
+           OR (status = 'leased' AND lease_expires_tms < now()))
+    ORDER BY priority DESC, job_id
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+)
+UPDATE {table} q
+SET status = 'leased', lease_owner = %s, lease_expires_tms = now() + %s * interval '1 second',
+    attempts = q.attempts + 1, updated_at_tms = now()
+FROM claimable
+WHERE q.job_id = claimable.job_id
+RETURNING q.job_id, q.task, q.job_key, q.payload, q.attempts
+"""
+
+
+class JobQueue:
+    """One named queue in the job table. Safe to share between threads; every call uses its own pooled connection.
+    """
+
+    def __init__(self, nebula, queue: str, table_schema: str = 'tasc_prod',
+                 table_name: str = 'tasc_job_queue') -> None:
+        """
+        Args:
+            nebula (NebulaConnector): Database holding the job table.
+            queue (str): Queue name, e.g. 'images' or 'enrichment'.
+            table_schema (str): Schema of the job table.
+            table_name (str): Job table.
+        """
+        self.nebula = nebula
+        self.queue = queue
+        self.table = f'{table_schema}.{table_name}'
+
+    def _run(self, sql: str, params=None, fetch: bool = False, many: bool = False):
+        conn = self.nebula.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                if many:
+                    from psycopg2.extras import execute_values
+                    rows = execute_values(cursor, sql, params, fetch=fetch)
+                else:
+                    cursor.execute(sql, params)
+                    rows = cursor.fetchall() if fetch else None
+                rowcount = cursor.rowcount
+                conn.commit()
+            finally:
+                cursor.close()
+        except Exception as e:
+            conn.rollback()
+            raise Exception(f'Job queue {self.queue} query failed: {e}')
+        finally:
+            conn.close()
+        return rows if fetch else rowcount
+
+    def enqueue(self, task: str, payloads: list, key: str = None, priority: int = 0, max_attempts: int = 3) -> int:
+        """
+        Adds jobs, skipping any whose job_key is already queued for the same task.
+
+        Args:
+            task (str): Worker handler to run, e.g. 'colours', 'remove_bg' or 'enrich'.
+            payloads (list): JSON-serialisable dicts, one per job.
+            key (str): Payload field used as job_key. Defaults to the whole payload, serialised.
+            priority (int): Higher runs first.
+            max_attempts (int): Attempts before a job is marked failed.
+
+        Returns:
+            int: Number of jobs added.
+        """
+        rows = []
+        for payload in payloads:
+            job_key = str(payload[key]) if key else json.dumps(payload, sort_keys=True)
+            rows.append((self.queue, task, job_key, json.dumps(payload), priority, max_attempts))
+        if not rows:
+            return 0
+        added = self._run(f"INSERT INTO {self.table} (queue, task, job_key, payload, priority, max_attempts) "
+                          f"VALUES %s ON CONFLICT (queue, task, job_key) DO NOTHING RETURNING job_id",
+                          rows, fetch=True, many=True)
+        return len(added)
+
+    def claim(self, worker_id: str, limit: int = 1, lease_seconds: float = 300) -> list:
+        """
+        Leases up to `limit` jobs to `worker_id`, highest priority first. Jobs with an expired lease are claimed
+        again. Returns an empty list when nothing is claimable.
+        """
+        rows = self._run(_CLAIM_SQL.format(table=self.table), (self.queue, limit, worker_id, lease_seconds),
+                         fetch=True)
+        jobs = [Job(job_id, task, job_key, payload if isinstance(payload, dict) or payload is None
+                    else json.loads(payload), attempts)
+                for job_id, task, job_key, payload, attempts in rows]
+        return sorted(jobs, key=lambda job: job.job_id)
+
+    def heartbeat(self, jobs: list, worker_id: str, lease_seconds: float = 300) -> set:
+        """
+        Extends the leases of running jobs.
+
+        Returns:
+            set: job_ids still leased to this worker. Any others were lost (lease expired and claimed elsewhere),
+                and their results will be rejected.
+        """
+        if not jobs:
+            return set()
+        rows = self._run(f"UPDATE {self.table} SET lease_expires_tms = now() + %s * interval '1 second', "
+                         f"updated_at_tms = now() "
+                         f"WHERE (job_id, attempts) IN (SELECT * FROM unnest(%s::bigint[], %s::int[])) "
+                         f"AND status = 'leased' AND lease_owner = %s RETURNING job_id",
+                         (lease_seconds, [job.job_id for job in jobs], [job.attempts for job in jobs], worker_id),
+                         fetch=True)
+        return {row[0] for row in rows}
+
+    def complete(self, job: Job, worker_id: str, result=None) -> bool:
+        """
+        Stores a job's result and marks it done, if `worker_id` still holds this attempt's lease.
+
+        Returns:
+            bool: False when the lease was lost or the job already completed; the result is then discarded.
+        """
+        return self._run(f"UPDATE {self.table} SET status = 'done', result = %s, error = NULL, lease_owner = NULL, "
+                         f"lease_expires_tms = NULL, updated_at_tms = now() "
+                         f"WHERE job_id = %s AND attempts = %s AND status = 'leased' AND lease_owner = %s",
+                         (json.dumps(result), job.job_id, job.attempts, worker_id)) == 1
+
+    def fail(self, job: Job, worker_id: str, error: str, retry_delay: float = 30) -> bool:
+        """
+        Records a failed attempt. The job is retried after retry_delay * attempts seconds, or marked failed once
+        it has used max_attempts. Fenced like complete().
+        """
+        return self._run(f"UPDATE {self.table} SET "
+                         f"status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END, "
+                         f"available_at_tms = now() + %s * attempts * interval '1 second', error = %s, "
+                         f"lease_owner = NULL, lease_expires_tms = NULL, updated_at_tms = now() "
+                         f"WHERE job_id = %s AND attempts = %s AND status = 'leased' AND lease_owner = %s",
+                         (retry_delay, str(error)[:2000], job.job_id, job.attempts, worker_id)) == 1
+
+    def reap(self) -> int:
+        """Marks failed the jobs whose lease expired on their last attempt. Returns how many."""
+        return self._run(f"UPDATE {self.table} SET status = 'failed', error = COALESCE(error, 'lease expired'), "
+                         f"lease_owner = NULL, updated_at_tms = now() "
+                         f"WHERE queue = %s AND status = 'leased' AND lease_expires_tms < now() "
+                         f"AND attempts >= max_attempts", (self.queue,))
+
+    def retry_failed(self, task: str = None) -> int:
+        """Puts failed jobs back in the queue with a fresh set of attempts. Returns how many."""
+        task_filter = " AND task = %s" if task else ""
+        return self._run(f"UPDATE {self.table} SET status = 'queued', attempts = 0, available_at_tms = now(), "
+                         f"updated_at_tms = now() WHERE queue = %s AND status = 'failed'{task_filter}",
+                         (self.queue, task) if task else (self.queue,))
+
+    def counts(self) -> dict:
+        """Number of jobs per status in this queue."""
+        rows = self._run(f"SELECT status, COUNT(*) FROM {self.table} WHERE queue = %s GROUP BY status",
+                         (self.queue,), fetch=True)
+        return {status: count for status, count in rows}
+
+    def results(self, task: str = None) -> list:
+        """(job_key, result) of the completed jobs, optionally of one task."""
+        task_filter = " AND task = %s" if task else ""
+        rows = self._run(f"SELECT job_key, result FROM {self.table} WHERE queue = %s AND status = 'done'"
+                         f"{task_filter} ORDER BY job_id", (self.queue, task) if task else (self.queue,), fetch=True)
+        return [(job_key, result if not isinstance(result, str) else json.loads(result)) for job_key, result in rows]
@@ -1,8 +1,8 @@
+from contextlib import contextmanager
 from pandas import DataFrame
-from pandas.io.sql import get_schema  # type: ignore
-from re import sub
 from io import StringIO
 from tasc_core.utils.util_db_connector import DbConnector  # from util_db_connector import DbConnector #
+from tasc_core.utils import util_metrics as metrics
 import os
 from dotenv import load_dotenv
 import pandas as pd
@@ -16,6 +16,27 @@ nebula_db_host = os.getenv('NEBULA_DB_HOST')
 nebula_db_port = os.getenv('NEBULA_DB_PORT')
 nebula_db_name = os.getenv('NEBULA_DB_NAME')
 
+# Bookkeeping columns that change on every load and are left out of row hashes
+AUDIT_COLUMNS = ['asof_dt', 'created_at_tms', 'created_by', 'last_modified_tms', 'last_modified_by', 'source_date',
+                 'source_datetime']
+
+
+def row_hash(df: DataFrame, columns: list = None) -> pd.Series:
+    """Stable 64-bit content hash of each row, computed vectorised over the DataFrame.
+
+    Values are hashed through their string form, so the same content gives the same hash whether a column was
+    parsed as int, float or str (an int column holding nulls becomes float in pandas), and in every process (pandas
+    hashes with a fixed key). Returned as int64 to fit a Postgres BIGINT.
+    """
+    subset = df[columns if columns is not None else df.columns.tolist()].copy()
+    for column in subset.columns:
+        values = subset[column]
+        if values.dtype.kind == 'f' and (values.dropna() % 1 == 0).all():
+            subset[column] = values.astype('Int64')
+    normalised = subset.astype(object).where(subset.notna(), None).astype(str)
+    hashes = pd.util.hash_pandas_object(normalised, index=False).to_numpy(dtype='uint64')
+    return pd.Series(hashes.view('int64'), index=df.index)
+
 
 class NebulaConnector(DbConnector):
     """This object handles connections to Nebula database and any SQL query you want to run. NebulaConnector inherits
@@ -92,12 +113,17 @@ class NebulaConnector(DbConnector):
             try:
                 # Convert DataFrame to CSV format in memory
                 buffer = StringIO()
-                df.to_csv(buffer, index=False, header=False)
+                with metrics.timer(metrics.DB_SECONDS, op="copy_serialise"):
+                    df.to_csv(buffer, index=False, header=False)
+                metrics.observe(metrics.COPY_BYTES, buffer.tell(), buckets=metrics.SIZE_BUCKETS, table=table_name)
                 buffer.seek(0)
-                cursor.execute(f"SET search_path TO {table_schema}")
-                column_names = ','.join(df.columns)
-                cursor.copy_expert(f"copy {table_name}({column_names}) from stdout (format csv)", buffer)
-                conn.commit()
+                with metrics.timer(metrics.DB_SECONDS, op="copy"):
+                    cursor.execute(f"SET search_path TO {table_schema}")
+                    column_names = ','.join(df.columns)
+                    cursor.copy_expert(f"copy {table_name}({column_names}) from stdout (format csv)", buffer)
+                    conn.commit()
+                    self.invalidate_cache([table_name])
+                metrics.inc(metrics.DB_ROWS, len(df), op="copy")
             finally:
                 cursor.close()
         except Exception as e:
@@ -106,13 +132,52 @@ class NebulaConnector(DbConnector):
         finally:
             conn.close()
 
-    def upsert_df(self, table_name: str, table_schema: str, df: DataFrame, conflict_columns: list) -> None:
+    @contextmanager
+    def transaction(self, tables: list = None):
+        """Raw connection shared by several writes, committed when the block exits and rolled back if it raises.
+
+        Pass it as `connection` to upsert_df and delete_missing so they neither commit nor close it. Cached reads of
+        `tables` (or every cached read when None) are dropped after the commit.
+
+        Example:
+            with nebula.transaction(['tasc_products', 'tasc_product_variants']) as connection:
+                nebula.upsert_df('tasc_products', 'tasc_prod', products, ['parent_product_id'], connection=connection)
+                nebula.upsert_df('tasc_product_variants', 'tasc_prod', variants, ['child_product_id'],
+                                 connection=connection)
+        """
+        conn = self.engine.raw_connection()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        self.invalidate_cache(tables)
+
+    def upsert_df(self, table_name: str, table_schema: str, df: DataFrame, conflict_columns: list,
+                  detect_changes: bool = True, hash_column: str = 'row_hash', ignore_columns: list = None,
+                  connection=None) -> dict:
         """Insert dataframe into sandbox table and update records if the record already exists (based on
         conflict_columns). The SQL query used is inspired by: https://stackoverflow.com/a/17267423/1960089
 
+        With detect_changes, a content hash of every row is computed client-side (see row_hash) and compared with the
+        hash stored in `hash_column` for the same conflict key. Only new rows and rows whose content changed are sent
+        to the database; unchanged rows are not rewritten, so a daily refresh where most rows are identical costs
+        one narrow key/hash transfer instead of a full rewrite. Tables without `hash_column` are upserted in full.
+
         Args: table_name (str): name of table, excluding schema prefix df (DataFrame):
         dataframe with column headers matching the table headers in the table conflict_columns (list): a list
         of column names (strings) that can be used to uniquely identify which rows to update
+        detect_changes (bool): skip rows whose content hash matches the stored one. Defaults to True.
+        hash_column (str): BIGINT column holding the row hash. Defaults to 'row_hash'.
+        ignore_columns (list): columns left out of the hash. Defaults to the audit columns (AUDIT_COLUMNS).
+        connection: raw connection of an open transaction() to write in. The caller commits it. Defaults to a
+            connection of its own, committed before returning.
+
+        Returns:
+            dict: counts of 'inserted', 'updated' and 'unchanged' rows
         """
         # self.insert_df(table_name='tasc_package_usage', table_schema="", df=DataFrame([{'username':
         # nebula_db_username, 'environment': 'NebulaConnector', 'module': 'tasc.utils.nebula.upsert', 'detail': None}]))
@@ -123,51 +188,223 @@ class NebulaConnector(DbConnector):
             return None
 
         columns_list = df.columns.tolist()
-        update_list = [col for col in columns_list if col not in conflict_columns]
         if not set(conflict_columns).issubset(columns_list):
             print('Conflict columns provided must exist in dataframe column headers')
             return None
 
-        # create temp table
-        columns_str = ",".join(columns_list)
-        create_temp_table_sql = get_schema(df, 'temp')
-        create_temp_table_sql = sub('"', '', create_temp_table_sql, 2)
-        create_temp_table_sql = sub('CREATE TABLE', 'CREATE TEMPORARY TABLE', create_temp_table_sql)
+        target = f'{table_schema}.{table_name}'
+        conn = connection or self.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                # lock the target table so the hashes read below are still current when rows are written
+                cursor.execute(f"LOCK TABLE {target} IN EXCLUSIVE MODE")
 
-        # populate the temp table with data from the dataframe
-        values_str = "%s," * len(columns_list)
-        values = list(df.itertuples(index=False, name=None))
-        insert_to_temp_sql = f"INSERT INTO temp ({columns_str}) VALUES ({values_str[:-1]})"
+                cursor.execute("SELECT column_name FROM information_schema.columns "
+                               "WHERE table_schema = %s AND table_name = %s", (table_schema, table_name))
+                table_columns = {row[0] for row in cursor.fetchall()}
+                if detect_changes and hash_column not in table_columns:
+                    print(f'{target} has no {hash_column} column, upserting every row')
+                    detect_changes = False
 
-        # lock the target table
-        lock_target_table_sql = f"LOCK TABLE {table_schema}.{table_name} IN EXCLUSIVE MODE"
+                if detect_changes:
+                    df = df.drop(columns=[hash_column], errors='ignore')
+                    hash_columns = [col for col in df.columns if col not in conflict_columns
+                                    and col not in (AUDIT_COLUMNS if ignore_columns is None else ignore_columns)]
+                    df = df.assign(**{hash_column: row_hash(df, hash_columns)})
+                    with metrics.timer(metrics.DB_SECONDS, op="upsert_diff"):
+                        status = self._diff_row_hashes(cursor, target, df, conflict_columns, hash_column)
+                    changed = df[status.values != 'unchanged']
+                    counts = {'inserted': int((status == 'inserted').sum()),
+                              'updated': int((status == 'updated').sum()),
+                              'unchanged': int((status == 'unchanged').sum())}
+                else:
+                    changed = df
+                    counts = None
 
-        # update records where the conflict_columns return a match in the target table
-        update_list_str = ", ".join([f'{col}=temp.{col}' for col in update_list])
-        conflict_str = " AND ".join([f'{table_name}.{col}=temp.{col}' for col in conflict_columns])
-        update_target_table_sql = f"UPDATE {table_schema}.{table_name} SET {update_list_str} FROM temp WHERE {conflict_str}"
+                with metrics.timer(metrics.DB_SECONDS, op="upsert"):
+                    written = self._upsert_rows(cursor, target, changed, conflict_columns)
+                if connection is None:
+                    conn.commit()
+                    self.invalidate_cache([table_name])
+                metrics.inc(metrics.DB_ROWS, len(changed), op="upsert")
+                if counts is None:
+                    counts = {'inserted': written, 'updated': len(changed) - written, 'unchanged': 0}
+                if detect_changes:
+                    metrics.inc(metrics.DB_ROWS, counts['unchanged'], op="upsert_skipped")
+            finally:
+                cursor.close()
+        except Exception as e:
+            if connection is None:
+                conn.rollback()
+            raise Exception(f'Could not insert into table: {e}')
+        finally:
+            if connection is None:
+                conn.close()
+        return counts
 
-        # insert rows that don't match on conflict cols
-        insert_columns_str = ",".join([f'{table_name}.{col}' for col in columns_list])
-        null_filter_str = " AND ".join([f"{table_name}.{col} IS NULL" for col in conflict_columns])
-        insert_target_table_sql = f'INSERT INTO {table_schema}.{table_name} SELECT {insert_columns_str} FROM temp LEFT OUTER JOIN {table_schema}.{table_name} ON ({conflict_str}) WHERE {null_filter_str}'
+    def delete_missing(self, table_name: str, table_schema: str, df: DataFrame, key_columns: list,
+                       parent_column: str, parent_ids: list, connection=None) -> int:
+        """Deletes the rows of the given parents whose key is not in df, e.g. variants or images a product no longer
+        has. Rows of parents not in `parent_ids` are left alone, so a partial crawl never deletes other products.
+
+        Args:
+            table_name (str): name of table, excluding schema prefix
+            table_schema (str): schema of the table
+            df (DataFrame): the rows to keep; only key_columns are sent
+            key_columns (list): columns identifying a row
+            parent_column (str): column holding the parent id
+            parent_ids (list): parents whose full set of rows is in df
+            connection: raw connection of an open transaction() to write in. Defaults to a connection of its own.
+
+        Returns:
+            int: number of rows deleted
+        """
+        if not len(parent_ids):
+            return 0
+        target = f'{table_schema}.{table_name}'
+        conn = connection or self.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                self._copy_into_temp(cursor, 'tasc_delete_parents', target,
+                                     DataFrame({parent_column: pd.unique(pd.Series(parent_ids))}))
+                self._copy_into_temp(cursor, 'tasc_keep_keys', target, df.reindex(columns=key_columns).drop_duplicates())
+                key_str = " AND ".join([f'k.{col}=t.{col}' for col in key_columns])
+                with metrics.timer(metrics.DB_SECONDS, op="delete_missing"):
+                    cursor.execute(f"DELETE FROM {target} t USING tasc_delete_parents p "
+                                   f"WHERE t.{parent_column}=p.{parent_column} "
+                                   f"AND NOT EXISTS (SELECT 1 FROM tasc_keep_keys k WHERE {key_str})")
+                deleted = cursor.rowcount
+                if connection is None:
+                    conn.commit()
+                    self.invalidate_cache([table_name])
+                metrics.inc(metrics.DB_ROWS, deleted, op="delete_missing")
+            finally:
+                cursor.close()
+        except Exception as e:
+            if connection is None:
+                conn.rollback()
+            raise Exception(f'Could not delete from table: {e}')
+        finally:
+            if connection is None:
+                conn.close()
+        return deleted
+
+
+    def update_columns(self, table_name: str, table_schema: str, df: DataFrame, key_columns: list,
+                       hash_column: str = 'row_hash', touch_column: str = 'last_modified_tms') -> int:
+        """Narrow batched UPDATE of the non-key columns of df, matched on key_columns.
 
-        # drop temp table
-        drop_temp_table_sql = 'DROP TABLE temp'
+        Only the key and value columns are COPYed into a temp table, and rows whose values already match are not
+        rewritten, so refreshing a few columns of a large table (e.g. price and availability) costs one COPY and
+        one UPDATE. When the table has `hash_column`, it is cleared on updated rows so the next upsert_df sees them
+        as changed, and `touch_column` is set to the update time.
+
+        Args:
+            table_name (str): name of table, excluding schema prefix
+            table_schema (str): schema of the table
+            df (DataFrame): key columns plus the columns to update
+            key_columns (list): columns identifying the rows to update
+            hash_column (str): row hash column of upsert_df to invalidate. Defaults to 'row_hash'.
+            touch_column (str): timestamp column set to now() on updated rows. Defaults to 'last_modified_tms'.
+
+        Returns:
+            int: number of rows updated
+        """
+        if df is None or df.empty:
+            return 0
+        value_columns = [col for col in df.columns if col not in key_columns]
+        if not set(key_columns).issubset(df.columns) or not value_columns:
+            print('df must hold the key columns and at least one column to update')
+            return 0
 
+        target = f'{table_schema}.{table_name}'
         conn = self.engine.raw_connection()
         try:
             cursor = conn.cursor()
             try:
-                sql = ';'.join(
-                    ['BEGIN', create_temp_table_sql, insert_to_temp_sql, lock_target_table_sql, update_target_table_sql,
-                     insert_target_table_sql, drop_temp_table_sql])
-                cursor.executemany(sql, values)
+                cursor.execute("SELECT column_name FROM information_schema.columns "
+                               "WHERE table_schema = %s AND table_name = %s", (table_schema, table_name))
+                table_columns = {row[0] for row in cursor.fetchall()}
+                self._copy_into_temp(cursor, 'tasc_update_rows', target, df[key_columns + value_columns])
+
+                set_list = [f'{col}=temp.{col}' for col in value_columns]
+                if hash_column in table_columns:
+                    set_list.append(f'{hash_column}=NULL')
+                if touch_column in table_columns:
+                    set_list.append(f'{touch_column}=now()')
+                key_str = " AND ".join([f't.{col}=temp.{col}' for col in key_columns])
+                changed_str = " OR ".join([f't.{col} IS DISTINCT FROM temp.{col}' for col in value_columns])
+                with metrics.timer(metrics.DB_SECONDS, op="update_columns"):
+                    cursor.execute(f"UPDATE {target} t SET {', '.join(set_list)} FROM tasc_update_rows temp "
+                                   f"WHERE {key_str} AND ({changed_str})")
+                updated = cursor.rowcount
                 conn.commit()
+                self.invalidate_cache([table_name])
+                metrics.inc(metrics.DB_ROWS, updated, op="update_columns")
             finally:
                 cursor.close()
         except Exception as e:
             conn.rollback()
-            raise Exception(f'Could not insert into table: {e}')
+            raise Exception(f'Could not update table: {e}')
         finally:
-            conn.close()
\ No newline at end of file
+            conn.close()
+        return updated
+
+    @staticmethod
+    def _copy_into_temp(cursor, temp_table: str, target: str, df: DataFrame) -> None:
+        """Creates a temp table with the target's types for df's columns and COPYs df into it."""
+        columns_str = ",".join(df.columns)
+        cursor.execute(f"DROP TABLE IF EXISTS {temp_table}")
+        cursor.execute(f"CREATE TEMPORARY TABLE {temp_table} ON COMMIT DROP AS "
+                       f"SELECT {columns_str} FROM {target} WITH NO DATA")
+        buffer = StringIO()
+        df.to_csv(buffer, index=False, header=False)
+        metrics.observe(metrics.COPY_BYTES, buffer.tell(), buckets=metrics.SIZE_BUCKETS, table=temp_table)
+        buffer.seek(0)
+        cursor.copy_expert(f"copy {temp_table}({columns_str}) from stdout (format csv)", buffer)
+
+    def _diff_row_hashes(self, cursor, target: str, df: DataFrame, conflict_columns: list,
+                         hash_column: str) -> pd.Series:
+        """Sends only conflict keys and hashes, and classifies each row as 'inserted', 'updated' or 'unchanged'."""
+        keys = df[conflict_columns + [hash_column]]
+        self._copy_into_temp(cursor, 'tasc_upsert_keys', target, keys)
+        conflict_str = " AND ".join([f't.{col}=k.{col}' for col in conflict_columns])
+        cursor.execute(f"SELECT {', '.join(f'k.{col}' for col in conflict_columns)}, "
+                       f"t.{hash_column} IS NOT DISTINCT FROM k.{hash_column} "
+                       f"FROM tasc_upsert_keys k JOIN {target} t ON ({conflict_str})")
+        existing = DataFrame(cursor.fetchall(), columns=conflict_columns + ['_unchanged'])
+
+        # compare keys as text so driver types (e.g. int vs VARCHAR ids) do not matter
+        key_df = df[conflict_columns].astype(str).reset_index(drop=True)
+        existing[conflict_columns] = existing[conflict_columns].astype(str)
+        existing = existing.groupby(conflict_columns, as_index=False)['_unchanged'].all()
+        merged = key_df.merge(existing, on=conflict_columns, how='left')
+        status = pd.Series('inserted', index=df.index)
+        status[merged['_unchanged'].eq(False).values] = 'updated'
+        status[merged['_unchanged'].eq(True).values] = 'unchanged'
+        return status
+
+    def _upsert_rows(self, cursor, target: str, df: DataFrame, conflict_columns: list) -> int:
+        """UPDATEs matching rows and INSERTs the rest from a COPY-loaded temp table. Returns rows inserted."""
+        if df.empty:
+            return 0
+        table_name = target.split('.')[-1]
+        columns_list = df.columns.tolist()
+        update_list = [col for col in columns_list if col not in conflict_columns]
+        self._copy_into_temp(cursor, 'tasc_upsert_rows', target, df)
+
+        # update records where the conflict_columns return a match in the target table
+        conflict_str = " AND ".join([f'{table_name}.{col}=temp.{col}' for col in conflict_columns])
+        if update_list:
+            update_list_str = ", ".join([f'{col}=temp.{col}' for col in update_list])
+            cursor.execute(f"UPDATE {target} SET {update_list_str} FROM tasc_upsert_rows temp WHERE {conflict_str}")
+
+        # insert rows that don't match on conflict cols
+        columns_str = ",".join(columns_list)
+        insert_columns_str = ",".join([f'temp.{col}' for col in columns_list])
+        null_filter_str = " AND ".join([f"{table_name}.{col} IS NULL" for col in conflict_columns])
+        cursor.execute(f"INSERT INTO {target} ({columns_str}) SELECT {insert_columns_str} FROM tasc_upsert_rows temp "
+                       f"LEFT OUTER JOIN {target} ON ({conflict_str}) WHERE {null_filter_str}")
+        return cursor.rowcount
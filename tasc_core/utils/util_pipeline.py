@@ -0,0 +1,252 @@
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from tasc_core.utils import util_metrics as metrics
+from tasc_core.utils.util_checkpoint import ProgressStore
+
+# Marks the end of the stream on a stage's inbound queue, one per worker
+_DONE = object()
+
+
+class Stage:
+    """One step of a Pipeline.
+
+    Args:
+        name (str): Stage name, used in stats and checkpoint scopes.
+        fn (callable): Takes one item value. Returns the value passed downstream, or None to drop the item.
+        workers (int): Number of items processed concurrently by this stage.
+        kind (str): "thread" for I/O-bound work (HTTP, database), "process" for CPU-bound work. Process stages need
+            a module-level `fn` and picklable values.
+        queue_size (int): Capacity of the stage's inbound queue. When it is full, the upstream stage blocks, which is
+            how backpressure propagates back to the source. Defaults to 2 * workers.
+        fan_out (bool): `fn` returns an iterable of (sub_key, value) pairs, each sent downstream as its own item.
+        side_effect (bool): `fn` is called for its effect only (e.g. a database write) and the input value is passed
+            downstream unchanged. Completion is checkpointed per item, so a resumed run does not repeat the effect.
+        initializer (callable): Called once in each worker process of a "process" stage, e.g. to load a model.
+    """
+
+    def __init__(self, name: str, fn, workers: int = 1, kind: str = 'thread', queue_size: int = None,
+                 fan_out: bool = False, side_effect: bool = False, initializer=None) -> None:
+        if kind not in ('thread', 'process'):
+            raise ValueError(f"Unknown stage kind: {kind}")
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.kind = kind
+        self.queue_size = queue_size or 2 * workers
+        self.fan_out = fan_out
+        self.side_effect = side_effect
+        self.initializer = initializer
+
+
+class StageStats:
+    def __init__(self, workers: int) -> None:
+        self.workers = workers
+        self.processed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, **values) -> None:
+        with self._lock:
+            for name, value in values.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self, wall_seconds: float) -> dict:
+        return {
+            'processed': self.processed,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'busy_seconds': round(self.busy_seconds, 3),
+            'blocked_seconds': round(self.blocked_seconds, 3),
+            'utilisation': round(self.busy_seconds / (self.workers * wall_seconds), 3) if wall_seconds else 0.0,
+        }
+
+
+class Pipeline:
+    """Runs items through a chain of stages connected by bounded queues.
+
+    All stages run at the same time, each with its own concurrency, so end-to-end wall time approaches that of the
+    slowest stage instead of the sum of all of them. Queues between stages are bounded: a slow stage fills its
+    inbound queue, the stage before it blocks on put, and so on back to the source, so memory stays flat however
+    many items the source yields.
+
+    Each source item is a unit of progress. It is marked done in the ProgressStore once every item derived from it
+    (through fan-out stages) has left the last stage without error; a resumed run skips source items already done.
+    An item that raises is reported and dropped, and its source item is retried on the next run.
+
+    Example:
+        pipeline = Pipeline("ingestion", [
+            Stage("fetch", fetch_products, workers=4),
+            Stage("insert", insert_products, workers=2, side_effect=True),
+            Stage("images", list_image_urls, fan_out=True),
+            Stage("download", download_image, workers=16),
+            Stage("colours", extract_colours, workers=4, kind="process"),
+        ], progress=ProgressStore("data/processed/ingestion_progress.sqlite"))
+        stats = pipeline.run(store_urls)
+    """
+
+    def __init__(self, name: str, stages: list, progress: ProgressStore = None, verbose: bool = True) -> None:
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.name = name
+        self.stages = stages
+        self.progress = progress
+        self.verbose = verbose
+        self._outstanding = {}
+        self._failed_roots = {}
+        self._lock = threading.Lock()
+
+    def _scope(self, stage: Stage = None) -> str:
+        return self.name if stage is None else f'{self.name}:{stage.name}'
+
+    def _adjust(self, root: str, delta: int, error: str = None) -> None:
+        """Tracks items in flight per source item, and records the source item once the last one finishes."""
+        with self._lock:
+            if error is not None:
+                self._failed_roots.setdefault(root, error)
+            self._outstanding[root] += delta
+            if self._outstanding[root] > 0:
+                return None
+            del self._outstanding[root]
+            error = self._failed_roots.pop(root, None)
+        if self.progress is not None:
+            if error is None:
+                self.progress.mark_done(self._scope(), root)
+            else:
+                self.progress.mark_failed(self._scope(), root, error)
+
+    def _put(self, outbox: queue.Queue, item, stats: StageStats) -> None:
+        start = time.perf_counter()
+        outbox.put(item)
+        stats.add(blocked_seconds=time.perf_counter() - start)
+
+    def _process(self, stage: Stage, key: str, value, pool) -> tuple:
+        """Runs one item through a stage. Returns the (key, value) pairs to send downstream, and whether the stage
+        was skipped because a previous run already completed it."""
+        if stage.side_effect and self.progress is not None and self.progress.is_done(self._scope(stage), key):
+            return [(key, value)], True
+        if pool is not None:
+            result = pool.submit(stage.fn, value).result()
+        else:
+            result = stage.fn(value)
+        if stage.side_effect:
+            if self.progress is not None:
+                self.progress.mark_done(self._scope(stage), key)
+            return [(key, value)], False
+        if stage.fan_out:
+            return [(f'{key}/{sub_key}', sub_value) for sub_key, sub_value in result], False
+        return ([] if result is None else [(key, result)]), False
+
+    def _worker(self, index: int, inbox: queue.Queue, outbox: queue.Queue, pool, stats: StageStats,
+                remaining: list) -> None:
+        stage = self.stages[index]
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                break
+            root, key, value = item
+            start = time.perf_counter()
+            try:
+                outputs, skipped = self._process(stage, key, value, pool)
+            except Exception as e:
+                stats.add(failed=1, busy_seconds=time.perf_counter() - start)
+                print(f"[{self.name}:{stage.name}] {key} failed: {e}")
+                metrics.inc(metrics.ERRORS, job=self.name, stage=stage.name)
+                self._adjust(root, -1, error=f'{stage.name}: {e}')
+                continue
+            elapsed = time.perf_counter() - start
+            stats.add(processed=0 if skipped else 1, skipped=1 if skipped else 0,
+                      busy_seconds=0.0 if skipped else elapsed)
+            if not skipped:
+                metrics.observe(metrics.STAGE_SECONDS, elapsed, job=self.name, stage=stage.name)
+
+            if outbox is None:
+                self._adjust(root, -1)
+                continue
+            if len(outputs) != 1:
+                self._adjust(root, len(outputs) - 1)
+            for output_key, output_value in outputs:
+                self._put(outbox, (root, output_key, output_value), stats)
+
+        with self._lock:
+            remaining[index] -= 1
+            last = remaining[index] == 0
+        if last and outbox is not None:
+            for _ in range(self.stages[index + 1].workers):
+                outbox.put(_DONE)
+
+    def run(self, source) -> dict:
+        """Runs every item of `source` through the pipeline and blocks until all stages have drained.
+
+        Args:
+            source (iterable): Items to process, either plain values (keyed by str(value)) or (key, value) pairs.
+
+        Returns:
+            dict: Per-stage counts and timings, plus totals for the run. A stage with utilisation near 1.0 is the
+                bottleneck; high blocked_seconds on a stage means the stage after it cannot keep up.
+        """
+        with metrics.profile_job(self.name):
+            return self._run(source)
+
+    def _run(self, source) -> dict:
+        queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        stats = {stage.name: StageStats(stage.workers) for stage in self.stages}
+        remaining = [stage.workers for stage in self.stages]
+        pools = [ProcessPoolExecutor(max_workers=stage.workers, initializer=stage.initializer)
+                 if stage.kind == 'process' else None for stage in self.stages]
+        done = self.progress.done_keys(self._scope()) if self.progress is not None else set()
+
+        threads = []
+        for index, stage in enumerate(self.stages):
+            outbox = queues[index + 1] if index + 1 < len(self.stages) else None
+            for n in range(stage.workers):
+                thread = threading.Thread(target=self._worker, name=f'{self.name}-{stage.name}-{n}', daemon=True,
+                                          args=(index, queues[index], outbox, pools[index], stats[stage.name],
+                                                remaining))
+                thread.start()
+                threads.append(thread)
+
+        start = time.perf_counter()
+        submitted = skipped = 0
+        source_blocked = 0.0
+        try:
+            for item in source:
+                key, value = item if isinstance(item, tuple) and len(item) == 2 else (str(item), item)
+                key = str(key)
+                if key in done:
+                    skipped += 1
+                    continue
+                with self._lock:
+                    self._outstanding[key] = self._outstanding.get(key, 0) + 1
+                put_start = time.perf_counter()
+                queues[0].put((key, key, value))
+                source_blocked += time.perf_counter() - put_start
+                submitted += 1
+        finally:
+            for _ in range(self.stages[0].workers):
+                queues[0].put(_DONE)
+            for thread in threads:
+                thread.join()
+            for pool in pools:
+                if pool is not None:
+                    pool.shutdown()
+
+        wall_seconds = time.perf_counter() - start
+        result = {
+            'wall_seconds': round(wall_seconds, 3),
+            'submitted': submitted,
+            'skipped': skipped,
+            'source_blocked_seconds': round(source_blocked, 3),
+            'stages': {name: stage_stats.as_dict(wall_seconds) for name, stage_stats in stats.items()},
+        }
+        if self.verbose:
+            print(f"[{self.name}] {submitted} items in {wall_seconds:.1f}s ({skipped} already done)")
+            for name, stage_stats in result['stages'].items():
+                print(f"  {name}: {stage_stats['processed']} ok, {stage_stats['failed']} failed, "
+                      f"{stage_stats['skipped']} skipped, utilisation {stage_stats['utilisation']:.0%}")
+        return result
@@ -0,0 +1,280 @@
+"""In-process result cache for DbConnector.select_df.
+
+Reference data such as tasc_prod.tasc_xref_partners and the colour and fabric rulesets is read constantly but
+changes rarely. With a cache enabled on a connector (DbConnector.enable_cache), repeated reads of the same query are
+served from memory:
+
+- entries are keyed by the normalised SQL text and its bind parameters;
+- total size is capped by `max_bytes` (pandas deep memory usage), evicting the least recently used entries;
+- writes made through the same connector (insert_df, upsert_df, update_columns, execute_query) drop every entry
+  that reads the written table. A query on a view is tracked under the view's base tables as well (see
+  view_base_tables), so writing tasc_products drops cached reads of v_tasc_products_shopify;
+- writes made elsewhere are caught by an optional version probe, run at most once per `probe_interval` seconds per
+  set of tables, or bounded by `ttl`.
+
+Queries on information_schema or the pg_ catalogs are never cached, since DDL run elsewhere changes them.
+
+Example:
+    nebula = NebulaConnector()
+    nebula.enable_cache(max_bytes=128 * 1024 ** 2, probe=pg_stat_probe, probe_interval=30)
+    partners = nebula.select_df("SELECT * FROM tasc_prod.tasc_xref_partners")   # database
+    partners = nebula.select_df("SELECT * FROM tasc_prod.tasc_xref_partners")   # memory
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from tasc_core.utils import util_metrics as metrics
+
+_STRING_OR_SPACE = re.compile(r"('(?:[^']|'')*')|\s+")
+_READ_TABLES = re.compile(r'\b(?:from|join)\s+((?:"[^"]+"|\w+)(?:\.(?:"[^"]+"|\w+))?)', re.IGNORECASE)
+_WRITE_TABLES = re.compile(
+    r'\b(?:insert\s+into|update|delete\s+from|truncate(?:\s+table)?|alter\s+table|drop\s+table(?:\s+if\s+exists)?|'
+    r'create\s+(?:unlogged\s+)?table(?:\s+if\s+not\s+exists)?|copy|refresh\s+materialized\s+view)\s+'
+    r'((?:"[^"]+"|\w+)(?:\.(?:"[^"]+"|\w+))?)', re.IGNORECASE)
+_WRITE_VERBS = re.compile(r'^\s*(?:with\b.*?\b)?(insert|update|delete|truncate|alter|drop|create|copy|merge|refresh)\b',
+                          re.IGNORECASE | re.DOTALL)
+_UNCACHEABLE = re.compile(r'\b(?:information_schema|pg_\w+)\b|\bfor\s+(?:update|share)\b|\b(?:now|random)\s*\(',
+                          re.IGNORECASE)
+
+
+def normalise_sql(query: str) -> str:
+    """Collapses whitespace outside string literals and drops a trailing semicolon, so formatting does not split
+    cache entries."""
+    return _STRING_OR_SPACE.sub(lambda m: m.group(1) or ' ', query).strip().rstrip(';').strip()
+
+
+def _table_name(identifier: str) -> str:
+    """Bare, unquoted, lower-case table name. Schemas are ignored so invalidation errs on the side of dropping."""
+    return identifier.split('.')[-1].strip('"').lower()
+
+
+def read_tables(query: str) -> set:
+    """Tables a query reads from (FROM and JOIN targets)."""
+    return {_table_name(t) for t in _READ_TABLES.findall(_STRING_OR_SPACE.sub(lambda m: "''" if m.group(1) else ' ',
+                                                                                query))}
+
+
+def written_tables(query: str):
+    """
+    Tables a statement may modify.
+
+    Returns:
+        set | None: The table names, an empty set for statements that do not change data (GRANT, SET, SELECT...),
+            or None when the statement writes but its targets cannot be told, meaning everything is stale.
+    """
+    stripped = _STRING_OR_SPACE.sub(lambda m: "''" if m.group(1) else ' ', query)
+    tables = {_table_name(t) for t in _WRITE_TABLES.findall(stripped)}
+    if tables:
+        return tables
+    return None if _WRITE_VERBS.search(stripped) else set()
+
+
+def pg_stat_probe(connector, tables: set):
+    """
+    Version probe for Postgres: the insert/update/delete counters of the tables in pg_stat_user_tables.
+
+    One catalog query, cheap next to re-reading a table, though the counters can lag a committed write by up to
+    the statistics flush interval (about a second).
+    """
+    from sqlalchemy import text
+
+    with connector.engine.connect() as connection:
+        rows = connection.execute(text("SELECT relname, n_tup_ins + n_tup_upd + n_tup_del FROM pg_stat_user_tables "
+                                       "WHERE relname = ANY(:tables) ORDER BY relname"),
+                                  {'tables': sorted(tables)}).fetchall()
+    return tuple((name, int(count)) for name, count in rows)
+
+
+def view_base_tables(connector, tables: set) -> set:
+    """
+    `tables` plus the tables every view among them reads, followed through views of views.
+
+    View definitions come from pg_views and pg_matviews on Postgres and from the SQLAlchemy inspector (default
+    schema) elsewhere. Like read_tables, names are bare and schemas are ignored.
+    """
+    from sqlalchemy import inspect, text
+
+    if connector.engine.dialect.name == 'postgresql':
+        def definitions(names):
+            with connector.engine.connect() as connection:
+                rows = connection.execute(text("SELECT viewname, definition FROM pg_views "
+                                               "WHERE viewname = ANY(:names) "
+                                               "UNION ALL SELECT matviewname, definition FROM pg_matviews "
+                                               "WHERE matviewname = ANY(:names)"),
+                                          {'names': sorted(names)}).fetchall()
+            return {name: definition for name, definition in rows}
+    else:
+        inspector = inspect(connector.engine)
+        views = {name.lower(): name for name in inspector.get_view_names()}
+
+        def definitions(names):
+            return {name: inspector.get_view_definition(views[name]) for name in names if name in views}
+
+    resolved = set(tables)
+    pending = set(tables)
+    while pending:
+        found = set()
+        for definition in definitions(pending).values():
+            found |= read_tables(definition or '')
+        pending = found - resolved
+        resolved |= found
+    return resolved
+
+
+class _Entry:
+    __slots__ = ('df', 'tables', 'size', 'stored_at', 'version')
+
+    def __init__(self, df, tables, size, version):
+        self.df = df
+        self.tables = tables
+        self.size = size
+        self.stored_at = time.monotonic()
+        self.version = version
+
+
+class QueryCache:
+    """LRU cache of select_df results, bounded by memory. Thread-safe."""
+
+    def __init__(self, max_bytes: int = 64 * 1024 ** 2, ttl: float = None, probe=None,
+                 probe_interval: float = 10.0, resolver=view_base_tables) -> None:
+        """
+        Args:
+            max_bytes (int): Memory budget for cached frames. Results larger than a quarter of it are not cached.
+            ttl (float): Seconds an entry is served without revalidation. Never expires when None.
+            probe (callable): probe(connector, tables) -> hashable version of the tables, e.g. pg_stat_probe.
+            probe_interval (float): Seconds a probed version is trusted before probing again.
+            resolver (callable): resolver(connector, tables) -> the tables plus the base tables of any views among
+                them, run once per set of tables. None trusts the query text alone.
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.probe = probe
+        self.probe_interval = probe_interval
+        self.resolver = resolver
+        self.size = 0
+        self.stats = {'hits': 0, 'misses': 0, 'invalidated': 0, 'evicted': 0}
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._resolved = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(query: str, params: dict = None):
+        """
+        Cache key and read tables of a query, or (None, None) when it must not be cached.
+        """
+        if _UNCACHEABLE.search(query) or written_tables(query) != set():
+            return None, None
+        tables = frozenset(read_tables(query))
+        if not tables:
+            return None, None
+        params_key = tuple(sorted((str(k), repr(v)) for k, v in (params or {}).items()))
+        return (normalise_sql(query), params_key), tables
+
+    def resolve(self, connector, tables: frozenset):
+        """
+        The tables a cached result of `tables` depends on: views are expanded to their base tables, once per set.
+
+        Returns:
+            frozenset | None: None when views could not be resolved, in which case the result must not be cached.
+        """
+        if self.resolver is None or connector is None:
+            return tables
+        with self._lock:
+            resolved = self._resolved.get(tables)
+        if resolved is None:
+            try:
+                resolved = frozenset(_table_name(t) for t in self.resolver(connector, tables)) | tables
+            except Exception as e:
+                print(f'Could not resolve views of {sorted(tables)}, not caching: {e}')
+                return None
+            with self._lock:
+                self._resolved[tables] = resolved
+        return resolved
+
+    def version(self, connector, tables: frozenset):
+        """Current version of `tables` from the probe, reusing a probed value for probe_interval seconds."""
+        if self.probe is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            cached = self._versions.get(tables)
+        if cached is not None and now - cached[0] < self.probe_interval:
+            return cached[1]
+        version = self.probe(connector, tables)
+        with self._lock:
+            self._versions[tables] = (now, version)
+        return version
+
+    def get(self, key, connector=None):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and self.ttl is not None and time.monotonic() - entry.stored_at > self.ttl:
+            self._drop(key)
+            entry = None
+        if entry is not None and self.probe is not None and self.version(connector, entry.tables) != entry.version:
+            self._drop(key, invalidated=True)
+            entry = None
+        with self._lock:
+            if entry is None:
+                self.stats['misses'] += 1
+            else:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+        metrics.inc(metrics.DB_CACHE, result='hit' if entry is not None else 'miss')
+        return None if entry is None else entry.df
+
+    def put(self, key, tables: frozenset, df, version=None) -> None:
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes // 4:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old.size
+            self._entries[key] = _Entry(df, tables, size, version)
+            self.size += size
+            while self.size > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted.size
+                self.stats['evicted'] += 1
+
+    def _drop(self, key, invalidated: bool = False) -> None:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry.size
+                if invalidated:
+                    self.stats['invalidated'] += 1
+
+    def invalidate(self, tables=None) -> int:
+        """
+        Drops entries reading any of `tables` (names with or without schema), or every entry when tables is None.
+
+        Returns:
+            int: Number of entries dropped.
+        """
+        with self._lock:
+            if tables is None:
+                keys = list(self._entries)
+                self._versions.clear()
+                # statements with unknown targets include CREATE/DROP VIEW, which change what a view reads
+                self._resolved.clear()
+            else:
+                names = {_table_name(t) for t in tables}
+                keys = [key for key, entry in self._entries.items() if entry.tables & names]
+                self._versions = {k: v for k, v in self._versions.items() if not k & names}
+            for key in keys:
+                self.size -= self._entries.pop(key).size
+            self.stats['invalidated'] += len(keys)
+        if keys:
+            metrics.inc(metrics.DB_CACHE, len(keys), result='invalidated')
+        return len(keys)
+
+    def clear(self) -> None:
+        self.invalidate(None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -1,7 +1,17 @@
 import json
-import requests
 import pandas as pd
 from requests.exceptions import HTTPError
+from tasc_core.utils import util_metrics as metrics
+from tasc_core.utils.util_http import get_transport
+
+
+def product_sizes(product: dict) -> str:
+    """Comma-separated values of a product's "Size" option, or an empty string when it has none."""
+    for option in product.get('options', []):
+        if option['name'].lower() == 'size':
+            return ", ".join(option['values'])
+    return ""
+
 
 class ShopifyProductParser:
     def __init__(self, url: str):
@@ -28,18 +38,19 @@ class ShopifyProductParser:
             parser.load_json()
         """
         try:
-            response = requests.get(self.url)
-            response.raise_for_status()  # Raise an exception for HTTP errors
+            # Pooled keep-alive transport: repeated pages of the same store reuse one connection
+            content = get_transport().fetch_bytes(self.url, target="products_json")
         except HTTPError as http_err:
             raise HTTPError(f"HTTP error occurred: {http_err}")
         except Exception as err:
             raise Exception(f"An error occurred: {err}")
 
-        if not response.content:
+        if not content:
             raise ValueError("Empty response from the URL")
 
         try:
-            self.json_data = response.json()
+            with metrics.timer(metrics.DECODE_SECONDS, format="json"):
+                self.json_data = json.loads(content)
         except json.JSONDecodeError as e:
             raise ValueError(f"Invalid JSON data: {e}")
 
@@ -68,12 +79,7 @@ class ShopifyProductParser:
             image_urls = [img['src'] for img in images[:5]]
             image_fields = {f'product_image_{i + 1}_url': image_urls[i] if i < len(image_urls) else None for i in range(5)}
 
-            # Extract sizes
-            sizes = []
-            for option in product.get('options', []):
-                if option['name'].lower() == 'size':
-                    sizes = option['values']
-                    break
+            sizes = product_sizes(product)
 
             for variant in product['variants']:
                 complete_products.append({
@@ -97,7 +103,7 @@ class ShopifyProductParser:
                     'taxable': variant['taxable'],
                     'featured_image': variant.get('featured_image'),
                     'position': variant['position'],
-                    'sizes': ", ".join(sizes),  # Add sizes field
+                    'sizes': sizes,  # Add sizes field
                     **image_fields  # Add image fields to the dictionary
                 })
         return complete_products
@@ -115,4 +121,90 @@ class ShopifyProductParser:
             df = parser.to_dataframe()
         """
         complete_products = self.parse_products()
-        return pd.DataFrame(complete_products)
\ No newline at end of file
+        return pd.DataFrame(complete_products)
+
+    def to_normalised_dataframes(self):
+        """
+        Convert the loaded JSON into separate product, variant and image tables, storing each product-level field
+        (title, body_html, tags, images) once per product instead of once per variant.
+
+        Returns:
+            dict: {'products': DataFrame, 'variants': DataFrame, 'images': DataFrame}, matching the
+                tasc_products, tasc_product_variants and tasc_product_images tables.
+
+        Raises:
+            ValueError: If JSON data is not loaded.
+
+        Example:
+            parser = ShopifyProductParser(url)
+            parser.load_json()
+            frames = parser.to_normalised_dataframes()
+            frames['variants'].head()
+        """
+        if self.json_data is None:
+            raise ValueError("JSON data not loaded. Call load_json() first.")
+
+        products, variants, images = [], [], []
+        for product in self.json_data['products']:
+            products.append({
+                'parent_product_id': product['id'],
+                'product_title': product['title'],
+                'product_desc': product.get('body_html'),
+                'handle': product.get('handle'),
+                'vendor': product.get('vendor'),
+                'product_type': product.get('product_type'),
+                'tags': ", ".join(product.get('tags', [])),
+                'published_at': product.get('published_at'),
+                'created_at': product.get('created_at'),
+                'updated_at': product.get('updated_at'),
+                'sizes': product_sizes(product),
+            })
+            for position, image in enumerate(product.get('images', []), start=1):
+                images.append({
+                    'parent_product_id': product['id'],
+                    'position': position,
+                    'image_url': image['src'],
+                })
+            for variant in product['variants']:
+                variants.append({
+                    'child_product_id': variant['id'],
+                    'parent_product_id': product['id'],
+                    'variant_title': variant['title'],
+                    'sku': variant.get('sku'),
+                    'price': variant['price'],
+                    'grams': variant['grams'],
+                    'available': variant['available'],
+                    'requires_shipping': variant['requires_shipping'],
+                    'taxable': variant['taxable'],
+                    'featured_image': variant.get('featured_image'),
+                    'position': variant['position'],
+                })
+
+        return {
+            'products': pd.DataFrame(products),
+            'variants': pd.DataFrame(variants),
+            'images': pd.DataFrame(images, columns=['parent_product_id', 'position', 'image_url']),
+        }
+
+    def to_stock_dataframe(self):
+        """
+        Convert the loaded JSON into variant-level availability and price only, for stock syncs that do not need
+        the product content.
+
+        Returns:
+            DataFrame: One row per variant with child_product_id, parent_product_id, price and available.
+
+        Raises:
+            ValueError: If JSON data is not loaded.
+
+        Example:
+            parser = ShopifyProductParser(url)
+            parser.load_json()
+            stock = parser.to_stock_dataframe()
+        """
+        if self.json_data is None:
+            raise ValueError("JSON data not loaded. Call load_json() first.")
+
+        rows = [(variant['id'], product['id'], variant['price'], variant['available'])
+                for product in self.json_data['products'] for variant in product['variants']]
+        return pd.DataFrame(rows, columns=['child_product_id', 'parent_product_id', 'price', 'available'])
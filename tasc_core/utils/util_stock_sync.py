@@ -0,0 +1,152 @@
+"""Availability and price sync between full catalogue ingests.
+
+Stock changes far more often than product content, so refreshing `available` and `price` should not need a full
+re-ingest. A stock sync fetches each store's products.json, keeps only the variant-level fields, diffs them against
+the current catalogue in one vectorised merge and applies just the deltas:
+
+- in memory, through ApparelCollection.apply_stock_deltas();
+- in Postgres, through NebulaConnector.update_columns(), a narrow batched UPDATE of the changed rows only.
+
+Variants missing from the catalogue are counted but not inserted; they arrive with the next full ingest. A store
+whose products.json cannot be fetched is reported in the stats and skipped, the other stores are still synced.
+
+The database side defaults to tasc_products_shopify, the table run_ingestion writes. That table keeps one row per
+variant per asof_dt, so only each variant's latest row is compared and updated; pass table_name (and the matching
+table to ingestion) when the catalogue lives in the normalised tasc_product_variants table instead.
+
+Example:
+    from tasc_core.utils.util_nebuladb import NebulaConnector
+
+    stats = sync_stock(["https://www.example-store.com/products.json?limit=250"], nebula=NebulaConnector())
+    print(stats)   # {'fetched': 1840, 'changed': 37, 'new': 0, 'updated_rows': 37, ...}
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from tasc_core.utils.util_shopify_product_parser import ShopifyProductParser
+
+STOCK_KEY = 'child_product_id'
+STOCK_COLUMNS = ['price', 'available']
+# Table run_ingestion writes by default
+STOCK_TABLE = 'tasc_products_shopify'
+
+
+def fetch_stock(url: str) -> pd.DataFrame:
+    """Fetches one products.json URL and keeps only variant id, product id, price and availability."""
+    parser = ShopifyProductParser(url)
+    parser.load_json()
+    return parser.to_stock_dataframe()
+
+
+def normalise_stock(df: pd.DataFrame) -> pd.DataFrame:
+    """Brings stock frames from Shopify (price as str), the database (Decimal) and memory to comparable types."""
+    df = df.copy()
+    df[STOCK_KEY] = df[STOCK_KEY].astype(str)
+    if 'parent_product_id' in df.columns:
+        df['parent_product_id'] = df['parent_product_id'].astype(str)
+    if 'price' in df.columns:
+        df['price'] = pd.to_numeric(df['price'], errors='coerce').astype('float64').round(2)
+    if 'available' in df.columns:
+        df['available'] = df['available'].astype('boolean')
+    return df
+
+
+def diff_stock(current: pd.DataFrame, fresh: pd.DataFrame, columns: list = None) -> tuple:
+    """
+    Compares fresh stock with the catalogue in one merge.
+
+    Args:
+        current (DataFrame): Catalogue stock, with child_product_id and the compared columns.
+        fresh (DataFrame): Stock fetched from the stores, same columns.
+        columns (list): Columns compared. Defaults to price and available.
+
+    Returns:
+        tuple: The changed variants (child_product_id, the new values and the previous ones suffixed "_old"), and
+            the fresh variants missing from the catalogue.
+    """
+    columns = columns or STOCK_COLUMNS
+    current = normalise_stock(current[[STOCK_KEY] + columns]).drop_duplicates(STOCK_KEY, keep='last')
+    fresh = normalise_stock(fresh).drop_duplicates(STOCK_KEY, keep='last')
+    merged = fresh.merge(current, on=STOCK_KEY, how='left', suffixes=('', '_old'), indicator=True)
+
+    known = merged['_merge'] == 'both'
+    changed = pd.Series(False, index=merged.index)
+    for column in columns:
+        new, old = merged[column], merged[f'{column}_old']
+        same = (new == old).fillna(False).astype(bool) | (new.isna() & old.isna())
+        changed |= ~same
+    keep = [col for col in fresh.columns] + [f'{column}_old' for column in columns]
+    deltas = merged.loc[known & changed, keep].reset_index(drop=True)
+    new_variants = merged.loc[~known, fresh.columns].reset_index(drop=True)
+    return deltas, new_variants
+
+
+def load_stock(nebula, parent_ids: list, table_schema: str = 'tasc_prod',
+               table_name: str = STOCK_TABLE) -> pd.DataFrame:
+    """Reads the catalogue's price and availability for the variants of the given products, from each variant's
+    latest asof_dt row."""
+    if len(parent_ids) == 0:
+        return pd.DataFrame(columns=[STOCK_KEY, 'asof_dt'] + STOCK_COLUMNS)
+    ids_str = ", ".join("'" + str(i).replace("'", "''") + "'" for i in pd.unique(pd.Series(parent_ids).astype(str)))
+    return nebula.select_df(f"SELECT DISTINCT ON ({STOCK_KEY}) {STOCK_KEY}, asof_dt, {', '.join(STOCK_COLUMNS)} "
+                            f"FROM {table_schema}.{table_name} WHERE parent_product_id IN ({ids_str}) "
+                            f"ORDER BY {STOCK_KEY}, asof_dt DESC NULLS LAST")
+
+
+def _fetch_or_error(url: str) -> tuple:
+    try:
+        return fetch_stock(url), None
+    except Exception as e:
+        print(f"Could not fetch stock from {url}: {e}")
+        return None, str(e)
+
+
+def sync_stock(urls: list, nebula=None, collection=None, table_schema: str = 'tasc_prod',
+               table_name: str = STOCK_TABLE, workers: int = 4) -> dict:
+    """
+    Fetches variant stock for every store in `urls` and applies the changes.
+
+    Args:
+        urls (list): products.json URLs.
+        nebula (NebulaConnector): Catalogue to diff against and update. Rows are not updated when None.
+        collection (ApparelCollection): In-memory catalogue, diffed against the fresh stock and given its deltas.
+            The database, when also given, is diffed separately against its own latest rows.
+        table_schema (str): Schema of the variant table.
+        table_name (str): Table holding price and available per variant and asof_dt. Defaults to the table
+            run_ingestion writes.
+        workers (int): Concurrent products.json requests.
+
+    Returns:
+        dict: fetched, changed and new (against the database when given, else the collection), updated_rows (in
+            Postgres), updated_items (in memory), failed (url -> error of the stores that could not be fetched) and
+            seconds.
+    """
+    if nebula is None and collection is None:
+        raise ValueError("Nothing to sync: pass a NebulaConnector, an ApparelCollection or both")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(_fetch_or_error, urls))
+    frames = [frame for frame, _ in results if frame is not None]
+    failed = {url: error for url, (_, error) in zip(urls, results) if error is not None}
+    fresh = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(
+        columns=[STOCK_KEY, 'parent_product_id'] + STOCK_COLUMNS)
+
+    stats = {'fetched': len(fresh), 'changed': 0, 'new': 0, 'updated_rows': 0, 'updated_items': 0, 'failed': failed}
+    if collection is not None:
+        deltas, new_variants = diff_stock(collection.stock_frame(), fresh)
+        stats.update(changed=len(deltas), new=len(new_variants))
+        stats['updated_items'] = collection.apply_stock_deltas(deltas)
+    if nebula is not None:
+        # the database is always diffed against its own rows, whatever the in-memory catalogue holds
+        current = load_stock(nebula, fresh['parent_product_id'].tolist(), table_schema, table_name)
+        deltas, new_variants = diff_stock(current, fresh)
+        stats.update(changed=len(deltas), new=len(new_variants))
+        if not deltas.empty:
+            # only the latest row of each variant, the one the diff was made against, is updated
+            rows = deltas[[STOCK_KEY] + STOCK_COLUMNS].merge(normalise_stock(current[[STOCK_KEY, 'asof_dt']]),
+                                                              on=STOCK_KEY, how='left')
+            stats['updated_rows'] = nebula.update_columns(table_name, table_schema, rows, [STOCK_KEY, 'asof_dt'])
+    stats['seconds'] = round(time.perf_counter() - start, 3)
+    return stats
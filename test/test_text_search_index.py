@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+
+from tasc_core.models.nlp.text_search_index import TextSearchIndex
+
+
+def test_missing_description_vendor_and_type_are_empty():
+    df = pd.DataFrame({
+        'parent_product_id': ['1', '2'],
+        'product_title': ['Linen Shirt', 'Wool Coat'],
+        'product_desc': [np.nan, '<p>Heavy <b>wool</b></p>'],
+        'tags': ['summer', np.nan],
+        'vendor': [np.nan, 'Cole Buxton'],
+        'product_type': [np.nan, 'Coat'],
+        'sizes': [np.nan, 'S, M'],
+    })
+
+    index = TextSearchIndex()
+    assert index.update_from_dataframe(df) == 2
+
+    assert 'nan' not in index.attributes['vendor']
+    assert 'nan' not in index.attributes['product_type']
+    assert 'nan' not in index.attributes['size']
+    assert [hit[0] for hit in index.search('linen shirt')][:1] == ['1']
+    assert [hit[0] for hit in index.search('wool', vendor='cole buxton')] == ['2']
+    assert index.search('nan') == []
@@ -0,0 +1,350 @@
+"""HTTP API over the tasc_core models.
+
+Models are loaded once per worker process when the pool starts, so request latency only covers inference.
+CPU-bound work (colour clustering, background removal) runs in a process pool off the event loop, and
+concurrent requests for the same model are grouped into micro-batches before being sent to a worker.
+Search and colour matching are in-memory index lookups served directly by the API process.
+
+Run locally with:
+
+    uvicorn web.app:app --port 8000
+
+Configuration (environment variables):
+    TASC_MODEL_WORKERS: number of model worker processes (default: 2)
+    TASC_WARM_MODELS: comma-separated models loaded at worker start, from "colour,background" (default: both)
+    TASC_SEARCH_INDEX_PATH: TextSearchIndex file written by TextSearchIndex.save()
+    TASC_COLOUR_INDEX_PATH: ColourIndex file written by ColourIndex.save()
+    TASC_FEATURE_STORE_PATH: LocalFeatureStore file; when set, model outputs are served from and written to it
+    TASC_METRICS: set to 1 to collect request and model timings, exposed at /metrics in the Prometheus text format
+"""
+import asyncio
+import base64
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from io import BytesIO
+
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel
+
+load_dotenv()
+
+from tasc_core.utils import util_metrics as metrics  # noqa: E402 (reads TASC_METRICS from .env)
+from tasc_core.utils.util_http import get_transport  # noqa: E402
+
+MODEL_WORKERS = int(os.getenv('TASC_MODEL_WORKERS', '2'))
+WARM_MODELS = [m for m in os.getenv('TASC_WARM_MODELS', 'colour,background').split(',') if m]
+SEARCH_INDEX_PATH = os.getenv('TASC_SEARCH_INDEX_PATH')
+COLOUR_INDEX_PATH = os.getenv('TASC_COLOUR_INDEX_PATH')
+FEATURE_STORE_PATH = os.getenv('TASC_FEATURE_STORE_PATH')
+# Matting mode of /remove-background cut-outs; part of the feature store version, since it changes the output
+BACKGROUND_MATTING = 'adaptive'
+# Seconds every worker gets to load its models (U2Net weights are downloaded on first use)
+WARMUP_TIMEOUT = 600
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Worker process side: models live in module globals of each worker process
+# ---------------------------------------------------------------------------------------------------------------------
+
+_worker_models = {}
+_warm_barrier = None
+
+
+def _load_worker_model(name: str):
+    if name not in _worker_models:
+        if name == 'colour':
+            from tasc_core.models.image_recognition.image_colour_recognition_model import ImageProcessor
+            _worker_models[name] = ImageProcessor()
+        elif name == 'background':
+            from tasc_core.models.image_recognition import image_background_removal_model
+            # loads the U2Net weights now rather than on the first request
+            image_background_removal_model._get_model('u2net')
+            _worker_models[name] = image_background_removal_model
+        else:
+            raise ValueError(f"Unknown model: {name}")
+    return _worker_models[name]
+
+
+def _init_worker(models: list, barrier=None) -> None:
+    global _warm_barrier
+    _warm_barrier = barrier
+    for name in models:
+        _load_worker_model(name)
+
+
+def _warmup_worker() -> int:
+    # The initializer has loaded the models before any task runs. Waiting on a barrier shared by all workers holds
+    # this process until every other worker has taken one of the warm-up tasks, so each task reports a distinct pid.
+    if _warm_barrier is not None:
+        _warm_barrier.wait(WARMUP_TIMEOUT)
+    return os.getpid()
+
+
+def _extract_colours_batch(images: list) -> list:
+    from PIL import Image
+
+    processor = _load_worker_model('colour')
+    results = []
+    for data in images:
+        try:
+            results.append(processor.extract_colors(image=Image.open(BytesIO(data))))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def _remove_background_batch(images: list) -> list:
+    model = _load_worker_model('background')
+    results = []
+    for data in images:
+        try:
+            results.append(bytes(model.remove_bg_bytes(data, matting=BACKGROUND_MATTING)))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# API process side
+# ---------------------------------------------------------------------------------------------------------------------
+
+class MicroBatcher:
+    """Groups concurrent requests for one model into batches of up to `max_batch` items.
+
+    A batch is dispatched as soon as it is full or `max_delay` seconds after its first item arrived, so a lone
+    request waits at most `max_delay` while a burst is processed with one worker round trip per batch.
+    """
+
+    def __init__(self, batch_fn, executor, max_batch: int = 8, max_delay: float = 0.01) -> None:
+        self.batch_fn = batch_fn
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue = None
+        self._task = None
+
+    def start(self) -> None:
+        self.queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future))
+        result = await future
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            asyncio.create_task(self._dispatch(batch))
+
+    async def _dispatch(self, batch: list) -> None:
+        items = [item for item, _ in batch]
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, self.batch_fn, items)
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+class AppState:
+    def __init__(self) -> None:
+        self.ready = False
+        self.warm_pids = []
+        self.process_pool = None
+        self.io_pool = None
+        self.batchers = {}
+        self.search_index = None
+        self.colour_index = None
+        self.feature_stores = {}
+
+
+state = AppState()
+
+
+def _load_feature_stores() -> None:
+    if FEATURE_STORE_PATH:
+        from tasc_core.utils.util_feature_store import LocalFeatureStore
+        state.feature_stores = {
+            'colour': LocalFeatureStore(FEATURE_STORE_PATH, 'kmeans_palette', '1'),
+            'background': LocalFeatureStore(FEATURE_STORE_PATH, 'u2net_cutout', f'2-{BACKGROUND_MATTING}'),
+        }
+
+
+async def _run_model(name: str, data: bytes):
+    """Runs a model through its micro-batcher, serving and recording the result in the feature store if enabled."""
+    with metrics.timer(metrics.STAGE_SECONDS, job="api", stage=name):
+        store = state.feature_stores.get(name)
+        if store is None:
+            return await state.batchers[name].submit(data)
+
+        from tasc_core.utils.util_feature_store import content_hash
+
+        loop = asyncio.get_running_loop()
+        image_hash = content_hash(data)
+        cached = await loop.run_in_executor(state.io_pool, store.get, image_hash)
+        if cached is not None:
+            metrics.inc("tasc_feature_store_hits_total", model=name)
+            return cached
+        result = await state.batchers[name].submit(data)
+        await loop.run_in_executor(state.io_pool, store.put, image_hash, result)
+        return result
+
+
+def _load_indexes() -> None:
+    if SEARCH_INDEX_PATH and os.path.exists(SEARCH_INDEX_PATH):
+        from tasc_core.models.nlp.text_search_index import TextSearchIndex
+        state.search_index = TextSearchIndex.load(SEARCH_INDEX_PATH)
+    if COLOUR_INDEX_PATH and os.path.exists(COLOUR_INDEX_PATH):
+        from tasc_core.models.color_matching.colour_index import ColourIndex
+        state.colour_index = ColourIndex.load(COLOUR_INDEX_PATH)
+        state.colour_index.build()
+
+
+async def _warm_up() -> None:
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(state.io_pool, _load_indexes)
+        await loop.run_in_executor(state.io_pool, _load_feature_stores)
+        warmups = [loop.run_in_executor(state.process_pool, _warmup_worker) for _ in range(MODEL_WORKERS)]
+        state.warm_pids = sorted(set(await asyncio.gather(*warmups)))
+        if len(state.warm_pids) != MODEL_WORKERS:
+            raise RuntimeError(f"only {len(state.warm_pids)} of {MODEL_WORKERS} workers reported ready")
+        state.ready = True
+    except Exception as e:
+        print(f"Model warm-up failed: {e}")
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    context = multiprocessing.get_context()
+    state.process_pool = ProcessPoolExecutor(max_workers=MODEL_WORKERS, mp_context=context, initializer=_init_worker,
+                                             initargs=(WARM_MODELS, context.Barrier(MODEL_WORKERS)))
+    state.io_pool = ThreadPoolExecutor(max_workers=16)
+    state.batchers = {
+        'colour': MicroBatcher(_extract_colours_batch, state.process_pool),
+        'background': MicroBatcher(_remove_background_batch, state.process_pool, max_batch=4),
+    }
+    for batcher in state.batchers.values():
+        batcher.start()
+    warm_up = asyncio.create_task(_warm_up())
+    yield
+    warm_up.cancel()
+    for batcher in state.batchers.values():
+        await batcher.stop()
+    state.process_pool.shutdown(cancel_futures=True)
+    state.io_pool.shutdown()
+
+
+app = FastAPI(title="tasc_core", lifespan=lifespan)
+
+
+async def _fetch_image(image_url: str) -> bytes:
+    def _get():
+        return get_transport().fetch_bytes(image_url, target="image")
+    try:
+        return await asyncio.get_running_loop().run_in_executor(state.io_pool, _get)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Could not fetch image: {e}")
+
+
+def _require_ready() -> None:
+    if not state.ready:
+        raise HTTPException(status_code=503, detail="Models are still loading")
+
+
+class ImageRequest(BaseModel):
+    image_url: str
+
+
+class MatchRequest(BaseModel):
+    colours: list
+    max_delta_e: float = 10.0
+    k: int = 20
+
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    body = {"ready": state.ready, "workers": state.warm_pids, "models": WARM_MODELS,
+            "search_index": state.search_index is not None, "colour_index": state.colour_index is not None}
+    return JSONResponse(body, status_code=200 if state.ready else 503)
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    if not metrics.is_enabled():
+        raise HTTPException(status_code=404, detail="Metrics are disabled, set TASC_METRICS=1")
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/colours")
+async def extract_colours(request: ImageRequest):
+    _require_ready()
+    data = await _fetch_image(request.image_url)
+    try:
+        colours = await _run_model('colour', data)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"image_url": request.image_url, "colours": colours}
+
+
+@app.post("/remove-background")
+async def remove_background(request: ImageRequest):
+    _require_ready()
+    data = await _fetch_image(request.image_url)
+    try:
+        png = await _run_model('background', data)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"image_url": request.image_url, "image_png_base64": base64.b64encode(png).decode("ascii")}
+
+
+@app.get("/search")
+async def search(q: str, k: int = 10, vendor: str = None, product_type: str = None, size: str = None):
+    if state.search_index is None:
+        raise HTTPException(status_code=503, detail="Search index not loaded")
+    hits = state.search_index.search(q, k=k, vendor=vendor, product_type=product_type, size=size)
+    return {"query": q, "results": [{"parent_product_id": pid, "score": score} for pid, score in hits]}
+
+
+@app.post("/match")
+async def match_colours(request: MatchRequest):
+    """Finds products with a palette colour within max_delta_e (CIEDE2000) of each requested colour."""
+    if not request.colours:
+        raise HTTPException(status_code=422, detail="colours must not be empty")
+    if state.colour_index is None:
+        raise HTTPException(status_code=503, detail="Colour index not loaded")
+    names, _ = state.colour_index.name_colours(request.colours)
+    matches = state.colour_index.query_radius(request.colours, max_delta_e=request.max_delta_e)
+    return {"results": [
+        {"colour": colour, "name": name,
+         "products": [{"product_id": pid, "delta_e": de} for pid, de in hits[:request.k]]}
+        for colour, name, hits in zip(request.colours, names, matches)
+    ]}